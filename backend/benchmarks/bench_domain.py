@@ -0,0 +1,163 @@
+"""
+bench_domain.py
+===============
+
+Compare the Pydantic odds pipeline with the slotted ``domain`` models.
+
+For 10k odds rows (synthetic TheOddsAPI payload) it measures, for the parse →
+filter → persist-document stages:
+
+* wall time,
+* allocated memory blocks still alive at the end of the stage (tracemalloc),
+* peak traced memory.
+
+Run from the ``backend`` directory::
+
+    python -m benchmarks.bench_domain
+
+"""
+
+from __future__ import annotations
+
+import gc
+import random
+import time
+import tracemalloc
+import uuid
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from pydantic import BaseModel, Field
+
+from domain import parse_games
+
+ROWS = 10_000
+BOOKMAKERS = [f"Bookmaker {i}" for i in range(10)]
+
+
+class LegacyOddsData(BaseModel):
+    """Copy of the original ``OddsData`` API model, used as the baseline."""
+
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    event_id: Optional[str] = None
+    sport: str
+    sport_name: str
+    league: Optional[str] = None
+    home_team: str
+    away_team: str
+    commence_time: str
+    bookmaker: str
+    home_odds: float = 0
+    away_odds: float = 0
+    draw_odds: Optional[float] = None
+    spread_home: Optional[float] = None
+    spread_away: Optional[float] = None
+    total_over: Optional[float] = None
+    total_under: Optional[float] = None
+    fetched_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+def synthetic_payload(rows: int = ROWS, seed: int = 7) -> List[Dict[str, Any]]:
+    rng = random.Random(seed)
+    games = []
+    for g in range(rows // len(BOOKMAKERS)):
+        home, away = f"Home {g % 40}", f"Away {g % 37}"
+        bookmakers = []
+        for title in BOOKMAKERS:
+            bookmakers.append({
+                "title": title,
+                "markets": [
+                    {"key": "h2h", "outcomes": [
+                        {"name": home, "price": round(rng.uniform(1.2, 5), 2)},
+                        {"name": away, "price": round(rng.uniform(1.2, 5), 2)},
+                        {"name": "Draw", "price": round(rng.uniform(2.8, 4), 2)},
+                    ]},
+                    {"key": "totals", "outcomes": [
+                        {"name": "Over", "price": 1.9, "point": 2.5},
+                        {"name": "Under", "price": 1.9, "point": 2.5},
+                    ]},
+                ],
+            })
+        games.append({
+            "id": f"event-{g}",
+            "home_team": home,
+            "away_team": away,
+            "commence_time": "2026-10-20T18:00:00Z",
+            "bookmakers": bookmakers,
+        })
+    return games
+
+
+def legacy_pipeline(games: List[Dict[str, Any]]):
+    rows = []
+    for game in games:
+        for bookmaker in game["bookmakers"]:
+            entry = LegacyOddsData(
+                event_id=game["id"], sport="soccer", sport_name="Fútbol", league="soccer_epl",
+                home_team=game["home_team"], away_team=game["away_team"],
+                commence_time=game["commence_time"], bookmaker=bookmaker["title"],
+            )
+            for market in bookmaker["markets"]:
+                if market["key"] == "h2h":
+                    outcomes = {o["name"]: o["price"] for o in market["outcomes"]}
+                    entry.home_odds = outcomes.get(game["home_team"], 0)
+                    entry.away_odds = outcomes.get(game["away_team"], 0)
+                    entry.draw_odds = outcomes.get("Draw")
+                elif market["key"] == "totals":
+                    for o in market["outcomes"]:
+                        if o["name"] == "Over":
+                            entry.total_over = o["price"]
+                        elif o["name"] == "Under":
+                            entry.total_under = o["price"]
+            rows.append(entry)
+    candidates = []
+    for row in rows:
+        for selection, odds in (("local", row.home_odds), ("visitante", row.away_odds), ("empate", row.draw_odds)):
+            if odds and odds >= 1.5:
+                candidates.append({"home_team": row.home_team, "away_team": row.away_team,
+                                   "selection": selection, "odds": odds, "sport": row.sport})
+    documents = [row.model_dump() for row in rows]
+    return rows, candidates, documents
+
+
+def domain_pipeline(games: List[Dict[str, Any]]):
+    rows = parse_games(games, "soccer", "Fútbol", "soccer_epl", datetime.utcnow())
+    candidates = [candidate for row in rows for candidate in row.candidates(min_odds=1.5)]
+    documents = [row.to_document() for row in rows]
+    return rows, candidates, documents
+
+
+def measure(name: str, pipeline: Callable, games: List[Dict[str, Any]]) -> Dict[str, Any]:
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    started = time.perf_counter()
+    result = pipeline(games)
+    elapsed = time.perf_counter() - started
+    after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename"))
+    del result
+    return {"name": name, "ms": elapsed * 1000, "blocks": blocks, "peak_kib": peak / 1024}
+
+
+def main() -> None:
+    games = synthetic_payload()
+    # warm up both paths (imports, validators)
+    legacy_pipeline(games[:10])
+    domain_pipeline(games[:10])
+    # time without tracemalloc overhead, then count allocations separately
+    for name, pipeline in (("pydantic", legacy_pipeline), ("domain", domain_pipeline)):
+        started = time.perf_counter()
+        pipeline(games)
+        wall = (time.perf_counter() - started) * 1000
+        stats = measure(name, pipeline, games)
+        print(
+            f"{name:>9}: {wall:8.1f} ms / {ROWS} rows | "
+            f"{stats['blocks']:>8} blocks allocated | peak {stats['peak_kib']:9.0f} KiB"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+bench_kelly.py
+==============
+
+Time the fractional-Kelly portfolio optimizer on a synthetic slate.
+
+The slate has 80 matches with up to three 1X2 singles each (mutually
+exclusive within a match) plus a handful of three-leg parlays, 200 bets in
+total, priced around the model probabilities so that part of the slate has
+positive EV.  It reports the median wall time of :func:`optimize_stakes`
+(scenario generation included) and the solver iterations.
+
+Run from the ``backend`` directory::
+
+    python -m benchmarks.bench_kelly
+
+"""
+
+from __future__ import annotations
+
+import statistics
+import time
+from typing import Any, Dict, List
+
+import numpy as np
+
+from kelly_portfolio import optimize_stakes
+
+BETS = 200
+SELECTIONS = ("local", "empate", "visitante")
+
+
+def synthetic_slate(bets: int = BETS, seed: int = 0) -> List[Dict[str, Any]]:
+    rng = np.random.default_rng(seed)
+    singles: List[Dict[str, Any]] = []
+    match = 0
+    while len(singles) < bets - 20:
+        probabilities = rng.dirichlet([4, 3, 3])
+        for k, selection in enumerate(SELECTIONS):
+            singles.append({
+                "id": f"m{match}:{selection}",
+                "event_id": f"m{match}",
+                "selection": selection,
+                "odds": round(float(rng.uniform(0.9, 1.15) / probabilities[k]), 2),
+                "probability": float(probabilities[k]),
+            })
+        match += 1
+    singles = singles[: bets - 20]
+    parlays = []
+    while len(parlays) < bets - len(singles):
+        legs = [singles[i] for i in rng.choice(len(singles), 3, replace=False)]
+        if len({leg["event_id"] for leg in legs}) < 3:
+            continue
+        parlays.append({
+            "id": f"parlay{len(parlays)}",
+            "odds": round(float(np.prod([leg["odds"] for leg in legs])), 2),
+            "legs": legs,
+        })
+    return singles + parlays
+
+
+def main() -> None:
+    slate = synthetic_slate()
+    optimize_stakes(slate, bankroll=1000, seed=1)  # warm up BLAS
+    timings = []
+    for seed in range(10):
+        started = time.perf_counter()
+        result = optimize_stakes(slate, bankroll=1000, seed=seed)
+        timings.append((time.perf_counter() - started) * 1000)
+    staked = sum(1 for bet in result["stakes"] if bet["stake"] > 0)
+    print(
+        f"{len(slate)} bets: median {statistics.median(timings):.1f} ms, max {max(timings):.1f} ms | "
+        f"{result['iterations']} iterations | {staked} bets staked, total {result['total_stake']:.2f}"
+    )
+
+
+if __name__ == "__main__":
+    main()
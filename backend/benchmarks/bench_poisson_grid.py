@@ -0,0 +1,81 @@
+"""
+bench_poisson_grid.py
+=====================
+
+Compare the precomputed Poisson grid with the exact computations.
+
+For 200k random ``(lambda_home, lambda_away)`` pairs inside the grid it
+reports:
+
+* the largest absolute error of every market against
+  :func:`poisson_grid.exact_markets`, next to the grid's own error bound;
+* time per call of the scalar 1X2 drop-in against
+  :func:`tipstars_prediction.poisson_probabilities`;
+* time per pair of the batched lookup against the vectorized exact formulas;
+* time to fit one match with :func:`tipstars_prediction.implied_lambdas`.
+
+Run from the ``backend`` directory::
+
+    python -m benchmarks.bench_poisson_grid
+
+"""
+
+from __future__ import annotations
+
+import time
+import timeit
+
+import numpy as np
+
+from poisson_grid import LAMBDA_MAX, LAMBDA_MIN, TOLERANCE, PoissonGrid, default_path, exact_markets
+from tipstars_prediction import implied_lambdas, implied_probabilities, poisson_probabilities
+
+PAIRS = 200_000
+
+
+def per_call(function, number: int) -> float:
+    """Best-of-five seconds per call."""
+    return min(timeit.repeat(function, number=number, repeat=5)) / number
+
+
+def main() -> None:
+    started = time.perf_counter()
+    grid = PoissonGrid.load()
+    print(f"grid {grid.table.shape} from {default_path()} in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    rng = np.random.default_rng(0)
+    lambda_home = rng.uniform(LAMBDA_MIN, LAMBDA_MAX, PAIRS)
+    lambda_away = rng.uniform(LAMBDA_MIN, LAMBDA_MAX, PAIRS)
+    interpolated = grid.lookup(lambda_home, lambda_away)
+    exact = exact_markets(lambda_home, lambda_away)
+    print(f"\n{'market':<10} {'max error':>10} {'bound':>10}   (tolerance {TOLERANCE:.0e})")
+    for market, values in interpolated.items():
+        error = float(np.abs(values - exact[market]).max())
+        print(f"{market:<10} {error:>10.2e} {grid.error_bounds[market]:>10.2e}")
+
+    scalar_exact = per_call(lambda: poisson_probabilities(1.456, 1.103), 200)
+    scalar_grid = per_call(lambda: grid.poisson_probabilities(1.456, 1.103), 20_000)
+    batch_exact = per_call(lambda: exact_markets(lambda_home, lambda_away), 1) / PAIRS
+    batch_grid = per_call(lambda: grid.lookup(lambda_home, lambda_away), 1) / PAIRS
+    batch_grid_1x2 = per_call(lambda: grid.lookup(lambda_home, lambda_away, ("home", "draw", "away")), 1) / PAIRS
+    probabilities = implied_probabilities({"home": 2.1, "draw": 3.4, "away": 3.6})
+    fit_exact = per_call(lambda: implied_lambdas(probabilities), 1)
+    fit_grid = per_call(lambda: implied_lambdas(probabilities, grid=grid), 10)
+
+    print(f"\n{'':<28} {'exact':>10} {'grid':>10} {'speed-up':>9}")
+    rows = [
+        ("1X2, one call", scalar_exact, scalar_grid, "us"),
+        ("all markets, per pair", batch_exact, batch_grid, "ns"),
+        ("1X2 only, per pair", batch_exact, batch_grid_1x2, "ns"),
+        ("implied_lambdas, one match", fit_exact, fit_grid, "ms"),
+    ]
+    scale = {"us": 1e6, "ns": 1e9, "ms": 1e3}
+    for label, baseline, candidate, unit in rows:
+        print(
+            f"{label:<28} {baseline * scale[unit]:>7.1f} {unit} {candidate * scale[unit]:>7.1f} {unit} "
+            f"{baseline / candidate:>8.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,318 @@
+"""
+candidate_pool.py
+=================
+
+Array-backed candidate selection for parlay generation.
+
+The latest odds document per ``(event, bookmaker)`` for all requested sports
+is fetched with a single aggregation (``$in`` on sport, newest first,
+``$group`` keeping the first document) and turned into a
+:class:`CandidatePool`: parallel NumPy columns with one entry per priced
+1X2 selection, sorted by odds.
+
+* Odds bands (e.g. ``1.8 <= odds <= 3.5``) are located with
+  ``np.searchsorted`` on the sorted odds column – O(log n).
+* Sport, league, selection type and model EV filters are boolean masks over
+  the band.
+* Sampling can draw from a preferred subset (e.g. the user's leagues) first
+  and complete the parlay from the rest of the band.
+* The model EV of a selection is ``p * odds - 1`` where ``p`` comes from the
+  sport's pricing model (:mod:`sport_models`), calibrated to the margin-free
+  consensus of every bookmaker pricing the event – moneyline, spread line and
+  totals (see :func:`tipstars_prediction.implied_probabilities`).  Events the
+  model cannot price keep the consensus probability.
+
+Example usage::
+
+    docs = await latest_odds_documents(db.odds_data, ["soccer", "basketball"])
+    pool = build_pool(docs)
+    band = pool.select(1.8, 3.5, min_ev=0.0)
+    picks = pool.sample(band, 3, preferred=pool.select(1.8, 3.5, leagues=["soccer_epl"], min_ev=0.0))
+    bets = [pool.candidate(i) for i in picks]
+
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+from pymongo import ASCENDING, DESCENDING
+
+from domain import BetCandidate
+from sport_models import MODELS, EventMarkets, ModelRegistry
+
+SELECTIONS = ("local", "visitante", "empate")
+PRICE_FIELDS = ("home_odds", "away_odds", "draw_odds")
+LINE_FIELDS = ("spread_home", "total_line", "total_over", "total_under")
+
+# odds rows older than this are ignored when building candidates
+LOOKBACK = timedelta(hours=48)
+
+_default_rng = np.random.default_rng()
+
+
+async def ensure_indexes(collection) -> None:
+    await collection.create_index(
+        [("sport", ASCENDING), ("fetched_at", DESCENDING)], name="sport_fetched_at"
+    )
+
+
+async def latest_odds_documents(
+    collection, sports: Sequence[str], now: Optional[datetime] = None
+) -> List[Dict[str, Any]]:
+    """Latest odds document per ``(event, bookmaker)`` for upcoming events of ``sports``."""
+    now = now or datetime.utcnow()
+    pipeline = [
+        {
+            "$match": {
+                "sport": {"$in": list(sports)},
+                "fetched_at": {"$gte": now - LOOKBACK},
+                "commence_time": {"$gt": now.strftime("%Y-%m-%dT%H:%M:%SZ")},
+            }
+        },
+        {"$sort": {"fetched_at": -1}},
+        {
+            "$group": {
+                "_id": {"event": {"$ifNull": ["$event_id", {"$concat": ["$home_team", "|", "$away_team"]}]}, "bookmaker": "$bookmaker"},
+                "doc": {"$first": "$$ROOT"},
+            }
+        },
+        {"$replaceRoot": {"newRoot": "$doc"}},
+        {"$project": {"_id": 0, "fetched_at": 0, "spread_away": 0}},
+    ]
+    return await collection.aggregate(pipeline, allowDiskUse=True).to_list(None)
+
+
+@dataclass(slots=True)
+class CandidatePool:
+    """Column store of 1X2 selections sorted by odds."""
+
+    odds: np.ndarray  # float64, ascending
+    ev: np.ndarray  # float64, model expected value per unit stake
+    probability: np.ndarray  # float64, consensus probability
+    sport: np.ndarray  # int16 codes into ``sports``
+    league: np.ndarray  # int16 codes into ``leagues``
+    selection: np.ndarray  # int8 codes into ``SELECTIONS``
+    event: np.ndarray  # int32 codes, one per event
+    row: np.ndarray  # int32 index into ``docs``
+    sports: List[str]
+    leagues: List[Optional[str]]
+    docs: List[Dict[str, Any]]
+
+    def __len__(self) -> int:
+        return len(self.odds)
+
+    def band(self, low: float, high: float = np.inf) -> slice:
+        """Positions of the selections with ``low <= odds <= high``."""
+        start = int(np.searchsorted(self.odds, low, side="left"))
+        stop = int(np.searchsorted(self.odds, high, side="right"))
+        return slice(start, stop)
+
+    def select(
+        self,
+        low: float,
+        high: float = np.inf,
+        sports: Optional[Sequence[str]] = None,
+        leagues: Optional[Sequence[str]] = None,
+        selections: Optional[Sequence[str]] = None,
+        min_ev: Optional[float] = None,
+    ) -> np.ndarray:
+        """Positions inside an odds band that pass the optional column filters."""
+        window = self.band(low, high)
+        positions = np.arange(window.start, window.stop)
+        mask = np.ones(len(positions), dtype=bool)
+        if sports is not None:
+            codes = [self.sports.index(sport) for sport in sports if sport in self.sports]
+            mask &= np.isin(self.sport[window], codes)
+        if leagues is not None:
+            codes = [self.leagues.index(league) for league in leagues if league in self.leagues]
+            mask &= np.isin(self.league[window], codes)
+        if selections is not None:
+            mask &= np.isin(self.selection[window], [SELECTIONS.index(s) for s in selections])
+        if min_ev is not None:
+            mask &= self.ev[window] >= min_ev
+        return positions[mask]
+
+    def sample(
+        self,
+        positions: np.ndarray,
+        k: int,
+        rng: Optional[np.random.Generator] = None,
+        preferred: Optional[np.ndarray] = None,
+    ) -> List[int]:
+        """Pick up to ``k`` random positions, at most one per event.
+
+        Positions in ``preferred`` (a subset of ``positions``) are picked
+        first; the rest of ``positions`` only completes the ``k``.
+        """
+        if len(positions) == 0 or k <= 0:
+            return []
+        rng = rng or _default_rng
+        if preferred is not None and len(preferred):
+            picked = self.sample(preferred, k, rng)
+            if len(picked) < k:
+                rest = positions[~np.isin(self.event[positions], self.event[picked])]
+                picked += self.sample(rest, k - len(picked), rng)
+            return picked
+        # oversample so that duplicates of the same event rarely force a full permutation
+        draws = rng.choice(positions, size=min(len(positions), k * 4), replace=False)
+        picked: List[int] = []
+        seen = set()
+        for attempt in range(2):
+            batch = draws if attempt == 0 else rng.permutation(positions)
+            for position in batch:
+                event = int(self.event[position])
+                if event in seen:
+                    continue
+                seen.add(event)
+                picked.append(int(position))
+                if len(picked) == k:
+                    return picked
+        return picked
+
+    def top(self, positions: np.ndarray, k: int, preferred: Optional[np.ndarray] = None) -> List[int]:
+        """The ``k`` positions with the highest model EV (unpriced selections last).
+
+        Positions in ``preferred`` (a subset of ``positions``) rank ahead of
+        the rest.
+        """
+        if len(positions) == 0 or k <= 0:
+            return []
+        if preferred is not None and len(preferred):
+            best = self.top(preferred, k)
+            if len(best) < k:
+                best += self.top(positions[~np.isin(positions, preferred)], k - len(best))
+            return best
+        ev = np.nan_to_num(self.ev[positions], nan=-np.inf)
+        if len(positions) > k:
+            best = np.argpartition(-ev, k - 1)[:k]
+        else:
+            best = np.arange(len(positions))
+        best = best[np.argsort(-ev[best], kind="stable")]
+        return [int(position) for position in positions[best]]
+
+    def probabilities_for(self, legs: Sequence[Dict[str, Any]]) -> List[Optional[float]]:
+        """Model probability of each leg's selection, matched by ``event_id`` (None if not in the pool)."""
+        by_event: Dict[tuple, float] = {}
+        for position in range(len(self.odds)):
+            event_id = self.docs[int(self.row[position])].get("event_id")
+            if event_id and np.isfinite(self.probability[position]) and self.probability[position] > 0:
+                by_event[(event_id, SELECTIONS[int(self.selection[position])])] = float(self.probability[position])
+        return [by_event.get((leg.get("event_id"), leg.get("selection"))) for leg in legs]
+
+    def candidate(self, position: int) -> BetCandidate:
+        doc = self.docs[int(self.row[position])]
+        return BetCandidate.from_odds_document(
+            doc, SELECTIONS[int(self.selection[position])], float(self.odds[position])
+        )
+
+
+def _event_mean(values: np.ndarray, event_codes: np.ndarray, n_events: int) -> np.ndarray:
+    """Mean of the finite ``values`` per event, NaN where an event has none."""
+    quoted = np.isfinite(values)
+    totals = np.zeros(n_events)
+    counts = np.zeros(n_events)
+    np.add.at(totals, event_codes[quoted], values[quoted])
+    np.add.at(counts, event_codes[quoted], 1.0)
+    return np.divide(totals, counts, out=np.full(n_events, np.nan), where=counts > 0)
+
+
+def build_pool(docs: List[Dict[str, Any]], models: Optional[ModelRegistry] = None) -> CandidatePool:
+    """Build the column store from odds documents.
+
+    Args:
+        docs: latest odds document per ``(event, bookmaker)``.
+        models: pricing models per sport (``sport_models.MODELS`` by default).
+    """
+    n = len(docs)
+    prices = np.full((n, 3), np.nan)
+    lines = np.full((n, 4), np.nan)  # spread_home, total_line, total_over, total_under
+    sport_codes = np.empty(n, dtype=np.int16)
+    league_codes = np.empty(n, dtype=np.int16)
+    event_codes = np.empty(n, dtype=np.int32)
+    sports: Dict[str, int] = {}
+    leagues: Dict[Optional[str], int] = {}
+    events: Dict[str, int] = {}
+    for i, doc in enumerate(docs):
+        for j, field in enumerate(PRICE_FIELDS):
+            price = doc.get(field)
+            if price:
+                prices[i, j] = price
+        for j, field in enumerate(LINE_FIELDS):
+            value = doc.get(field)
+            if value is not None:
+                lines[i, j] = value
+        sport_codes[i] = sports.setdefault(doc["sport"], len(sports))
+        league_codes[i] = leagues.setdefault(doc.get("league"), len(leagues))
+        event_key = doc.get("event_id") or f"{doc['home_team']}|{doc['away_team']}|{doc.get('commence_time')}"
+        event_codes[i] = events.setdefault(event_key, len(events))
+
+    valid = prices > 1.0
+    implied = np.where(valid, 1.0 / np.where(valid, prices, 1.0), 0.0)
+    # a row can only be de-margined when at least two outcomes are priced
+    complete = valid.sum(axis=1) >= 2
+    overround = implied.sum(axis=1, keepdims=True)
+    fair = np.divide(implied, overround, out=np.zeros_like(implied), where=overround > 0)
+    fair[~complete] = 0.0
+
+    # consensus probability per (event, outcome): mean of the bookmakers' fair probabilities
+    n_events = len(events)
+    totals = np.zeros((n_events, 3))
+    counts = np.zeros((n_events, 3))
+    np.add.at(totals, event_codes, fair)
+    np.add.at(counts, event_codes, (fair > 0).astype(float))
+    consensus = np.divide(totals, counts, out=np.zeros_like(totals), where=counts > 0)
+
+    # one pass through the sport models for every event of every sport
+    first_row = np.zeros(n_events, dtype=np.int64)
+    first_row[event_codes[::-1]] = np.arange(n)[::-1]
+    over_prices = lines[:, 2:]
+    over_fair = (1.0 / over_prices[:, 0]) / (1.0 / over_prices[:, 0] + 1.0 / over_prices[:, 1])
+    quoted = np.where(counts > 0, consensus, np.nan)
+    markets = EventMarkets.from_consensus(
+        home=quoted[:, 0],
+        away=quoted[:, 1],
+        draw=quoted[:, 2],
+        spread=_event_mean(lines[:, 0], event_codes, n_events),
+        total=_event_mean(lines[:, 1], event_codes, n_events),
+        over=_event_mean(over_fair, event_codes, n_events),
+        home_team=[docs[i]["home_team"] for i in first_row],
+        away_team=[docs[i]["away_team"] for i in first_row],
+        league=[docs[i].get("league") for i in first_row],
+    )
+    modelled = (models or MODELS).price(markets, [docs[i]["sport"] for i in first_row])
+    missing = np.full(n_events, np.nan)
+    model_probability = np.column_stack([modelled.get(name, missing) for name in ("home", "away", "draw")])
+    consensus = np.where(np.isfinite(model_probability), model_probability, consensus)
+
+    rows, cols = np.nonzero(valid)
+    odds = prices[rows, cols]
+    probability = consensus[event_codes[rows], cols]
+    ev = np.where(probability > 0, probability * odds - 1.0, np.nan)
+
+    order = np.argsort(odds, kind="stable")
+    return CandidatePool(
+        odds=odds[order],
+        ev=ev[order],
+        probability=probability[order],
+        sport=sport_codes[rows][order],
+        league=league_codes[rows][order],
+        selection=cols.astype(np.int8)[order],
+        event=event_codes[rows][order],
+        row=rows.astype(np.int32)[order],
+        sports=list(sports),
+        leagues=list(leagues),
+        docs=docs,
+    )
+
+
+__all__ = [
+    "CandidatePool",
+    "SELECTIONS",
+    "build_pool",
+    "ensure_indexes",
+    "latest_odds_documents",
+]
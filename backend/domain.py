@@ -0,0 +1,274 @@
+"""
+domain.py
+=========
+
+Lightweight internal representations for the odds → candidates → parlay
+pipeline.
+
+The Pydantic models in ``server.py`` describe the public API.  Building one
+of them per odds row (each with a fresh ``uuid4`` string and ``datetime``),
+mutating it field by field and then calling ``.dict()`` dominates the cost of
+the hot path.  The classes here are slotted dataclasses instead:
+
+* no per-instance ``__dict__``; repeated strings (sport, league, bookmaker,
+  team names, kick-off times) are interned so thousands of rows share them;
+* ids are generated lazily, only when :meth:`OddsRow.to_document` is called
+  to persist or serialise a record;
+* conversion to plain dicts happens once, at the storage / API boundary.
+
+Example usage::
+
+    rows = parse_games(payload, "soccer", "Fútbol", "soccer_epl", datetime.utcnow())
+    candidates = [c for row in rows for c in row.candidates(min_odds=1.5)]
+    documents = [row.to_document() for row in rows]
+
+See ``benchmarks/bench_domain.py`` for a comparison against the Pydantic path.
+"""
+
+from __future__ import annotations
+
+import sys
+import uuid
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+_intern = sys.intern
+
+
+def _new_id() -> str:
+    return str(uuid.uuid4())
+
+
+@dataclass(slots=True)
+class OddsRow:
+    """Prices of one bookmaker for one game (all markets merged)."""
+
+    event_id: Optional[str]
+    sport: str
+    sport_name: str
+    league: Optional[str]
+    home_team: str
+    away_team: str
+    commence_time: str
+    bookmaker: str
+    fetched_at: datetime
+    home_odds: float = 0.0
+    away_odds: float = 0.0
+    draw_odds: Optional[float] = None
+    spread_home: Optional[float] = None
+    spread_away: Optional[float] = None
+    total_over: Optional[float] = None
+    total_under: Optional[float] = None
+    total_line: Optional[float] = None
+    id: Optional[str] = None
+
+    def to_document(self) -> Dict[str, Any]:
+        """Return the stored odds document (``odds_data``), assigning an id on first use."""
+        if self.id is None:
+            self.id = _new_id()
+        return {
+            "id": self.id,
+            "event_id": self.event_id,
+            "sport": self.sport,
+            "sport_name": self.sport_name,
+            "league": self.league,
+            "home_team": self.home_team,
+            "away_team": self.away_team,
+            "commence_time": self.commence_time,
+            "bookmaker": self.bookmaker,
+            "home_odds": self.home_odds,
+            "away_odds": self.away_odds,
+            "draw_odds": self.draw_odds,
+            "spread_home": self.spread_home,
+            "spread_away": self.spread_away,
+            "total_over": self.total_over,
+            "total_under": self.total_under,
+            "total_line": self.total_line,
+            "fetched_at": self.fetched_at,
+        }
+
+    def candidates(self, min_odds: float) -> Iterator["BetCandidate"]:
+        """Yield the 1X2 selections of this row priced at or above ``min_odds``."""
+        for selection, odds in (("local", self.home_odds), ("visitante", self.away_odds), ("empate", self.draw_odds)):
+            if odds and odds >= min_odds:
+                yield BetCandidate(
+                    self.home_team,
+                    self.away_team,
+                    selection,
+                    odds,
+                    self.sport,
+                    self.sport_name,
+                    self.event_id,
+                    self.league,
+                    self.bookmaker,
+                    self.commence_time,
+                )
+
+
+@dataclass(slots=True)
+class BetCandidate:
+    """A single selection eligible for a parlay."""
+
+    home_team: str
+    away_team: str
+    selection: str  # local, visitante, empate
+    odds: float
+    sport: str
+    sport_name: str
+    event_id: Optional[str] = None
+    league: Optional[str] = None
+    bookmaker: Optional[str] = None
+    commence_time: Optional[str] = None
+
+    @classmethod
+    def from_odds_document(cls, doc: Dict[str, Any], selection: str, odds: float) -> "BetCandidate":
+        return cls(
+            _intern(doc["home_team"]),
+            _intern(doc["away_team"]),
+            selection,
+            odds,
+            _intern(doc["sport"]),
+            _intern(doc["sport_name"]),
+            doc.get("event_id"),
+            doc.get("league"),
+            doc.get("bookmaker"),
+            doc.get("commence_time"),
+        )
+
+
+@dataclass(slots=True)
+class ParlayLeg:
+    """A candidate picked into a parlay together with its scoring."""
+
+    bet: BetCandidate
+    confidence_score: float
+    reasoning: str
+    id: Optional[str] = None
+
+    def to_document(self) -> Dict[str, Any]:
+        """Return a dict in the ``MockBet`` schema, assigning an id on first use."""
+        if self.id is None:
+            self.id = _new_id()
+        bet = self.bet
+        return {
+            "id": self.id,
+            "home_team": bet.home_team,
+            "away_team": bet.away_team,
+            "selection": bet.selection,
+            "odds": bet.odds,
+            "confidence_score": self.confidence_score,
+            "reasoning": self.reasoning,
+            "sport": bet.sport,
+            "sport_name": bet.sport_name,
+            "event_id": bet.event_id,
+            "league": bet.league,
+            "bookmaker": bet.bookmaker,
+            "commence_time": bet.commence_time,
+        }
+
+
+@dataclass(slots=True)
+class ParlayRecommendation:
+    """One set of parlays, one per risk level."""
+
+    parlays: List[List[ParlayLeg]]
+    risk_levels: List[str]
+    generated_at: datetime
+    stake: float = 10.0
+    id: Optional[str] = None
+
+    def total_odds(self) -> List[float]:
+        totals = []
+        for parlay in self.parlays:
+            total = 1.0
+            for leg in parlay:
+                total *= leg.bet.odds
+            totals.append(round(total, 2))
+        return totals
+
+    def to_document(self) -> Dict[str, Any]:
+        """Return a dict in the ``MockParlayRecommendation`` schema."""
+        if self.id is None:
+            self.id = _new_id()
+        total_odds = self.total_odds()
+        return {
+            "id": self.id,
+            "parlays": [[leg.to_document() for leg in parlay] for parlay in self.parlays],
+            "total_odds": total_odds,
+            "risk_levels": self.risk_levels,
+            "potential_payouts": [round(total * self.stake, 2) for total in total_odds],
+            "generated_at": self.generated_at,
+        }
+
+
+def parse_game(
+    game: Dict[str, Any], sport: str, sport_name: str, league: Optional[str], fetched_at: datetime
+) -> Iterator[OddsRow]:
+    """Yield one :class:`OddsRow` per bookmaker of a TheOddsAPI game payload.
+
+    The ``h2h``, ``spreads`` and ``totals`` markets of a bookmaker are merged
+    into the same row.  Rows without any moneyline price are skipped.
+    """
+    home_team = _intern(game["home_team"])
+    away_team = _intern(game["away_team"])
+    commence_time = _intern(game["commence_time"])
+    event_id = game.get("id")
+    for bookmaker in game.get("bookmakers", []):
+        row = OddsRow(
+            event_id,
+            sport,
+            sport_name,
+            league,
+            home_team,
+            away_team,
+            commence_time,
+            _intern(bookmaker["title"]),
+            fetched_at,
+        )
+        for market in bookmaker.get("markets", []):
+            key = market["key"]
+            if key == "h2h":
+                for outcome in market["outcomes"]:
+                    name = outcome["name"]
+                    if name == home_team:
+                        row.home_odds = outcome["price"]
+                    elif name == away_team:
+                        row.away_odds = outcome["price"]
+                    elif name == "Draw":
+                        row.draw_odds = outcome["price"]
+            elif key == "spreads":
+                for outcome in market["outcomes"]:
+                    if outcome["name"] == home_team:
+                        row.spread_home = outcome.get("point")
+                    elif outcome["name"] == away_team:
+                        row.spread_away = outcome.get("point")
+            elif key == "totals":
+                for outcome in market["outcomes"]:
+                    if outcome["name"] == "Over":
+                        row.total_over = outcome["price"]
+                        row.total_line = outcome.get("point")
+                    elif outcome["name"] == "Under":
+                        row.total_under = outcome["price"]
+        if row.home_odds > 0 or row.away_odds > 0:
+            yield row
+
+
+def parse_games(
+    games: Iterable[Dict[str, Any]], sport: str, sport_name: str, league: Optional[str], fetched_at: datetime
+) -> List[OddsRow]:
+    """Parse a full TheOddsAPI odds response into :class:`OddsRow` objects."""
+    sport = _intern(sport)
+    sport_name = _intern(sport_name)
+    league = _intern(league) if league else None
+    return [row for game in games for row in parse_game(game, sport, sport_name, league, fetched_at)]
+
+
+__all__ = [
+    "OddsRow",
+    "BetCandidate",
+    "ParlayLeg",
+    "ParlayRecommendation",
+    "parse_game",
+    "parse_games",
+]
@@ -0,0 +1,157 @@
+"""
+http_cache.py
+=============
+
+Conditional responses and an in-memory cache of serialized response bodies.
+
+Read endpoints are keyed by ``(route, params, version)`` where *version*
+identifies the data snapshot the response was built from (an odds snapshot
+digest, the sports registry ETag, the newest document of a collection, a
+counter bumped on every write...).  The
+ETag is derived from that key alone, so a poll carrying a matching
+``If-None-Match`` is answered with ``304 Not Modified`` without building the
+body, and a poll without it is served from the cached bytes without touching
+the database.
+
+Versions bumped through :class:`SnapshotVersions` are per process, so they
+only suit data that every worker reloads itself; data written by other
+workers should be versioned from the data (e.g. the newest ``generated_at``).
+Cached entries also expire after ``max_age``.
+
+Example usage::
+
+    versions = SnapshotVersions()
+    cache = ResponseCache()
+
+    @api_router.get("/odds/{sport}")
+    async def get_odds(request: Request, sport: str):
+        return await cache.respond(
+            request, "odds", (sport,), versions.get(f"odds:{sport}"), build_odds, cache_control(15, 30)
+        )
+
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+
+CacheKey = Tuple[str, Tuple[Any, ...], Hashable]
+
+
+def cache_control(max_age: int, stale_while_revalidate: int, public: bool = True) -> str:
+    """Build a ``Cache-Control`` header suitable for CDNs."""
+    scope = "public" if public else "private"
+    return f"{scope}, max-age={max_age}, stale-while-revalidate={stale_while_revalidate}"
+
+
+def make_etag(route: str, params: Tuple[Any, ...], version: Hashable) -> str:
+    """Strong ETag for a response built from ``version`` of the data."""
+    digest = hashlib.sha1(repr((route, params, version)).encode()).hexdigest()[:20]
+    return f'"{digest}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Whether the request's ``If-None-Match`` header covers ``etag``."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    candidates = {candidate.strip().removeprefix("W/") for candidate in header.split(",")}
+    return etag in candidates
+
+
+def encode_json(payload: Any) -> bytes:
+    return json.dumps(jsonable_encoder(payload), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class SnapshotVersions:
+    """Monotonic per-process version counters for data that endpoints depend on."""
+
+    def __init__(self) -> None:
+        self._versions: Dict[str, int] = {}
+
+    def get(self, name: str) -> int:
+        return self._versions.get(name, 0)
+
+    def bump(self, name: str) -> int:
+        self._versions[name] = self._versions.get(name, 0) + 1
+        return self._versions[name]
+
+
+class ResponseCache:
+    """Small LRU cache of serialized JSON bodies."""
+
+    def __init__(self, max_entries: int = 512, max_age: float = 30.0) -> None:
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._entries: "OrderedDict[CacheKey, Tuple[float, bytes]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: CacheKey) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        created, body = entry
+        if time.monotonic() - created > self.max_age:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return body
+
+    def put(self, key: CacheKey, body: bytes) -> None:
+        self._entries[key] = (time.monotonic(), body)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    async def respond(
+        self,
+        request: Request,
+        route: str,
+        params: Tuple[Any, ...],
+        version: Hashable,
+        build: Callable[[], Awaitable[Any]],
+        cache_control_header: str,
+    ) -> Response:
+        """Serve a JSON response for ``(route, params, version)``.
+
+        Returns ``304`` when the client already holds the current ETag,
+        otherwise the cached body, calling ``build`` only on a cache miss.
+        """
+        etag = make_etag(route, params, version)
+        headers = {"ETag": etag, "Cache-Control": cache_control_header}
+        if etag_matches(request, etag):
+            self.hits += 1
+            return Response(status_code=304, headers=headers)
+
+        key = (route, params, version)
+        body = self.get(key)
+        if body is None:
+            self.misses += 1
+            body = encode_json(await build())
+            self.put(key, body)
+        else:
+            self.hits += 1
+        return Response(content=body, media_type="application/json", headers=headers)
+
+
+__all__ = [
+    "ResponseCache",
+    "SnapshotVersions",
+    "cache_control",
+    "encode_json",
+    "etag_matches",
+    "make_etag",
+]
@@ -0,0 +1,289 @@
+"""
+kelly_portfolio.py
+==================
+
+Fractional-Kelly stake optimization for a slate of simultaneous bets.
+
+:func:`tipstars_prediction.select_value_bets` ranks positive-EV outcomes but
+says nothing about how much to stake when several of them are open at the
+same time.  Staking each one with its single-bet Kelly fraction over-bets the
+slate: the three outcomes of one match are mutually exclusive, and a parlay
+shares its legs with the singles on the same matches.
+
+This module maximizes the expected log growth of the bankroll over the joint
+outcome of every match involved:
+
+* Each match is a categorical variable over its outcomes (any probability
+  mass not covered by the bets becomes an implicit "other" outcome).  Matches
+  are independent of each other.
+* ``S`` joint scenarios are drawn with stratified sampling per match and turned
+  into a ``(S, n)`` matrix of per-unit returns (``odds - 1`` or ``-1``), so
+  mutually exclusive selections and parlays are priced consistently.
+* ``max E[log(1 + R g)]`` is concave; it is solved with a primal-dual interior
+  point method over the box/budget set ``0 <= g_i <= cap / c``,
+  ``sum(g) <= total / c``.  Stakes are ``c * g`` for the Kelly fraction ``c``,
+  so the caps hold exactly on the returned stakes.
+
+A slate of 200 bets with 2,000 scenarios is optimized in about 50 ms
+(``python -m benchmarks.bench_kelly``).
+
+Example usage::
+
+    bets = [
+        {"id": "a", "odds": 2.1, "legs": [{"event_id": "m1", "selection": "local", "probability": 0.52}]},
+        {"id": "b", "odds": 3.6, "legs": [{"event_id": "m1", "selection": "empate", "probability": 0.29}]},
+    ]
+    result = optimize_stakes(bets, bankroll=1000, fraction=0.25, max_bet_share=0.05)
+    result["stakes"]
+
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+# probability mass above 1 per match that is tolerated (and normalised away)
+PROBABILITY_SLACK = 0.02
+
+
+@dataclass(slots=True)
+class Slate:
+    """Bets compiled into index arrays over a set of categorical matches."""
+
+    ids: List[str]
+    odds: np.ndarray  # (n,)
+    leg_event: np.ndarray  # (n, L) event column per leg, padded with the dummy event
+    leg_outcome: np.ndarray  # (n, L) outcome code per leg, padded with 0
+    cumulative: np.ndarray  # (E + 1, K) cumulative outcome probabilities per event
+    probability: np.ndarray  # (n,) model probability of each bet, legs independent
+
+
+def _normalize_bet(bet: Dict[str, Any]) -> Tuple[str, float, List[Dict[str, Any]]]:
+    legs = bet.get("legs") or [bet]
+    return str(bet.get("id", "")), float(bet["odds"]), legs
+
+
+def compile_slate(bets: List[Dict[str, Any]]) -> Slate:
+    """Group the legs of ``bets`` by match and build the outcome tables.
+
+    Raises:
+        ValueError: on missing probabilities, odds <= 1 or inconsistent
+            probabilities for the same selection.
+    """
+    events: Dict[str, Dict[str, float]] = {}
+    compiled = []
+    for index, bet in enumerate(bets):
+        bet_id, odds, legs = _normalize_bet(bet)
+        if odds <= 1.0:
+            raise ValueError(f"Cuota inválida en la apuesta {bet_id or index}")
+        keys = []
+        for leg in legs:
+            event = str(leg.get("event_id") or f"{leg.get('home_team')}|{leg.get('away_team')}")
+            selection = str(leg["selection"])
+            probability = leg.get("probability")
+            if probability is None or not 0.0 < float(probability) < 1.0:
+                raise ValueError(f"Probabilidad del modelo inválida para {event}:{selection}")
+            outcomes = events.setdefault(event, {})
+            previous = outcomes.setdefault(selection, float(probability))
+            if abs(previous - float(probability)) > 1e-6:
+                raise ValueError(f"Probabilidades distintas para la misma selección {event}:{selection}")
+            keys.append((event, selection))
+        compiled.append((bet_id or str(index), odds, keys))
+
+    event_index = {event: i for i, event in enumerate(events)}
+    outcome_index = {event: {sel: k for k, sel in enumerate(outcomes)} for event, outcomes in events.items()}
+    n_outcomes = max(len(outcomes) for outcomes in events.values()) + 1  # + implicit "other"
+    cumulative = np.ones((len(events) + 1, n_outcomes))
+    for event, outcomes in events.items():
+        probs = np.fromiter(outcomes.values(), dtype=float)
+        total = probs.sum()
+        if total > 1.0 + PROBABILITY_SLACK:
+            raise ValueError(f"Las probabilidades del partido {event} suman {total:.2f}")
+        if total > 1.0:
+            probs = probs / total
+        cumulative[event_index[event], : len(probs)] = np.cumsum(probs)
+
+    n_legs = max(len(keys) for _, _, keys in compiled)
+    dummy = len(events)  # always resolves to outcome 0
+    leg_event = np.full((len(compiled), n_legs), dummy, dtype=np.int32)
+    leg_outcome = np.zeros((len(compiled), n_legs), dtype=np.int32)
+    probability = np.ones(len(compiled))
+    for i, (_, _, keys) in enumerate(compiled):
+        for l, (event, selection) in enumerate(keys):
+            leg_event[i, l] = event_index[event]
+            leg_outcome[i, l] = outcome_index[event][selection]
+            probability[i] *= events[event][selection]
+    return Slate(
+        ids=[bet_id for bet_id, _, _ in compiled],
+        odds=np.array([odds for _, odds, _ in compiled]),
+        leg_event=leg_event,
+        leg_outcome=leg_outcome,
+        cumulative=cumulative,
+        probability=probability,
+    )
+
+
+def scenario_returns(slate: Slate, scenarios: int, rng: np.random.Generator) -> np.ndarray:
+    """``(scenarios, n)`` per-unit returns from stratified joint match outcomes."""
+    n_events = slate.cumulative.shape[0]
+    # one stratified uniform per scenario and match: every probability decile is hit evenly
+    strata = rng.permuted(np.tile(np.arange(scenarios), (n_events, 1)), axis=1).T
+    uniforms = (strata + rng.random((scenarios, n_events))) / scenarios
+    outcome = (uniforms[:, :, None] >= slate.cumulative[None, :, :]).sum(axis=2)
+    outcome[:, -1] = 0  # dummy event used to pad short parlays
+    won = np.ones((scenarios, len(slate.odds)), dtype=bool)
+    for l in range(slate.leg_event.shape[1]):
+        won &= outcome[:, slate.leg_event[:, l]] == slate.leg_outcome[:, l]
+    return np.where(won, slate.odds - 1.0, -1.0)
+
+
+def maximize_log_growth(
+    returns: np.ndarray,
+    upper: np.ndarray,
+    budget: float,
+    tolerance: float = 1e-9,
+    max_iterations: int = 100,
+) -> Tuple[np.ndarray, int]:
+    """Maximize ``mean(log(1 + returns @ g))`` s.t. ``0 <= g <= upper``, ``sum(g) <= budget``.
+
+    Primal-dual interior point method.  Each iteration solves one Newton
+    system for the perturbed KKT conditions, which costs a Gram product of
+    the weighted return matrix and a Cholesky solve; a slate converges in a
+    couple of dozen iterations.  Columns with ``upper == 0`` are excluded up
+    front.  ``budget`` must be below 1 so that wealth stays positive in every
+    scenario.
+
+    Returns:
+        The optimal ``g`` and the number of iterations taken.
+    """
+    scenarios, n = returns.shape
+    g_full = np.zeros(n)
+    active = np.flatnonzero(upper > 0)
+    if len(active) == 0:
+        return g_full, 0
+    R = np.ascontiguousarray(returns[:, active])
+    u = upper[active]
+    m = len(active)
+
+    # strictly interior start; duals of g >= 0, g <= u and sum(g) <= budget
+    g = 0.5 * np.minimum(u, budget / (m + 1))
+    z_low = np.full(m, 1e-2)
+    z_up = np.full(m, 1e-2)
+    y = 1e-2
+    iterations = 0
+    for iterations in range(1, max_iterations + 1):
+        wealth = 1.0 + R @ g
+        grad = -(R.T @ (1.0 / wealth)) / scenarios
+        gap_up = u - g
+        slack = budget - g.sum()
+        residual = grad - z_low + z_up + y
+        mu = (g @ z_low + gap_up @ z_up + slack * y) / (2 * m + 1)
+        if mu < tolerance / (2 * m + 1) and float(np.abs(residual).max()) < tolerance:
+            break
+
+        target = 0.1 * mu
+        weighted = R / wealth[:, None]
+        hessian = weighted.T @ weighted / scenarios
+        hessian[np.diag_indices(m)] += z_low / g + z_up / gap_up
+        hessian += y / slack
+        rhs = -(grad - target / g + target / gap_up + target / slack)
+        dg = np.linalg.solve(hessian, rhs)
+        dz_low = (target - g * z_low - z_low * dg) / g
+        dz_up = (target - gap_up * z_up + z_up * dg) / gap_up
+        dy = (target - slack * y + y * dg.sum()) / slack
+
+        # fraction to the boundary, separately for primal and dual variables
+        step_primal = 1.0
+        for value, change in ((g, dg), (gap_up, -dg), (np.array([slack]), np.array([-dg.sum()]))):
+            shrinking = change < 0
+            if shrinking.any():
+                step_primal = min(step_primal, 0.995 * float((-value[shrinking] / change[shrinking]).min()))
+        step_dual = 1.0
+        for value, change in ((z_low, dz_low), (z_up, dz_up), (np.array([y]), np.array([dy]))):
+            shrinking = change < 0
+            if shrinking.any():
+                step_dual = min(step_dual, 0.995 * float((-value[shrinking] / change[shrinking]).min()))
+        g = g + step_primal * dg
+        z_low = z_low + step_dual * dz_low
+        z_up = z_up + step_dual * dz_up
+        y = y + step_dual * dy
+    g_full[active] = g
+    return g_full, iterations
+
+
+def optimize_stakes(
+    bets: List[Dict[str, Any]],
+    bankroll: float,
+    fraction: float = 0.25,
+    max_bet_share: float = 0.05,
+    max_total_share: float = 0.25,
+    scenarios: int = 2000,
+    seed: Optional[int] = None,
+) -> Dict[str, Any]:
+    """Fractional-Kelly stakes for ``bets`` placed simultaneously.
+
+    Args:
+        bets: singles (``odds``, ``event_id``, ``selection``, ``probability``)
+            or parlays (``odds`` and ``legs`` with those fields); optional ``id``.
+        bankroll: current bankroll.
+        fraction: Kelly fraction ``c`` (1.0 is full Kelly).
+        max_bet_share: cap on each stake as a share of the bankroll.
+        max_total_share: cap on the total staked as a share of the bankroll.
+        scenarios: number of joint scenarios used for the expectation.
+        seed: seed for reproducible scenarios.
+
+    Returns:
+        A dict with the stake per bet, its expected value, the total stake,
+        expected profit and expected log growth of the bankroll.
+    """
+    if not bets:
+        raise ValueError("Se necesita al menos una apuesta")
+    if not 0.0 < fraction <= 1.0:
+        raise ValueError("La fracción de Kelly debe estar entre 0 y 1")
+    if not (0.0 < max_bet_share <= 1.0 and 0.0 < max_total_share <= 1.0) or bankroll <= 0:
+        raise ValueError("Los límites deben estar entre 0 y 1 y el bankroll ser positivo")
+    slate = compile_slate(bets)
+    returns = scenario_returns(slate, scenarios, np.random.default_rng(seed))
+
+    n = len(slate.odds)
+    ev = slate.probability * slate.odds - 1.0
+    # optimise g = f / c, so that the caps hold exactly on f = c * g
+    upper = np.full(n, max_bet_share / fraction)
+    upper[ev <= 0] = 0.0  # never stake a negative-EV bet, even as a hedge
+    budget = min(max_total_share / fraction, 0.999)
+    g, iterations = maximize_log_growth(returns, upper, budget)
+    shares = fraction * g
+    shares[shares < 1e-5] = 0.0
+
+    stakes = np.round(shares * bankroll, 2)
+    growth = float(np.log1p(returns @ shares).mean())
+    return {
+        "stakes": [
+            {
+                "id": bet_id,
+                "odds": float(slate.odds[i]),
+                "probability": float(slate.probability[i]),
+                "expected_value": float(ev[i]),
+                "share": float(shares[i]),
+                "stake": float(stakes[i]),
+            }
+            for i, bet_id in enumerate(slate.ids)
+        ],
+        "total_stake": float(stakes.sum()),
+        "expected_profit": float((shares * ev).sum() * bankroll),
+        "expected_log_growth": growth,
+        "iterations": iterations,
+        "scenarios": scenarios,
+    }
+
+
+__all__ = [
+    "Slate",
+    "compile_slate",
+    "maximize_log_growth",
+    "optimize_stakes",
+    "scenario_returns",
+]
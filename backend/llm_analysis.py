@@ -0,0 +1,413 @@
+"""
+llm_analysis.py
+===============
+
+Cached, rate-limited LLM analysis of bets.
+
+Calling the LLM once per bet is slow and expensive.  :class:`AnalysisService`
+instead:
+
+* deduplicates requests by ``(fixture, selection, price bucket)`` – both
+  within one call and across concurrent calls (in-flight requests are
+  shared);
+* answers from a persistent cache with a TTL (:class:`MongoAnalysisCache`,
+  backed by a MongoDB TTL index) before calling the model;
+* packs the remaining legs into batched prompts of up to ``batch_size`` legs;
+* limits concurrent LLM calls with a semaphore and spending with a
+  tokens-per-minute budget;
+* falls back to model-based reasoning when a call times out, fails, returns
+  unusable output or the budget is exhausted: the leg is priced by its
+  sport's model (:mod:`sport_models`) calibrated to the consensus of every
+  bookmaker, through the optional ``pricer`` (the candidate pool in the
+  server).  Without a consensus only the leg's own de-margined price is
+  known, so no expected value is claimed.  Fallback answers are not cached,
+  so a later call can still get the LLM analysis.
+
+:class:`FakeLlmClient` and :class:`MemoryAnalysisCache` make it possible to
+exercise latency, batching and caching offline.
+
+Example usage::
+
+    service = AnalysisService(FakeLlmClient(latency=0.5), MemoryAnalysisCache())
+    results = await service.analyze([
+        {"event_id": "abc", "home_team": "A", "away_team": "B", "selection": "local", "odds": 2.1},
+    ])
+
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import logging
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterable, List, Optional, Protocol, Tuple
+
+from pymongo import ASCENDING, UpdateOne
+
+from tipstars_prediction import expected_value, fair_odds, implied_probabilities
+
+logger = logging.getLogger(__name__)
+
+SYSTEM_MESSAGE = (
+    "Eres un analista experto en apuestas deportivas. Evalúas selecciones de forma "
+    "objetiva y respondes únicamente con JSON válido."
+)
+
+# width of the price buckets used for deduplication / caching
+PRICE_BUCKET = 0.05
+
+# assumed bookmaker margin when only the selected price is known
+DEFAULT_MARGIN = 0.05
+
+SELECTION_OUTCOMES = {"local": "home", "visitante": "away", "empate": "draw"}
+
+# model probability of each leg (None when the leg's event is unknown to the model)
+Pricer = Callable[[List[Dict[str, Any]]], Awaitable[List[Optional[float]]]]
+
+
+class LlmClient(Protocol):
+    async def complete(self, prompt: str) -> str: ...
+
+
+def price_bucket(odds: float) -> float:
+    return round(round(float(odds) / PRICE_BUCKET) * PRICE_BUCKET, 2)
+
+
+def analysis_key(leg: Dict[str, Any]) -> str:
+    """Deduplication / cache key of a leg: fixture, selection and price bucket."""
+    fixture = leg.get("event_id") or f"{leg.get('home_team')}|{leg.get('away_team')}|{leg.get('commence_time')}"
+    raw = f"{fixture}|{leg.get('selection')}|{price_bucket(leg['odds'])}"
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token estimate (≈4 characters per token)."""
+    return len(text) // 4 + 1
+
+
+def build_prompt(legs: List[Tuple[str, Dict[str, Any]]]) -> str:
+    lines = [
+        "Analiza las siguientes apuestas. Para cada una devuelve un objeto con "
+        '"id", "confidence_score" (0-100) y "reasoning" (una frase en español).',
+        "Responde solo con una lista JSON.",
+        "",
+    ]
+    for key, leg in legs:
+        lines.append(json.dumps({
+            "id": key[:12],
+            "deporte": leg.get("sport"),
+            "partido": f"{leg.get('home_team')} vs {leg.get('away_team')}",
+            "seleccion": leg.get("selection"),
+            "cuota": leg["odds"],
+        }, ensure_ascii=False))
+    return "\n".join(lines)
+
+
+def parse_response(text: str, keys: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+    """Parse the JSON list returned by the model, keyed by full analysis key."""
+    start, end = text.find("["), text.rfind("]")
+    if start < 0 or end < start:
+        raise ValueError("La respuesta del modelo no contiene una lista JSON")
+    items = json.loads(text[start:end + 1])
+    by_prefix = {key[:12]: key for key in keys}
+    parsed = {}
+    for item in items:
+        key = by_prefix.get(str(item.get("id")))
+        if key is None:
+            continue
+        parsed[key] = {
+            "confidence_score": max(0.0, min(100.0, float(item["confidence_score"]))),
+            "reasoning": str(item.get("reasoning", "")).strip(),
+        }
+    return parsed
+
+
+def model_analysis(leg: Dict[str, Any], probability: Optional[float] = None) -> Dict[str, Any]:
+    """Model-based analysis used when the LLM is unavailable.
+
+    Args:
+        leg: the bet.
+        probability: the sport model's probability of the selection,
+            calibrated to the consensus of every bookmaker.  Without it the
+            leg's own prices are de-margined (exactly with the full 1X2,
+            otherwise assuming a standard margin); that only restates the
+            bookmaker's price, so no expected value is reported.
+    """
+    odds = float(leg["odds"])
+    outcome = SELECTION_OUTCOMES.get(leg.get("selection"), "home")
+    if probability is not None:
+        fair = fair_odds({outcome: probability})[outcome]
+        ev = expected_value({outcome: probability}, {outcome: odds})[outcome]
+        return {
+            "confidence_score": round(probability * 100, 1),
+            "reasoning": (
+                f"Modelo de {leg.get('sport') or 'deporte'} calibrado al consenso del mercado: probabilidad "
+                f"{probability:.0%} (cuota justa {fair:.2f}), valor esperado {ev:+.1%} con cuota {odds:.2f}"
+            ),
+        }
+    market = {name: leg.get(f"{name}_odds") for name in ("home", "draw", "away")}
+    # outcomes priced at 1.0 or less carry no information and are dropped by implied_probabilities
+    market = {name: float(price) for name, price in market.items() if price and float(price) > 1.0}
+    if outcome in market and len(market) >= 2:
+        probability = implied_probabilities(market)[outcome]
+    else:
+        probability = 1.0 / (odds * (1.0 + DEFAULT_MARGIN))
+    fair = fair_odds({outcome: probability})[outcome]
+    return {
+        "confidence_score": round(probability * 100, 1),
+        "reasoning": (
+            f"Sin consenso de mercado para este evento: probabilidad de la propia cuota sin margen "
+            f"{probability:.0%} (cuota justa {fair:.2f}); no se estima valor esperado"
+        ),
+    }
+
+
+class MemoryAnalysisCache:
+    """In-process cache with a TTL, for tests and single-worker setups."""
+
+    def __init__(self, ttl: timedelta = timedelta(hours=6)) -> None:
+        self.ttl = ttl
+        self._entries: Dict[str, Tuple[datetime, Dict[str, Any]]] = {}
+
+    async def get_many(self, keys: List[str]) -> Dict[str, Dict[str, Any]]:
+        now = datetime.utcnow()
+        found = {}
+        for key in keys:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                found[key] = entry[1]
+        return found
+
+    async def put_many(self, results: Dict[str, Dict[str, Any]]) -> None:
+        expires_at = datetime.utcnow() + self.ttl
+        for key, result in results.items():
+            self._entries[key] = (expires_at, result)
+
+
+class MongoAnalysisCache:
+    """Persistent cache; MongoDB removes expired entries through a TTL index."""
+
+    def __init__(self, collection, ttl: timedelta = timedelta(hours=6)) -> None:
+        self.collection = collection
+        self.ttl = ttl
+
+    async def ensure_indexes(self) -> None:
+        await self.collection.create_index([("expires_at", ASCENDING)], name="expires_at", expireAfterSeconds=0)
+
+    async def get_many(self, keys: List[str]) -> Dict[str, Dict[str, Any]]:
+        docs = await self.collection.find(
+            {"_id": {"$in": keys}, "expires_at": {"$gt": datetime.utcnow()}}
+        ).to_list(None)
+        return {doc["_id"]: doc["result"] for doc in docs}
+
+    async def put_many(self, results: Dict[str, Dict[str, Any]]) -> None:
+        if not results:
+            return
+        expires_at = datetime.utcnow() + self.ttl
+        await self.collection.bulk_write(
+            [
+                UpdateOne({"_id": key}, {"$set": {"result": result, "expires_at": expires_at}}, upsert=True)
+                for key, result in results.items()
+            ],
+            ordered=False,
+        )
+
+
+class TokenBudget:
+    """Sliding one-minute window of estimated tokens."""
+
+    def __init__(self, tokens_per_minute: int) -> None:
+        self.tokens_per_minute = tokens_per_minute
+        self._spent: Deque[Tuple[float, int]] = deque()
+
+    def try_spend(self, tokens: int) -> bool:
+        now = time.monotonic()
+        while self._spent and now - self._spent[0][0] > 60:
+            self._spent.popleft()
+        if sum(spent for _, spent in self._spent) + tokens > self.tokens_per_minute:
+            return False
+        self._spent.append((now, tokens))
+        return True
+
+
+class EmergentLlmClient:
+    """LLM client backed by ``emergentintegrations``, imported on first use."""
+
+    def __init__(self, api_key: str, provider: str = "openai", model: str = "gpt-4o-mini") -> None:
+        self.api_key = api_key
+        self.provider = provider
+        self.model = model
+
+    async def complete(self, prompt: str) -> str:
+        from emergentintegrations.llm.chat import LlmChat, UserMessage
+
+        chat = LlmChat(
+            api_key=self.api_key, session_id=f"analisis-{uuid.uuid4()}", system_message=SYSTEM_MESSAGE
+        ).with_model(self.provider, self.model)
+        return await chat.send_message(UserMessage(text=prompt))
+
+
+class FakeLlmClient:
+    """Deterministic offline stand-in for the LLM.
+
+    Args:
+        latency: seconds to wait before answering each prompt.
+        fail: raise instead of answering, to exercise the fallback path.
+    """
+
+    def __init__(self, latency: float = 0.0, fail: bool = False) -> None:
+        self.latency = latency
+        self.fail = fail
+        self.calls = 0
+        self.prompts: List[str] = []
+
+    async def complete(self, prompt: str) -> str:
+        self.calls += 1
+        self.prompts.append(prompt)
+        await asyncio.sleep(self.latency)
+        if self.fail:
+            raise RuntimeError("Fallo simulado del LLM")
+        answers = []
+        for line in prompt.splitlines():
+            if not line.startswith("{"):
+                continue
+            item = json.loads(line)
+            answers.append({
+                "id": item["id"],
+                "confidence_score": round(min(95.0, 100.0 / item["cuota"] + 10), 1),
+                "reasoning": f"Análisis simulado de {item['partido']}",
+            })
+        return json.dumps(answers, ensure_ascii=False)
+
+
+@dataclass
+class AnalysisStats:
+    requested: int = 0
+    deduplicated: int = 0
+    cache_hits: int = 0
+    llm_calls: int = 0
+    llm_legs: int = 0
+    fallbacks: int = 0
+
+
+class AnalysisService:
+    """Batching, deduplicating and caching front-end to an :class:`LlmClient`."""
+
+    def __init__(
+        self,
+        client: LlmClient,
+        cache,
+        batch_size: int = 20,
+        max_concurrency: int = 2,
+        tokens_per_minute: int = 60_000,
+        timeout: float = 20.0,
+        output_tokens_per_leg: int = 60,
+        pricer: Optional[Pricer] = None,
+    ) -> None:
+        self.client = client
+        self.pricer = pricer
+        self.cache = cache
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.output_tokens_per_leg = output_tokens_per_leg
+        self.budget = TokenBudget(tokens_per_minute)
+        self.stats = AnalysisStats()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    async def analyze(self, legs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Analyze ``legs``, returning one result per leg in the same order.
+
+        Each result has ``confidence_score``, ``reasoning`` and ``source``
+        (``"cache"``, ``"llm"`` or ``"modelo"``).
+        """
+        self.stats.requested += len(legs)
+        keys = [analysis_key(leg) for leg in legs]
+        unique: Dict[str, Dict[str, Any]] = {}
+        for key, leg in zip(keys, legs):
+            unique.setdefault(key, leg)
+        self.stats.deduplicated += len(legs) - len(unique)
+
+        results: Dict[str, Dict[str, Any]] = {}
+        cached = await self.cache.get_many([key for key in unique if key not in self._inflight])
+        self.stats.cache_hits += len(cached)
+        for key, result in cached.items():
+            results[key] = {**result, "source": "cache"}
+
+        waiting = {key: self._inflight[key] for key in unique if key not in results and key in self._inflight}
+        pending = [(key, leg) for key, leg in unique.items() if key not in results and key not in waiting]
+
+        loop = asyncio.get_running_loop()
+        for key, _ in pending:
+            self._inflight[key] = loop.create_future()
+        try:
+            batches = [pending[i:i + self.batch_size] for i in range(0, len(pending), self.batch_size)]
+            for batch_results in await asyncio.gather(*(self._run_batch(batch) for batch in batches)):
+                results.update(batch_results)
+        finally:
+            for key, _ in pending:
+                future = self._inflight.pop(key)
+                if not future.done():
+                    future.set_result(results.get(key) or {**model_analysis(unique[key]), "source": "modelo"})
+
+        for key, future in waiting.items():
+            results[key] = await future
+        return [results[key] for key in keys]
+
+    async def _run_batch(self, batch: List[Tuple[str, Dict[str, Any]]]) -> Dict[str, Dict[str, Any]]:
+        prompt = build_prompt(batch)
+        tokens = estimate_tokens(prompt) + self.output_tokens_per_leg * len(batch)
+        parsed: Dict[str, Dict[str, Any]] = {}
+        if self.budget.try_spend(tokens):
+            try:
+                async with self._semaphore:
+                    self.stats.llm_calls += 1
+                    text = await asyncio.wait_for(self.client.complete(prompt), timeout=self.timeout)
+                parsed = parse_response(text, [key for key, _ in batch])
+                self.stats.llm_legs += len(parsed)
+                await self.cache.put_many(parsed)
+            except asyncio.TimeoutError:
+                logger.warning(f"Tiempo de espera agotado analizando {len(batch)} apuestas con IA")
+            except Exception as e:
+                logger.warning(f"Error en el análisis IA: {str(e)}")
+        else:
+            logger.warning("Presupuesto de tokens agotado, usando el modelo estadístico")
+
+        probabilities = await self._model_probabilities([leg for key, leg in batch if key not in parsed])
+        results = {}
+        for key, leg in batch:
+            if key in parsed:
+                results[key] = {**parsed[key], "source": "llm"}
+            else:
+                self.stats.fallbacks += 1
+                results[key] = {**model_analysis(leg, probabilities.get(id(leg))), "source": "modelo"}
+            self._inflight[key].set_result(results[key])
+        return results
+
+    async def _model_probabilities(self, legs: List[Dict[str, Any]]) -> Dict[int, float]:
+        """Consensus-calibrated model probability per leg (keyed by ``id(leg)``), when a pricer is set."""
+        if not legs or self.pricer is None:
+            return {}
+        try:
+            probabilities = await self.pricer(legs)
+        except Exception as e:
+            logger.warning(f"Error valorando apuestas con el modelo: {str(e)}")
+            return {}
+        return {id(leg): p for leg, p in zip(legs, probabilities) if p is not None}
+
+
+__all__ = [
+    "AnalysisService",
+    "EmergentLlmClient",
+    "FakeLlmClient",
+    "MemoryAnalysisCache",
+    "MongoAnalysisCache",
+    "analysis_key",
+    "model_analysis",
+]
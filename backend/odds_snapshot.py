@@ -0,0 +1,265 @@
+"""
+odds_snapshot.py
+================
+
+In-memory snapshot of the latest odds per sport.
+
+Polling ``/api/odds/{sport}`` used to call TheOddsAPI and write to MongoDB on
+every request.  The snapshot store keeps the latest parsed rows per sport
+and refreshes them at most once per ``ttl``:
+
+* a fresh snapshot is returned immediately;
+* a stale snapshot is returned immediately while a single background task
+  refreshes it (stale-while-revalidate);
+* only the very first request for a sport waits for the loader;
+* a refresh that comes back empty (every upstream fetch failed) keeps the
+  previous snapshot for up to ``keep_on_empty`` seconds.
+
+Each snapshot carries a ``version`` digest of its prices, so an unchanged
+refresh keeps the same version and HTTP caches keyed on it stay valid.
+
+When a snapshot is built its rows are also grouped once into games
+(:func:`group_games`): one entry per event with a bookmaker × outcome price
+matrix and the best price per outcome, sorted by kick-off and indexed by
+league, so requests only bisect and slice (:meth:`OddsSnapshot.query`).
+
+Example usage::
+
+    snapshots = OddsSnapshotStore(ttl=60)
+    snapshot = await snapshots.get("soccer", load_soccer_rows)
+    etag_version = snapshot.version
+    page, total = snapshot.query(league="soccer_epl", offset=0, limit=20)
+
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import logging
+import time
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from domain import OddsRow
+from odds_timeseries import parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+Loader = Callable[[str], Awaitable[List[OddsRow]]]
+
+# price matrix rows: outcome -> OddsRow attribute (spreads and total_line hold points, not prices)
+PRICE_FIELDS = {
+    "home": "home_odds",
+    "away": "away_odds",
+    "draw": "draw_odds",
+    "over": "total_over",
+    "under": "total_under",
+    "spread_home": "spread_home",
+    "spread_away": "spread_away",
+    "total_line": "total_line",
+}
+BEST_PRICE_OUTCOMES = ("home", "away", "draw", "over", "under")
+
+
+def rows_digest(rows: List[OddsRow]) -> str:
+    """Digest of the prices in ``rows``; identical prices give identical digests."""
+    digest = hashlib.sha1()
+    for row in rows:
+        digest.update(
+            repr(
+                (
+                    row.event_id,
+                    row.bookmaker,
+                    row.commence_time,
+                    row.home_odds,
+                    row.away_odds,
+                    row.draw_odds,
+                    row.spread_home,
+                    row.spread_away,
+                    row.total_over,
+                    row.total_under,
+                    row.total_line,
+                )
+            ).encode()
+        )
+    return digest.hexdigest()[:16]
+
+
+def _matrix_value(row: OddsRow, attribute: str) -> Optional[float]:
+    value = getattr(row, attribute)
+    if attribute.startswith("spread_"):
+        return value  # a 0.0 handicap is a real line
+    return value or None  # missing moneyline prices are stored as 0.0
+
+
+def group_games(rows: List[OddsRow]) -> List[Dict[str, Any]]:
+    """Group per-bookmaker rows into one entry per game, sorted by kick-off.
+
+    ``prices[outcome][i]`` is the price of ``bookmakers[i]`` (``None`` when it
+    does not price that outcome); outcomes nobody prices are left out.
+    ``best[outcome]`` holds the highest price and the bookmaker offering it.
+    """
+    grouped: Dict[Tuple, List[OddsRow]] = {}
+    for row in rows:
+        key = row.event_id or (row.home_team, row.away_team, row.commence_time)
+        grouped.setdefault(key, []).append(row)
+
+    games = []
+    for event_rows in grouped.values():
+        first = event_rows[0]
+        prices = {}
+        for outcome, attribute in PRICE_FIELDS.items():
+            values = [_matrix_value(row, attribute) for row in event_rows]
+            if any(value is not None for value in values):
+                prices[outcome] = values
+        best = {}
+        for outcome in BEST_PRICE_OUTCOMES:
+            values = prices.get(outcome)
+            if values:
+                index = max(range(len(values)), key=lambda i: values[i] or 0.0)
+                best[outcome] = {"odds": values[index], "bookmaker": event_rows[index].bookmaker}
+        games.append({
+            "event_id": first.event_id,
+            "league": first.league,
+            "home_team": first.home_team,
+            "away_team": first.away_team,
+            "commence_time": first.commence_time,
+            "bookmakers": [row.bookmaker for row in event_rows],
+            "prices": prices,
+            "best": best,
+        })
+    games.sort(key=lambda game: game["commence_time"])
+    return games
+
+
+@dataclass(slots=True)
+class _GameIndex:
+    """Games sorted by kick-off plus their kick-off times, for bisecting."""
+
+    games: List[Dict[str, Any]]
+    kickoffs: List[datetime]
+
+
+def _index_games(games: List[Dict[str, Any]]) -> Dict[Optional[str], _GameIndex]:
+    """Kick-off index over all games (key ``None``) and per league."""
+    indexes: Dict[Optional[str], _GameIndex] = {None: _GameIndex([], [])}
+    for game in games:
+        kickoff = parse_timestamp(game["commence_time"]) or datetime.max
+        for key in (None, game["league"]):
+            index = indexes.setdefault(key, _GameIndex([], []))
+            index.games.append(game)
+            index.kickoffs.append(kickoff)
+    return indexes
+
+
+@dataclass(slots=True)
+class OddsSnapshot:
+    """Latest odds rows for one sport, plus the same prices grouped by game."""
+
+    sport: str
+    rows: List[OddsRow]
+    version: str
+    fetched_at: datetime
+    loaded_monotonic: float = field(default_factory=time.monotonic)
+    games: List[Dict[str, Any]] = field(init=False)
+    _indexes: Dict[Optional[str], _GameIndex] = field(init=False)
+
+    def __post_init__(self) -> None:
+        self.games = group_games(self.rows)
+        self._indexes = _index_games(self.games)
+
+    def query(
+        self,
+        league: Optional[str] = None,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        descending: bool = False,
+        offset: int = 0,
+        limit: int = 30,
+    ) -> Tuple[List[Dict[str, Any]], int]:
+        """One page of games of ``league`` kicking off in ``[start, end]``.
+
+        Returns:
+            The page and the total number of matching games.
+        """
+        index = self._indexes.get(league)
+        if index is None:
+            return [], 0
+        low = bisect_left(index.kickoffs, start) if start else 0
+        high = bisect_right(index.kickoffs, end) if end else len(index.kickoffs)
+        total = max(high - low, 0)
+        if descending:
+            stop = max(high - offset, low)
+            page = index.games[max(stop - limit, low):stop][::-1]
+        else:
+            begin = min(low + offset, high)
+            page = index.games[begin:min(begin + limit, high)]
+        return page, total
+
+
+class OddsSnapshotStore:
+    """Per-sport odds snapshots with single-flight, stale-while-revalidate refresh."""
+
+    def __init__(self, ttl: float = 60.0, keep_on_empty: float = 1800.0) -> None:
+        self.ttl = ttl
+        # seconds a snapshot with games is kept when a refresh comes back empty (every fetch failed)
+        self.keep_on_empty = keep_on_empty
+        self._snapshots: Dict[str, OddsSnapshot] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._refreshing: Dict[str, asyncio.Task] = {}
+
+    def peek(self, sport: str) -> Optional[OddsSnapshot]:
+        return self._snapshots.get(sport)
+
+    def is_fresh(self, snapshot: OddsSnapshot) -> bool:
+        return time.monotonic() - snapshot.loaded_monotonic < self.ttl
+
+    async def get(self, sport: str, loader: Loader) -> OddsSnapshot:
+        """Return the snapshot for ``sport``, loading or refreshing it as needed."""
+        snapshot = self._snapshots.get(sport)
+        if snapshot is not None:
+            if not self.is_fresh(snapshot):
+                self._refresh_in_background(sport, loader)
+            return snapshot
+        return await self.refresh(sport, loader)
+
+    async def refresh(self, sport: str, loader: Loader) -> OddsSnapshot:
+        lock = self._locks.setdefault(sport, asyncio.Lock())
+        async with lock:
+            current = self._snapshots.get(sport)
+            if current is not None and self.is_fresh(current):
+                return current
+            rows = await loader(sport)
+            if not rows and current is not None and current.rows and self._keeps(current):
+                logger.warning(f"Odds de {sport} vacías: se mantiene el snapshot anterior")
+                current.loaded_monotonic = time.monotonic()
+                return current
+            version = rows_digest(rows)
+            if current is not None and current.version == version:
+                current.loaded_monotonic = time.monotonic()
+                current.fetched_at = datetime.utcnow()
+                return current
+            snapshot = OddsSnapshot(sport, rows, version, datetime.utcnow())
+            self._snapshots[sport] = snapshot
+            return snapshot
+
+    def _keeps(self, snapshot: OddsSnapshot) -> bool:
+        return (datetime.utcnow() - snapshot.fetched_at).total_seconds() < self.keep_on_empty
+
+    def _refresh_in_background(self, sport: str, loader: Loader) -> None:
+        task = self._refreshing.get(sport)
+        if task is not None and not task.done():
+            return
+        self._refreshing[sport] = asyncio.create_task(self._refresh_safely(sport, loader))
+
+    async def _refresh_safely(self, sport: str, loader: Loader) -> None:
+        try:
+            await self.refresh(sport, loader)
+        except Exception as e:
+            logger.warning(f"Error actualizando snapshot de {sport}: {str(e)}")
+
+
+__all__ = ["OddsSnapshot", "OddsSnapshotStore", "group_games", "rows_digest"]
@@ -0,0 +1,478 @@
+"""
+odds_timeseries.py
+==================
+
+Compact storage for bookmaker price movements.
+
+Instead of appending one document per fetched odds row, every price change is
+stored as a point inside a *bucket* document that covers one event for a fixed
+time span.  A bucket holds one series per ``(bookmaker, outcome)`` pair as two
+parallel arrays: second offsets from the start of the bucket and prices.
+
+Data is kept at three resolutions:
+
+* ``tick`` – one document per event per hour holding every price change.
+* ``hour`` – one document per event per day holding the closing price of each
+  hour.
+* ``day`` – one document per event per 30 days holding the closing price of
+  each day.
+
+As buckets age past the retention of their resolution, :meth:`OddsTimeSeriesStore.downsample`
+folds them into the next coarser resolution and removes the originals.  All
+buckets share the ``(event_id, bucket_start, bucket_end)`` index, so reading any
+time range for an event (e.g. a full week of movement) is a single indexed query
+whatever mix of resolutions it spans.
+
+Example usage::
+
+    store = OddsTimeSeriesStore(db.odds_timeseries)
+    await store.ensure_indexes()
+    await store.record_games(games, sport="soccer", league="soccer_epl")
+    series = await store.query_range(event_id, start, end)
+    moves = steam_moves(series["Pinnacle|h2h:home"]["points"])
+
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from pymongo import ASCENDING, UpdateOne
+
+logger = logging.getLogger(__name__)
+
+EPOCH = datetime(1970, 1, 1)
+
+
+@dataclass(frozen=True)
+class Resolution:
+    """One storage tier of the time series.
+
+    Attributes:
+        name: identifier stored in each bucket document.
+        bucket_seconds: time span covered by a single document.
+        step_seconds: spacing between stored points (0 keeps every change).
+        retain: age after which buckets are folded into the next tier, or
+            ``None`` to keep them forever.
+    """
+
+    name: str
+    bucket_seconds: int
+    step_seconds: int
+    retain: Optional[timedelta]
+
+
+RESOLUTIONS: Tuple[Resolution, ...] = (
+    Resolution("tick", 3600, 0, timedelta(days=2)),
+    Resolution("hour", 86400, 3600, timedelta(days=30)),
+    Resolution("day", 30 * 86400, 86400, None),
+)
+
+
+@dataclass(frozen=True)
+class PriceTick:
+    """A single observed price for one outcome at one bookmaker."""
+
+    event_id: str
+    bookmaker: str
+    outcome: str
+    price: float
+    observed_at: datetime
+
+
+def parse_timestamp(value: Optional[str]) -> Optional[datetime]:
+    """Parse an ISO-8601 timestamp from TheOddsAPI into a naive UTC datetime."""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is not None:
+        parsed = (parsed - parsed.utcoffset()).replace(tzinfo=None)
+    return parsed
+
+
+def bucket_start(moment: datetime, bucket_seconds: int) -> datetime:
+    """Floor ``moment`` to the start of its bucket."""
+    seconds = int((moment - EPOCH).total_seconds())
+    return EPOCH + timedelta(seconds=seconds - seconds % bucket_seconds)
+
+
+def series_key(bookmaker: str, outcome: str) -> str:
+    """Build the field name used for a series inside a bucket document.
+
+    MongoDB field names cannot contain ``.`` or start with ``$``; bookmaker
+    titles such as ``BetOnline.ag`` are escaped with their full-width forms.
+    """
+    raw = f"{bookmaker}|{outcome}"
+    return raw.replace(".", "．").replace("$", "＄")
+
+
+def split_series_key(key: str) -> Tuple[str, str]:
+    """Inverse of :func:`series_key`, returning ``(bookmaker, outcome)``."""
+    raw = key.replace("．", ".").replace("＄", "$")
+    bookmaker, _, outcome = raw.partition("|")
+    return bookmaker, outcome
+
+
+def _outcome_label(market_key: str, outcome: Dict[str, Any], home_team: str, away_team: str) -> str:
+    name = outcome.get("name")
+    if name == home_team:
+        side = "home"
+    elif name == away_team:
+        side = "away"
+    elif name == "Draw":
+        side = "draw"
+    else:
+        side = str(name).lower()
+    point = outcome.get("point")
+    if point is not None:
+        return f"{market_key}:{side}@{point}"
+    return f"{market_key}:{side}"
+
+
+def extract_ticks(game: Dict[str, Any], fetched_at: datetime) -> Iterator[PriceTick]:
+    """Yield one :class:`PriceTick` per priced outcome in a TheOddsAPI game payload.
+
+    The bookmaker's ``last_update`` is used as the observation time when
+    present, so the stored series reflects when the price actually moved.
+    """
+    event_id = game.get("id")
+    if not event_id:
+        return
+    home_team = game.get("home_team", "")
+    away_team = game.get("away_team", "")
+    for bookmaker in game.get("bookmakers", []):
+        title = bookmaker.get("title") or bookmaker.get("key", "")
+        for market in bookmaker.get("markets", []):
+            observed_at = parse_timestamp(market.get("last_update") or bookmaker.get("last_update")) or fetched_at
+            for outcome in market.get("outcomes", []):
+                price = outcome.get("price")
+                if not price:
+                    continue
+                yield PriceTick(
+                    event_id=event_id,
+                    bookmaker=title,
+                    outcome=_outcome_label(market["key"], outcome, home_team, away_team),
+                    price=float(price),
+                    observed_at=observed_at,
+                )
+
+
+def downsample_points(
+    offsets: List[int], prices: List[float], origin: datetime, target_origin: datetime, step_seconds: int
+) -> Tuple[List[int], List[float]]:
+    """Keep the closing price of every ``step_seconds`` window.
+
+    Args:
+        offsets: second offsets of the source points relative to ``origin``.
+        prices: prices matching ``offsets``.
+        origin: start of the source bucket.
+        target_origin: start of the destination bucket.
+        step_seconds: width of the destination windows.
+
+    Returns:
+        ``(offsets, prices)`` relative to ``target_origin``, one point per
+        window that contained at least one source point.
+    """
+    shift = int((origin - target_origin).total_seconds())
+    closes: Dict[int, Tuple[int, float]] = {}
+    for offset, price in sorted(zip(offsets, prices)):
+        absolute = offset + shift
+        window = absolute - absolute % step_seconds
+        closes[window] = (window, price)
+    ordered = sorted(closes.values())
+    return [point[0] for point in ordered], [point[1] for point in ordered]
+
+
+def steam_moves(
+    points: List[Tuple[datetime, float]], window: timedelta = timedelta(minutes=30), min_change: float = 0.05
+) -> List[Dict[str, Any]]:
+    """Detect sharp price moves ("steam") within a single series.
+
+    A move is reported whenever the price changes by at least ``min_change``
+    (as a fraction of the starting price) within ``window``.  Overlapping
+    detections are merged so each move is reported once.
+
+    Args:
+        points: ``(timestamp, price)`` pairs sorted by time.
+        window: maximum duration of a move.
+        min_change: minimum relative change, e.g. ``0.05`` for 5%.
+
+    Returns:
+        A list of dicts with ``start``, ``end``, ``from_price``, ``to_price``
+        and ``change`` (negative when the price shortened).
+    """
+    moves: List[Dict[str, Any]] = []
+    start = 0
+    i = 0
+    while i < len(points):
+        while points[i][0] - points[start][0] > window:
+            start += 1
+        origin_time, origin_price = points[start]
+        moment, price = points[i]
+        change = price / origin_price - 1.0
+        if abs(change) >= min_change:
+            # extend while the move keeps going in the same direction
+            end = i
+            while end + 1 < len(points) and points[end + 1][0] - origin_time <= window:
+                nxt = points[end + 1][1] / origin_price - 1.0
+                if (nxt > change) if change > 0 else (nxt < change):
+                    change = nxt
+                    end += 1
+                else:
+                    break
+            moves.append(
+                {
+                    "start": origin_time,
+                    "end": points[end][0],
+                    "from_price": origin_price,
+                    "to_price": points[end][1],
+                    "change": round(change, 4),
+                }
+            )
+            start = i = end
+        i += 1
+    return moves
+
+
+class OddsTimeSeriesStore:
+    """Bucketed price-movement store backed by a Motor collection."""
+
+    def __init__(self, collection, downsample_interval: timedelta = timedelta(minutes=15)) -> None:
+        self.collection = collection
+        self.downsample_interval = downsample_interval
+        # last recorded price per (event_id, series key); unchanged prices are not stored again
+        self._last_price: Dict[Tuple[str, str], float] = {}
+        self._last_downsample: Optional[datetime] = None
+        self._downsample_task: Optional[asyncio.Task] = None
+
+    async def ensure_indexes(self) -> None:
+        await self.collection.create_index(
+            [("event_id", ASCENDING), ("bucket_start", ASCENDING), ("bucket_end", ASCENDING)],
+            name="event_range",
+        )
+        await self.collection.create_index(
+            [("resolution", ASCENDING), ("bucket_end", ASCENDING)], name="resolution_age"
+        )
+
+    def build_updates(
+        self, games: Iterable[Dict[str, Any]], sport: str, league: str, fetched_at: datetime
+    ) -> List[UpdateOne]:
+        """Turn game payloads into one upsert per touched tick bucket.
+
+        Only prices that differ from the last recorded value for the same
+        series are included.
+        """
+        tier = RESOLUTIONS[0]
+        buckets: Dict[Tuple[str, datetime], Dict[str, Any]] = {}
+        for game in games:
+            for tick in extract_ticks(game, fetched_at):
+                key = series_key(tick.bookmaker, tick.outcome)
+                if self._last_price.get((tick.event_id, key)) == tick.price:
+                    continue
+                self._last_price[(tick.event_id, key)] = tick.price
+
+                start = bucket_start(tick.observed_at, tier.bucket_seconds)
+                bucket = buckets.get((tick.event_id, start))
+                if bucket is None:
+                    bucket = buckets[(tick.event_id, start)] = {
+                        "meta": {
+                            "event_id": tick.event_id,
+                            "sport": sport,
+                            "league": league,
+                            "home_team": game.get("home_team"),
+                            "away_team": game.get("away_team"),
+                            "commence_time": parse_timestamp(game.get("commence_time")),
+                            "resolution": tier.name,
+                            "bucket_start": start,
+                            "bucket_end": start + timedelta(seconds=tier.bucket_seconds),
+                        },
+                        "push": {},
+                    }
+                offset = int((tick.observed_at - start).total_seconds())
+                push = bucket["push"]
+                push.setdefault(f"series.{key}.t", []).append(offset)
+                push.setdefault(f"series.{key}.p", []).append(tick.price)
+
+        updates = []
+        for (event_id, start), bucket in buckets.items():
+            push = {field: {"$each": values} for field, values in bucket["push"].items()}
+            points = sum(len(values) for field, values in bucket["push"].items() if field.endswith(".p"))
+            updates.append(
+                UpdateOne(
+                    {"_id": f"{event_id}:{RESOLUTIONS[0].name}:{int((start - EPOCH).total_seconds())}"},
+                    {"$setOnInsert": bucket["meta"], "$push": push, "$inc": {"n": points}},
+                    upsert=True,
+                )
+            )
+        return updates
+
+    async def record_games(
+        self, games: Iterable[Dict[str, Any]], sport: str, league: str, fetched_at: Optional[datetime] = None
+    ) -> int:
+        """Record the prices contained in a TheOddsAPI response.
+
+        Returns:
+            The number of bucket documents written.
+        """
+        fetched_at = fetched_at or datetime.utcnow()
+        updates = self.build_updates(games, sport, league, fetched_at)
+        if updates:
+            await self.collection.bulk_write(updates, ordered=False)
+        self.maybe_downsample(fetched_at)
+        return len(updates)
+
+    async def query_range(
+        self,
+        event_id: str,
+        start: datetime,
+        end: datetime,
+        bookmaker: Optional[str] = None,
+        outcome: Optional[str] = None,
+    ) -> Dict[str, Dict[str, Any]]:
+        """Return every series for ``event_id`` between ``start`` and ``end``.
+
+        Buckets of all resolutions overlapping the range are fetched with one
+        indexed query and stitched together.
+
+        Returns:
+            A dict keyed by ``"<bookmaker>|<outcome>"`` whose values contain
+            ``bookmaker``, ``outcome`` and ``points`` – a time-sorted list of
+            ``(timestamp, price)`` pairs.
+        """
+        cursor = self.collection.find(
+            {"event_id": event_id, "bucket_start": {"$lt": end}, "bucket_end": {"$gt": start}},
+            {"bucket_start": 1, "series": 1},
+        ).sort("bucket_start", ASCENDING)
+
+        result: Dict[str, Dict[str, Any]] = {}
+        async for doc in cursor:
+            origin = doc["bucket_start"]
+            for key, series in doc.get("series", {}).items():
+                book, label = split_series_key(key)
+                if bookmaker and book != bookmaker:
+                    continue
+                if outcome and label != outcome:
+                    continue
+                entry = result.setdefault(
+                    f"{book}|{label}", {"bookmaker": book, "outcome": label, "points": []}
+                )
+                for offset, price in zip(series.get("t", []), series.get("p", [])):
+                    moment = origin + timedelta(seconds=offset)
+                    if start <= moment < end:
+                        entry["points"].append((moment, price))
+        for entry in result.values():
+            entry["points"].sort(key=lambda point: point[0])
+        return result
+
+    async def closing_price(
+        self, event_id: str, bookmaker: Optional[str], outcome: str, commence_time: datetime
+    ) -> Optional[float]:
+        """Last recorded price for an outcome before kick-off.
+
+        When ``bookmaker`` is ``None`` the best closing price across all
+        bookmakers is returned.
+        """
+        series = await self.query_range(
+            event_id, commence_time - timedelta(days=7), commence_time, bookmaker=bookmaker, outcome=outcome
+        )
+        closes = [entry["points"][-1][1] for entry in series.values() if entry["points"]]
+        return max(closes) if closes else None
+
+    def maybe_downsample(self, now: Optional[datetime] = None) -> None:
+        """Schedule :meth:`downsample` in the background if it is due."""
+        now = now or datetime.utcnow()
+        if self._last_downsample and now - self._last_downsample < self.downsample_interval:
+            return
+        if self._downsample_task and not self._downsample_task.done():
+            return
+        self._last_downsample = now
+        self._downsample_task = asyncio.create_task(self._downsample_safely(now))
+
+    async def _downsample_safely(self, now: datetime) -> None:
+        try:
+            await self.downsample(now)
+        except Exception as e:
+            logger.warning(f"Error compactando series de odds: {str(e)}")
+
+    async def downsample(self, now: Optional[datetime] = None, batch_size: int = 500) -> int:
+        """Fold aged buckets into the next coarser resolution.
+
+        Returns:
+            The number of source buckets that were compacted.
+        """
+        now = now or datetime.utcnow()
+        compacted = 0
+        for tier, target in zip(RESOLUTIONS, RESOLUTIONS[1:]):
+            cutoff = now - tier.retain
+            docs = await self.collection.find(
+                {"resolution": tier.name, "bucket_end": {"$lte": cutoff}}
+            ).sort("bucket_end", ASCENDING).to_list(batch_size)
+            if not docs:
+                continue
+
+            merged: Dict[Tuple[str, datetime], Dict[str, Any]] = {}
+            for doc in docs:
+                target_start = bucket_start(doc["bucket_start"], target.bucket_seconds)
+                bucket = merged.get((doc["event_id"], target_start))
+                if bucket is None:
+                    meta = {field: doc.get(field) for field in ("event_id", "sport", "league", "home_team", "away_team", "commence_time")}
+                    meta.update(
+                        resolution=target.name,
+                        bucket_start=target_start,
+                        bucket_end=target_start + timedelta(seconds=target.bucket_seconds),
+                    )
+                    bucket = merged[(doc["event_id"], target_start)] = {"meta": meta, "series": {}}
+                for key, series in doc.get("series", {}).items():
+                    offsets, prices = downsample_points(
+                        series.get("t", []), series.get("p", []), doc["bucket_start"], target_start, target.step_seconds
+                    )
+                    acc = bucket["series"].setdefault(key, {"t": [], "p": []})
+                    # later source buckets overwrite the close of a shared window
+                    if acc["t"] and offsets and acc["t"][-1] == offsets[0]:
+                        acc["t"].pop()
+                        acc["p"].pop()
+                    acc["t"].extend(offsets)
+                    acc["p"].extend(prices)
+
+            updates = []
+            for (event_id, target_start), bucket in merged.items():
+                push = {}
+                for key, series in bucket["series"].items():
+                    push[f"series.{key}.t"] = {"$each": series["t"]}
+                    push[f"series.{key}.p"] = {"$each": series["p"]}
+                points = sum(len(series["p"]) for series in bucket["series"].values())
+                updates.append(
+                    UpdateOne(
+                        {"_id": f"{event_id}:{target.name}:{int((target_start - EPOCH).total_seconds())}"},
+                        {"$setOnInsert": bucket["meta"], "$push": push, "$inc": {"n": points}},
+                        upsert=True,
+                    )
+                )
+            await self.collection.bulk_write(updates, ordered=False)
+            await self.collection.delete_many({"_id": {"$in": [doc["_id"] for doc in docs]}})
+            compacted += len(docs)
+
+        self._prune_last_prices()
+        return compacted
+
+    def _prune_last_prices(self) -> None:
+        # the dedup cache only matters while a series is still moving; drop it once it grows large
+        if len(self._last_price) > 200_000:
+            self._last_price.clear()
+
+
+__all__ = [
+    "RESOLUTIONS",
+    "PriceTick",
+    "OddsTimeSeriesStore",
+    "extract_ticks",
+    "downsample_points",
+    "steam_moves",
+]
@@ -0,0 +1,394 @@
+"""
+parlay_simulator.py
+===================
+
+Monte Carlo risk simulation for parlays with correlated legs.
+
+``100 / total_odds`` includes the bookmaker margin on every leg and assumes
+the legs are independent.  This module instead simulates the matches:
+
+* Soccer legs whose 1X2 prices are known get Poisson goal expectations fitted
+  to the margin-free prices (:func:`tipstars_prediction.implied_lambdas`).
+  Each simulation draws a full scoreline per match, so legs on the same match
+  (e.g. home win and over 2.5) are correlated exactly.
+* A shared log-normal shock per league and per team scales the goal
+  expectations of every match in that league / involving that team, which
+  correlates legs across matches.
+* Other legs share one categorical draw per event: each selection on the event
+  takes a slice of the draw sized by its margin-free probability, so mutually
+  exclusive picks (home and away on the same match) can never both win.  The
+  draw is correlated with its league through a Gaussian copula.
+
+Simulations run in vectorized NumPy batches from a seeded generator, so
+results are reproducible.  Batches are sized from the legs, matches and teams
+to stay within a memory budget, and the run stops as soon as the 95%
+confidence interval of the win probability is narrower than the requested
+tolerance, both absolute and relative to the probability (a long parlay at
+1e-4 needs far more precision than ±0.001), or when the draw cap or the time
+budget is reached (``converged`` is then false).
+
+Supported selections: ``local``, ``visitante``, ``empate`` (1X2),
+``mas``/``menos`` with ``line`` (total goals) and ``ambos_marcan``/``no_ambos_marcan``.
+
+Example usage::
+
+    result = simulate_parlay(legs, seed=42, stake=10, bankroll=500, repetitions=100)
+    result["win_probability"], result["ruin_probability"]
+
+"""
+
+from __future__ import annotations
+
+import math
+import time
+from dataclasses import dataclass, field
+from statistics import NormalDist
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from tipstars_prediction import implied_lambdas, implied_probabilities
+
+SELECTION_OUTCOMES = {"local": "home", "visitante": "away", "empate": "draw"}
+GOAL_SELECTIONS = {"local", "visitante", "empate", "mas", "menos", "ambos_marcan", "no_ambos_marcan"}
+
+# assumed bookmaker margin when only the selected price is known
+DEFAULT_MARGIN = 0.05
+
+Z_95 = 1.959963984540054
+
+# memory of one batch: the shocks, goal rates and scores of every draw
+BATCH_MEMORY_BYTES = 64 * 1024 * 1024
+MIN_BATCH_SIZE = 10_000
+
+
+@dataclass(slots=True)
+class CorrelationModel:
+    """Strength of the shared shocks.
+
+    Attributes:
+        league_sigma: log-scale std-dev of the goal-rate shock shared by a league.
+        team_sigma: log-scale std-dev of the shock shared by every match of a team.
+        bernoulli_rho: loading of non-goal legs on their league factor.
+    """
+
+    league_sigma: float = 0.08
+    team_sigma: float = 0.05
+    bernoulli_rho: float = 0.10
+
+
+@dataclass(slots=True)
+class _Match:
+    lambda_home: float
+    lambda_away: float
+    league: int
+    home_team: int
+    away_team: int
+
+
+@dataclass(slots=True)
+class _Event:
+    league: int
+    probabilities: Dict[str, float] = field(default_factory=dict)
+
+
+@dataclass(slots=True)
+class _Leg:
+    kind: str  # "goals" or "categorical"
+    selection: str
+    odds: float
+    probability: float = 0.0
+    match: int = -1
+    event: int = -1
+    league: int = -1
+    line: float = 2.5
+    lower: float = -math.inf
+    threshold: float = 0.0
+
+
+@dataclass(slots=True)
+class _Model:
+    matches: List[_Match] = field(default_factory=list)
+    events: List[_Event] = field(default_factory=list)
+    legs: List[_Leg] = field(default_factory=list)
+    n_leagues: int = 0
+    n_teams: int = 0
+
+
+def leg_probability(leg: Dict[str, Any]) -> float:
+    """Margin-free probability of a leg from its market, or an assumed margin."""
+    outcome = SELECTION_OUTCOMES.get(leg.get("selection"))
+    market = {name: leg.get(f"{name}_odds") for name in ("home", "draw", "away")}
+    market = {name: price for name, price in market.items() if price}
+    if outcome in market and len(market) >= 2:
+        return implied_probabilities(market)[outcome]
+    return 1.0 / (float(leg["odds"]) * (1.0 + DEFAULT_MARGIN))
+
+
+def _match_key(leg: Dict[str, Any]) -> str:
+    return leg.get("event_id") or f"{leg.get('home_team')}|{leg.get('away_team')}"
+
+
+def _build_model(legs: List[Dict[str, Any]], grid=None) -> _Model:
+    model = _Model()
+    leagues: Dict[str, int] = {}
+    teams: Dict[str, int] = {}
+    matches: Dict[str, int] = {}
+    events: Dict[str, int] = {}
+
+    # a full 1X2 market on any leg of a soccer match prices every leg of it
+    markets: Dict[str, Dict[str, Any]] = {}
+    for leg in legs:
+        if leg.get("sport", "soccer") == "soccer" and all(leg.get(f"{name}_odds") for name in ("home", "draw", "away")):
+            markets.setdefault(_match_key(leg), leg)
+
+    for leg in legs:
+        selection = leg.get("selection")
+        league_key = leg.get("league") or leg.get("sport") or "desconocida"
+        league = leagues.setdefault(league_key, len(leagues))
+        match_key = _match_key(leg)
+        if match_key in markets and selection in GOAL_SELECTIONS:
+            if match_key not in matches:
+                market = markets[match_key]
+                probs = implied_probabilities({name: market[f"{name}_odds"] for name in ("home", "draw", "away")})
+                lambda_home, lambda_away = implied_lambdas(probs, total_goals=market.get("expected_goals"), grid=grid)
+                matches[match_key] = len(model.matches)
+                model.matches.append(_Match(
+                    lambda_home,
+                    lambda_away,
+                    league,
+                    teams.setdefault(str(market.get("home_team")), len(teams)),
+                    teams.setdefault(str(market.get("away_team")), len(teams)),
+                ))
+            model.legs.append(_Leg(
+                "goals", selection, float(leg["odds"]), match=matches[match_key], league=league,
+                line=float(leg.get("line", 2.5)),
+            ))
+        else:
+            if selection not in SELECTION_OUTCOMES:
+                raise ValueError(f"Selección '{selection}' no soportada sin cuotas 1X2 completas")
+            if match_key not in events:
+                events[match_key] = len(model.events)
+                model.events.append(_Event(league))
+            event = model.events[events[match_key]]
+            # the same pick twice on an event is one outcome, priced once
+            event.probabilities.setdefault(selection, min(max(leg_probability(leg), 1e-6), 1 - 1e-6))
+            model.legs.append(_Leg(
+                "categorical", selection, float(leg["odds"]), event=events[match_key], league=league,
+            ))
+
+    # slice each event's draw between its selections; prices quoted with
+    # different margins may add up to more than 1, so scale them back
+    for leg in model.legs:
+        if leg.kind != "categorical":
+            continue
+        probabilities = model.events[leg.event].probabilities
+        scale = max(1.0, sum(probabilities.values()))
+        start = 0.0
+        for selection, probability in probabilities.items():
+            if selection == leg.selection:
+                break
+            start += probability / scale
+        leg.probability = probabilities[leg.selection] / scale
+        leg.lower = NormalDist().inv_cdf(start) if start > 0 else -math.inf
+        leg.threshold = NormalDist().inv_cdf(min(start + leg.probability, 1 - 1e-12))
+
+    model.n_leagues = len(leagues)
+    model.n_teams = len(teams)
+    return model
+
+
+def _goal_outcome(selection: str, line: float, home: np.ndarray, away: np.ndarray) -> np.ndarray:
+    if selection == "local":
+        return home > away
+    if selection == "visitante":
+        return away > home
+    if selection == "empate":
+        return home == away
+    if selection == "mas":
+        return home + away > line
+    if selection == "menos":
+        return home + away < line
+    if selection == "ambos_marcan":
+        return (home > 0) & (away > 0)
+    return (home == 0) | (away == 0)
+
+
+def _simulate_batch(model: _Model, correlation: CorrelationModel, size: int, rng: np.random.Generator) -> np.ndarray:
+    """Return a ``(size, n_legs)`` boolean matrix of leg outcomes."""
+    league_z = rng.standard_normal((size, model.n_leagues))
+    team_z = rng.standard_normal((size, model.n_teams)) if model.matches else None
+    outcomes = np.empty((size, len(model.legs)), dtype=bool)
+
+    goals: List[Tuple[np.ndarray, np.ndarray]] = []
+    sl, st = correlation.league_sigma, correlation.team_sigma
+    drift = -(sl * sl + st * st) / 2  # keeps the mean goal rate unchanged
+    for match in model.matches:
+        league_shock = sl * league_z[:, match.league]
+        home_rate = match.lambda_home * np.exp(league_shock + st * team_z[:, match.home_team] + drift)
+        away_rate = match.lambda_away * np.exp(league_shock + st * team_z[:, match.away_team] + drift)
+        goals.append((rng.poisson(home_rate), rng.poisson(away_rate)))
+
+    rho = correlation.bernoulli_rho
+    latents = [
+        rho * league_z[:, event.league] + math.sqrt(1 - rho * rho) * rng.standard_normal(size)
+        for event in model.events
+    ]
+    for j, leg in enumerate(model.legs):
+        if leg.kind == "goals":
+            home, away = goals[leg.match]
+            outcomes[:, j] = _goal_outcome(leg.selection, leg.line, home, away)
+        else:
+            latent = latents[leg.event]
+            outcomes[:, j] = (latent >= leg.lower) & (latent < leg.threshold)
+    return outcomes
+
+
+def ruin_simulation(
+    win_probability: float,
+    total_odds: float,
+    stake: float,
+    bankroll: float,
+    repetitions: int,
+    rng: np.random.Generator,
+    paths: int = 20_000,
+    chunk: int = 64,
+) -> Dict[str, Any]:
+    """Bankroll paths for the same parlay staked ``repetitions`` times.
+
+    A path is ruined when the bankroll can no longer cover the stake.  The
+    repetitions are simulated ``chunk`` at a time, so memory stays at
+    ``paths x chunk`` whatever the number of repetitions.
+    """
+    final = np.full(paths, float(bankroll))
+    ruined = np.zeros(paths, dtype=bool)
+    for start in range(0, repetitions, chunk):
+        size = min(chunk, repetitions - start)
+        wins = rng.random((paths, size)) < win_probability
+        steps = np.where(wins, stake * (total_odds - 1.0), -stake)
+        balances = final[:, None] + np.cumsum(steps, axis=1)
+        ruined_at = balances < stake
+        # once ruined a path stops betting: freeze its balance at the ruin point
+        hit = ruined_at.any(axis=1) & ~ruined
+        last = np.where(hit, ruined_at.argmax(axis=1), size - 1)
+        final = np.where(ruined, final, balances[np.arange(paths), last])
+        ruined |= hit
+    quantiles = np.quantile(final, [0.05, 0.25, 0.5, 0.75, 0.95])
+    return {
+        "ruin_probability": float(ruined.mean()),
+        "final_bankroll_mean": float(final.mean()),
+        "final_bankroll_quantiles": {
+            f"p{int(q * 100)}": round(float(v), 2) for q, v in zip((0.05, 0.25, 0.5, 0.75, 0.95), quantiles)
+        },
+    }
+
+
+def _converged(p: float, half_width: float, tolerance: float, relative_tolerance: float) -> bool:
+    return half_width <= tolerance and half_width <= relative_tolerance * p
+
+
+def _batch_size(model: _Model, limit: int) -> int:
+    """Draws per batch that keep one batch within :data:`BATCH_MEMORY_BYTES`."""
+    per_draw = 8 * (model.n_leagues + model.n_teams + 6 * len(model.matches) + len(model.events) + 2) + len(model.legs)
+    return max(MIN_BATCH_SIZE, min(limit, BATCH_MEMORY_BYTES // per_draw))
+
+
+def simulate_parlay(
+    legs: List[Dict[str, Any]],
+    seed: Optional[int] = None,
+    stake: float = 10.0,
+    bankroll: Optional[float] = None,
+    repetitions: int = 100,
+    tolerance: float = 0.001,
+    relative_tolerance: float = 0.05,
+    batch_size: int = 100_000,
+    max_draws: int = 5_000_000,
+    time_budget: Optional[float] = None,
+    correlation: Optional[CorrelationModel] = None,
+    grid=None,
+) -> Dict[str, Any]:
+    """Simulate a parlay and summarise its risk.
+
+    Args:
+        legs: bets with ``selection`` and ``odds``; soccer legs should include
+            ``home_odds``/``draw_odds``/``away_odds`` (and optionally
+            ``event_id``, ``league``, ``home_team``, ``away_team``).
+        seed: seed for reproducible results.
+        stake: stake per parlay.
+        bankroll: starting bankroll for the ruin simulation (skipped if None).
+        repetitions: number of times the parlay is staked in the ruin simulation.
+        tolerance: stop once the 95% CI half-width of the win probability is
+            below this value...
+        relative_tolerance: ...and below this fraction of the probability.
+        batch_size: maximum draws per vectorized batch (lowered for large
+            parlays to stay within :data:`BATCH_MEMORY_BYTES`).
+        max_draws: hard cap on the number of draws.
+        time_budget: seconds (model fitting included) after which no new batch
+            is started.
+        correlation: strength of league / team correlation.
+        grid: optional :class:`poisson_grid.PoissonGrid` used to fit the goal
+            expectations of soccer matches.
+
+    Returns:
+        A dict with the win probability and its confidence interval, the
+        independent-legs probability for comparison, the payout distribution,
+        expected value, variance and (optionally) ruin statistics.
+    """
+    if not legs:
+        raise ValueError("Se necesita al menos una apuesta")
+    deadline = None if time_budget is None else time.perf_counter() + time_budget
+    model = _build_model(legs, grid)
+    correlation = correlation or CorrelationModel()
+    rng = np.random.default_rng(seed)
+    total_odds = float(np.prod([leg.odds for leg in model.legs]))
+
+    n_legs = len(model.legs)
+    batch_size = _batch_size(model, batch_size)
+    draws = 0
+    wins = 0
+    legs_won = np.zeros(n_legs + 1, dtype=np.int64)
+    leg_hits = np.zeros(n_legs, dtype=np.int64)
+    half_width = math.inf
+    while draws < max_draws:
+        size = min(batch_size, max_draws - draws)
+        outcomes = _simulate_batch(model, correlation, size, rng)
+        won_count = outcomes.sum(axis=1)
+        legs_won += np.bincount(won_count, minlength=n_legs + 1)
+        leg_hits += outcomes.sum(axis=0)
+        wins += int((won_count == n_legs).sum())
+        draws += size
+        p = wins / draws
+        half_width = Z_95 * math.sqrt(max(p * (1 - p), 1.0 / draws) / draws)
+        if _converged(p, half_width, tolerance, relative_tolerance):
+            break
+        if deadline is not None and time.perf_counter() >= deadline:
+            break
+
+    p = wins / draws
+    leg_probabilities = leg_hits / draws
+    independent = float(np.prod(leg_probabilities))
+    profit_win = stake * (total_odds - 1.0)
+    result: Dict[str, Any] = {
+        "win_probability": p,
+        "confidence_interval": [max(0.0, p - half_width), min(1.0, p + half_width)],
+        "converged": _converged(p, half_width, tolerance, relative_tolerance),
+        "relative_error": half_width / p if p > 0 else None,
+        "draws": draws,
+        "implied_probability": 1.0 / total_odds,
+        "independent_probability": independent,
+        "leg_probabilities": leg_probabilities.tolist(),
+        "total_odds": total_odds,
+        "payout_distribution": [
+            {"payout": round(stake * total_odds, 2), "probability": p},
+            {"payout": 0.0, "probability": 1 - p},
+        ],
+        "legs_won_distribution": (legs_won / draws).tolist(),
+        "expected_profit": p * profit_win - (1 - p) * stake,
+        "profit_variance": p * (1 - p) * (stake * total_odds) ** 2,
+    }
+    if bankroll is not None:
+        result.update(ruin_simulation(p, total_odds, stake, bankroll, repetitions, rng))
+    return result
+
+
+__all__ = ["CorrelationModel", "leg_probability", "ruin_simulation", "simulate_parlay"]
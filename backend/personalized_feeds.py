@@ -0,0 +1,325 @@
+"""
+personalized_feeds.py
+=====================
+
+Stored user preferences and precomputed personalized feeds.
+
+Preferences (``UserPreferences``) are persisted in ``user_preferences``, one
+document per ``user_id``.  Every active user (seen within ``active_window``)
+has a feed document in ``user_feeds`` keyed by ``_id = user_id``:
+
+* ``candidates.<sport>`` – the best selections of that sport inside the odds
+  band of the user's risk level, ranked by model EV with the user's
+  preferred leagues first;
+* ``recommendation`` – parlays per risk level built from those sports, the
+  user's own risk level first, drawing legs from the preferred leagues
+  before the others.
+
+Feeds are refreshed by a background worker instead of at request time.
+Each odds ingest calls :meth:`PersonalizedFeeds.notify` with its sport; the
+worker coalesces notifications, finds the active users that follow the
+affected sports through the ``(preferred_sports, last_seen_at)`` index,
+builds one candidate pool per distinct sports combination and rewrites only
+the ``candidates.<sport>`` sections that changed plus the recommendation,
+with one unordered bulk write per batch of users.  Opening the app is then a
+single ``find_one`` by ``_id``.
+
+Example usage::
+
+    feeds = PersonalizedFeeds(db, pool_for=get_candidate_pool)
+    await feeds.ensure_indexes()
+    await feeds.save_preferences(UserPreferences(user_id="u1").model_dump())
+    feeds.notify("soccer")          # after ingesting soccer odds
+    feed = await feeds.get_feed("u1")
+
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import random
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Set
+
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+
+from domain import ParlayLeg, ParlayRecommendation
+
+logger = logging.getLogger(__name__)
+
+RISK_LEVELS = ["conservador", "equilibrado", "agresivo"]
+
+# odds band of each risk level's parlay legs
+RISK_ODDS = {"conservador": (1.0, 2.5), "equilibrado": (1.8, 3.5), "agresivo": (2.0, float("inf"))}
+
+# UserPreferences.risk_level -> risk level of the parlays
+PREFERENCE_RISK = {"bajo": "conservador", "medio": "equilibrado", "alto": "agresivo"}
+
+REASONING_OPTIONS = [
+    "Buena forma reciente del equipo",
+    "Valor interesante con odds de {odds}",
+    "Estadísticas favorables en casa/visitante",
+    "Análisis técnico positivo",
+    "Tendencia histórica favorable",
+]
+
+# fields copied from UserPreferences into the stored document
+PREFERENCE_FIELDS = ("min_odds", "max_legs", "risk_level", "preferred_sports", "preferred_leagues", "min_ev")
+
+# users per bulk write when refreshing feeds
+BATCH_SIZE = 500
+
+# last_seen_at is only rewritten when older than this, so feed reads rarely write
+TOUCH_INTERVAL = timedelta(hours=1)
+
+
+def build_recommendation(
+    pool,
+    min_odds: float,
+    max_legs: int,
+    min_ev: Optional[float] = None,
+    leagues: Optional[Sequence[str]] = None,
+    risk_level: Optional[str] = None,
+) -> ParlayRecommendation:
+    """Build one parlay per risk level from a candidate pool.
+
+    * conservador: 2-3 legs with odds up to 2.5, confidence 75-90;
+    * equilibrado: 3-4 legs with odds 1.8-3.5, confidence 60-80;
+    * agresivo: 4+ legs with odds from 2.0, confidence 45-70.
+
+    Legs come from ``leagues`` when given, completed from the other leagues
+    only when those run short.  The parlay of the user's ``risk_level``
+    (``bajo``/``medio``/``alto``) comes first.  Risk levels without enough
+    candidates are left out.
+    """
+    parlays = []
+    risk_levels = []
+    preferred_level = PREFERENCE_RISK.get(risk_level)
+    for level in sorted(RISK_LEVELS, key=lambda level: level != preferred_level):
+        if level == "conservador":
+            legs = random.randint(2, 3)
+            confidence_range = (75, 90)
+        elif level == "equilibrado":
+            legs = random.randint(3, max(3, min(4, max_legs)))
+            confidence_range = (60, 80)
+        else:
+            legs = random.randint(4, max(4, max_legs))
+            confidence_range = (45, 70)
+        low, high = RISK_ODDS[level]
+        band = pool.select(max(min_odds, low), high, min_ev=min_ev)
+        preferred = pool.select(max(min_odds, low), high, leagues=leagues, min_ev=min_ev) if leagues else None
+
+        parlay = []
+        for position in pool.sample(band, legs, preferred=preferred):
+            bet = pool.candidate(position)
+            reasoning = random.choice(REASONING_OPTIONS).format(odds=bet.odds)
+            parlay.append(ParlayLeg(bet, random.randint(*confidence_range), reasoning))
+        if parlay:
+            parlays.append(parlay)
+            risk_levels.append(level)
+    return ParlayRecommendation(parlays=parlays, risk_levels=risk_levels, generated_at=datetime.utcnow())
+
+
+def candidate_document(pool, position: int) -> Dict[str, Any]:
+    """A pool selection as stored in a feed, with its model probability and EV."""
+    bet = pool.candidate(position)
+    ev = float(pool.ev[position])
+    return {
+        "event_id": bet.event_id,
+        "home_team": bet.home_team,
+        "away_team": bet.away_team,
+        "selection": bet.selection,
+        "odds": bet.odds,
+        "sport": bet.sport,
+        "sport_name": bet.sport_name,
+        "league": bet.league,
+        "bookmaker": bet.bookmaker,
+        "commence_time": bet.commence_time,
+        "probability": round(float(pool.probability[position]), 4),
+        "ev": round(ev, 4) if ev == ev else None,
+    }
+
+
+class PersonalizedFeeds:
+    """Preference storage plus the worker that keeps personalized feeds fresh."""
+
+    def __init__(
+        self,
+        db,
+        pool_for: Callable[[List[str]], Awaitable[Any]],
+        version_of: Optional[Callable[[str], int]] = None,
+        active_window: timedelta = timedelta(days=14),
+        candidates_per_sport: int = 20,
+        debounce: float = 2.0,
+    ) -> None:
+        self.preferences = db.user_preferences
+        self.feeds = db.user_feeds
+        self.pool_for = pool_for
+        self.version_of = version_of or (lambda sport: 0)
+        self.active_window = active_window
+        self.candidates_per_sport = candidates_per_sport
+        self.debounce = debounce
+        self._dirty: Set[str] = set()
+        self._wake = asyncio.Event()
+        # the event loop only keeps weak references to tasks
+        self._touches: Set[asyncio.Task] = set()
+
+    async def ensure_indexes(self) -> None:
+        await self.preferences.create_index([("user_id", ASCENDING)], unique=True, name="user_id")
+        await self.preferences.create_index(
+            [("preferred_sports", ASCENDING), ("last_seen_at", DESCENDING)], name="sports_last_seen"
+        )
+
+    # -- preferences -----------------------------------------------------------------
+
+    async def save_preferences(self, preferences: Dict[str, Any]) -> Dict[str, Any]:
+        """Upsert a user's preferences and rebuild their feed right away."""
+        now = datetime.utcnow()
+        fields = {name: preferences.get(name) for name in PREFERENCE_FIELDS}
+        fields.update(updated_at=now, last_seen_at=now)
+        await self.preferences.update_one(
+            {"user_id": preferences["user_id"]},
+            {
+                "$set": fields,
+                "$setOnInsert": {"id": preferences.get("id"), "created_at": preferences.get("created_at", now)},
+            },
+            upsert=True,
+        )
+        stored = await self.get_preferences(preferences["user_id"])
+        # a full rebuild: the user's sports may have changed
+        await self.feeds.replace_one({"_id": stored["user_id"]}, await self._feed_document(stored), upsert=True)
+        return stored
+
+    async def get_preferences(self, user_id: str) -> Optional[Dict[str, Any]]:
+        return await self.preferences.find_one({"user_id": user_id}, {"_id": 0})
+
+    # -- feeds ---------------------------------------------------------------------------
+
+    async def get_feed(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """The precomputed feed of a user: one keyed read, nothing is generated."""
+        feed = await self.feeds.find_one({"_id": user_id})
+        if feed is None:
+            return None
+        feed.pop("_id")
+        last_seen = feed.pop("last_seen_at", None)
+        now = datetime.utcnow()
+        if last_seen is None or now - last_seen > TOUCH_INTERVAL:
+            task = asyncio.create_task(self._touch(user_id, now))
+            self._touches.add(task)
+            task.add_done_callback(self._touches.discard)
+        return feed
+
+    async def _touch(self, user_id: str, now: datetime) -> None:
+        try:
+            await self.preferences.update_one({"user_id": user_id}, {"$set": {"last_seen_at": now}})
+            await self.feeds.update_one({"_id": user_id}, {"$set": {"last_seen_at": now}})
+        except Exception as e:
+            logger.warning(f"Error actualizando actividad de {user_id}: {str(e)}")
+
+    async def _sections(self, prefs: Dict[str, Any], sports: Sequence[str]) -> Dict[str, Any]:
+        """``$set`` fields for the given sports' candidates and the recommendation."""
+        user_sports = prefs.get("preferred_sports") or ["soccer"]
+        pool = await self.pool_for(user_sports)
+        min_odds = prefs.get("min_odds") or 1.5
+        min_ev = prefs.get("min_ev")
+        leagues = prefs.get("preferred_leagues") or None
+        risk_level = prefs.get("risk_level")
+        low, high = RISK_ODDS[PREFERENCE_RISK.get(risk_level, "equilibrado")]
+        low = max(min_odds, low)
+        fields: Dict[str, Any] = {}
+        for sport in sports:
+            band = pool.select(low, high, sports=[sport], min_ev=min_ev)
+            preferred = pool.select(low, high, sports=[sport], leagues=leagues, min_ev=min_ev) if leagues else None
+            fields[f"candidates.{sport}"] = [
+                candidate_document(pool, position)
+                for position in pool.top(band, self.candidates_per_sport, preferred=preferred)
+            ]
+            fields[f"sport_versions.{sport}"] = self.version_of(sport)
+        if len(pool):
+            recommendation = build_recommendation(
+                pool, min_odds, prefs.get("max_legs") or 4, min_ev, leagues=leagues, risk_level=risk_level
+            )
+            fields["recommendation"] = recommendation.to_document()
+        else:
+            fields["recommendation"] = None
+        fields["updated_at"] = datetime.utcnow()
+        fields["last_seen_at"] = prefs.get("last_seen_at")
+        return fields
+
+    async def _feed_document(self, prefs: Dict[str, Any]) -> Dict[str, Any]:
+        sports = prefs.get("preferred_sports") or ["soccer"]
+        fields = await self._sections(prefs, sports)
+        document: Dict[str, Any] = {"user_id": prefs["user_id"], "candidates": {}, "sport_versions": {}}
+        for key, value in fields.items():
+            if "." in key:
+                section, sport = key.split(".", 1)
+                document[section][sport] = value
+            else:
+                document[key] = value
+        return document
+
+    async def refresh_sports(self, sports: Sequence[str]) -> int:
+        """Refresh the feed sections of every active user following ``sports``.
+
+        Returns:
+            The number of feeds updated.
+        """
+        sports = sorted(set(sports))
+        if not sports:
+            return 0
+        cursor = self.preferences.find(
+            {
+                "preferred_sports": {"$in": sports},
+                "last_seen_at": {"$gte": datetime.utcnow() - self.active_window},
+            },
+            {"_id": 0},
+        )
+        updated = 0
+        operations: List[UpdateOne] = []
+        async for prefs in cursor:
+            affected = [sport for sport in prefs.get("preferred_sports") or [] if sport in sports]
+            try:
+                fields = await self._sections(prefs, affected)
+            except Exception as e:
+                logger.warning(f"Error generando el feed de {prefs.get('user_id')}: {str(e)}")
+                continue
+            operations.append(
+                UpdateOne({"_id": prefs["user_id"]}, {"$set": {"user_id": prefs["user_id"], **fields}}, upsert=True)
+            )
+            if len(operations) >= BATCH_SIZE:
+                await self.feeds.bulk_write(operations, ordered=False)
+                updated += len(operations)
+                operations = []
+        if operations:
+            await self.feeds.bulk_write(operations, ordered=False)
+            updated += len(operations)
+        return updated
+
+    # -- worker --------------------------------------------------------------------------
+
+    def notify(self, sport: str) -> None:
+        """Mark a sport as changed; the worker refreshes the affected feeds."""
+        self._dirty.add(sport)
+        self._wake.set()
+
+    async def run(self) -> None:
+        """Worker loop: wait for ingests, coalesce them and refresh the affected feeds."""
+        while True:
+            await self._wake.wait()
+            # let ingests of several leagues / sports land before refreshing
+            await asyncio.sleep(self.debounce)
+            self._wake.clear()
+            sports, self._dirty = self._dirty, set()
+            try:
+                updated = await self.refresh_sports(sports)
+                logger.info(f"Feeds personalizados actualizados: {updated} ({', '.join(sorted(sports))})")
+            except Exception as e:
+                logger.warning(f"Error actualizando feeds personalizados: {str(e)}")
+
+
+__all__ = [
+    "PersonalizedFeeds",
+    "build_recommendation",
+    "candidate_document",
+]
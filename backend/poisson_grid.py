@@ -0,0 +1,290 @@
+"""
+poisson_grid.py
+===============
+
+Precomputed Poisson market probabilities with bilinear interpolation.
+
+:func:`tipstars_prediction.poisson_probabilities` sums the full scoreline
+matrix on every call, which is wasteful when the same narrow range of goal
+expectations (roughly 0.2–4.0 per team in football) is priced over and over,
+e.g. by the bisections of :func:`tipstars_prediction.implied_lambdas`.
+:class:`PoissonGrid` tabulates, on a regular grid of ``(lambda_home,
+lambda_away)`` over ``[LAMBDA_MIN, LAMBDA_MAX]``:
+
+* ``home`` / ``draw`` / ``away`` – exactly what ``poisson_probabilities``
+  returns (scores up to ``max_goals`` each, renormalised);
+* ``over_0.5`` … ``over_5.5`` – total goals above the line (``under`` is
+  ``1 - over``), from the Poisson law of the total;
+* ``btts`` – both teams score, ``(1 - e^-λh)(1 - e^-λa)``.
+
+Lookups interpolate bilinearly between the four surrounding grid points.  For
+a function with bounded second derivatives the bilinear error on a cell of
+side ``h`` is at most ``h² / 8 · (max |f_xx| + max |f_yy|)``; the grid measures
+those second derivatives from its own second differences when it is loaded
+and exposes the resulting per-market bound in :attr:`PoissonGrid.error_bounds`.
+With the default step of 0.01 every market stays below ``TOLERANCE`` (the
+largest bound is about 2e-5, the stored float32 values add less than 1e-7).
+Points outside the grid are priced with the exact formulas instead.
+
+The table is built once, written atomically to a ``.npy`` file and opened
+with ``np.load(mmap_mode="r")``, so every worker process on the host maps
+the same pages from the OS page cache instead of holding its own copy.  The
+file name includes the grid parameters and ``GRID_VERSION``, so a change of
+layout simply builds a new file.
+
+Run ``python -m benchmarks.bench_poisson_grid`` from ``backend`` for the
+speed-up and the measured error against the exact method.
+
+Example usage::
+
+    grid = shared_grid()
+    grid.probabilities(1.45, 1.10)["over_2.5"]
+    grid.poisson_probabilities(1.45, 1.10)          # drop-in for the 1X2 function
+    prices = grid.lookup(lambda_home_array, lambda_away_array)
+    prices["home"], prices["btts"]
+
+"""
+
+from __future__ import annotations
+
+import logging
+import math
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from tipstars_prediction import poisson_probabilities
+
+logger = logging.getLogger(__name__)
+
+GRID_VERSION = 1
+
+LAMBDA_MIN = 0.2
+LAMBDA_MAX = 4.0
+DEFAULT_STEP = 0.01
+
+# scores per team summed for 1X2, as in ``poisson_probabilities``
+MAX_GOALS = 10
+
+TOTAL_LINES = (0.5, 1.5, 2.5, 3.5, 4.5, 5.5)
+MARKETS = ("home", "draw", "away", "btts", *(f"over_{line}" for line in TOTAL_LINES))
+
+# documented agreement with the exact formulas inside the grid (absolute probability)
+TOLERANCE = 5e-5
+
+_shared: Optional["PoissonGrid"] = None
+_shared_lock = threading.Lock()
+
+
+def _poisson_pmf(lam: np.ndarray, max_goals: int) -> np.ndarray:
+    """``P(k goals)`` for ``k = 0..max_goals``, one row per expectation."""
+    lam = np.asarray(lam, dtype=np.float64)
+    k = np.arange(max_goals + 1)
+    log_pmf = k * np.log(lam)[..., None] - lam[..., None] - np.array([math.lgamma(i + 1) for i in k])
+    return np.exp(log_pmf)
+
+
+def exact_markets(lambda_home, lambda_away, max_goals: int = MAX_GOALS) -> Dict[str, np.ndarray]:
+    """Exact probabilities of every grid market for paired arrays of expectations."""
+    lambda_home = np.asarray(lambda_home, dtype=np.float64)
+    lambda_away = np.asarray(lambda_away, dtype=np.float64)
+    home_pmf = _poisson_pmf(lambda_home, max_goals)
+    away_pmf = _poisson_pmf(lambda_away, max_goals)
+    # cumulative sums give P(away < i) and P(away <= i) for every home score i
+    away_cdf = np.cumsum(away_pmf, axis=-1)
+    away_below = away_cdf - away_pmf
+    home = (home_pmf * away_below).sum(axis=-1)
+    draw = (home_pmf * away_pmf).sum(axis=-1)
+    away = (home_pmf * (away_cdf[..., -1:] - away_cdf)).sum(axis=-1)
+    total = home + draw + away
+    markets = {
+        "home": home / total,
+        "draw": draw / total,
+        "away": away / total,
+        "btts": -np.expm1(-lambda_home) * -np.expm1(-lambda_away),
+    }
+    goals_cdf = np.cumsum(_poisson_pmf(lambda_home + lambda_away, int(max(TOTAL_LINES))), axis=-1)
+    for line in TOTAL_LINES:
+        markets[f"over_{line}"] = 1.0 - goals_cdf[..., int(line)]
+    return markets
+
+
+def _build_table(step: float) -> np.ndarray:
+    axis = _axis(step)
+    lambda_home, lambda_away = np.meshgrid(axis, axis, indexing="ij")
+    markets = exact_markets(lambda_home, lambda_away)
+    # markets last, so the four corners of a lookup are contiguous rows
+    return np.stack([markets[name] for name in MARKETS], axis=-1).astype(np.float32)
+
+
+def _axis(step: float) -> np.ndarray:
+    size = int(round((LAMBDA_MAX - LAMBDA_MIN) / step)) + 1
+    return LAMBDA_MIN + step * np.arange(size)
+
+
+def default_path(step: float = DEFAULT_STEP) -> Path:
+    """``$POISSON_GRID_DIR`` (or the temp dir) / file name keyed by the grid parameters."""
+    directory = Path(os.environ.get("POISSON_GRID_DIR") or tempfile.gettempdir())
+    name = f"poisson_grid_v{GRID_VERSION}_{LAMBDA_MIN}_{LAMBDA_MAX}_{step}_{MAX_GOALS}.npy"
+    return directory / name
+
+
+class PoissonGrid:
+    """Memory-mapped table of Poisson market probabilities."""
+
+    def __init__(self, table: np.ndarray, step: float) -> None:
+        # a plain ndarray view of the mapping: same pages, without np.memmap's per-operation overhead
+        self.table = np.asarray(table)
+        self.step = step
+        self.size = table.shape[0]
+        self._flat = self.table.reshape(-1, len(MARKETS))
+        self._columns = {name: index for index, name in enumerate(MARKETS)}
+        self.error_bounds = self._error_bounds()
+
+    @classmethod
+    def load(cls, path: Optional[Path] = None, step: float = DEFAULT_STEP) -> "PoissonGrid":
+        """Map the grid file, building (and writing) it first if it is missing or invalid."""
+        path = Path(path) if path is not None else default_path(step)
+        expected = (len(_axis(step)), len(_axis(step)), len(MARKETS))
+        try:
+            table = np.load(path, mmap_mode="r")
+            if table.shape == expected and table.dtype == np.float32:
+                return cls(table, step)
+            logger.warning(f"Tabla de Poisson con formato inesperado en {path}, se reconstruye")
+        except (OSError, ValueError):
+            pass
+        cls.build(path, step)
+        return cls(np.load(path, mmap_mode="r"), step)
+
+    @staticmethod
+    def build(path: Path, step: float = DEFAULT_STEP) -> None:
+        """Compute the table and write it atomically (concurrent builders are harmless)."""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        table = _build_table(step)
+        handle, temporary = tempfile.mkstemp(dir=path.parent, prefix=path.stem, suffix=".tmp")
+        try:
+            with os.fdopen(handle, "wb") as file:
+                np.save(file, table)
+            os.replace(temporary, path)
+        except BaseException:
+            Path(temporary).unlink(missing_ok=True)
+            raise
+
+    def _error_bounds(self) -> Dict[str, float]:
+        """Bilinear error bound per market, ``(max |Δ²x f| + max |Δ²y f|) / 8``.
+
+        Second differences average the curvature over two cells, so a 5% margin
+        covers its change across one cell at the edges of the grid.
+        """
+        table = np.asarray(self.table, dtype=np.float64)
+        second_x = np.abs(table[2:, :, :] - 2 * table[1:-1, :, :] + table[:-2, :, :]).max(axis=(0, 1))
+        second_y = np.abs(table[:, 2:, :] - 2 * table[:, 1:-1, :] + table[:, :-2, :]).max(axis=(0, 1))
+        # float32 storage adds at most half an ulp of 1.0
+        bounds = 1.05 * (second_x + second_y) / 8 + np.finfo(np.float32).eps
+        return {name: float(bounds[index]) for name, index in self._columns.items()}
+
+    def contains(self, lambda_home: float, lambda_away: float) -> bool:
+        return LAMBDA_MIN <= lambda_home <= LAMBDA_MAX and LAMBDA_MIN <= lambda_away <= LAMBDA_MAX
+
+    def lookup(
+        self,
+        lambda_home,
+        lambda_away,
+        markets: Optional[Sequence[str]] = None,
+    ) -> Dict[str, np.ndarray]:
+        """Interpolated probabilities for paired arrays of goal expectations.
+
+        Args:
+            lambda_home: expected home goals, any array shape.
+            lambda_away: expected away goals, same shape.
+            markets: subset of ``MARKETS`` to return (all by default).
+
+        Returns:
+            A dict mapping each market to an array shaped like the inputs.
+            Pairs outside the grid are computed with :func:`exact_markets`.
+        """
+        lambda_home = np.asarray(lambda_home, dtype=np.float64)
+        lambda_away = np.asarray(lambda_away, dtype=np.float64)
+        names = list(markets) if markets is not None else list(MARKETS)
+        columns = [self._columns[name] for name in names]
+
+        x = (lambda_home - LAMBDA_MIN) / self.step
+        y = (lambda_away - LAMBDA_MIN) / self.step
+        last = self.size - 1
+        inside = (x >= 0) & (x <= last) & (y >= 0) & (y <= last)
+        x = np.clip(x, 0, last)
+        y = np.clip(y, 0, last)
+        i = np.minimum(x.astype(np.intp), last - 1)
+        j = np.minimum(y.astype(np.intp), last - 1)
+        # float32 weights keep the arithmetic in the table's precision (half the memory traffic)
+        tx = (x - i).astype(np.float32).reshape(-1, 1)
+        ty = (y - j).astype(np.float32).reshape(-1, 1)
+        # flat row of the lower-left corner; the other corners are +1, +size and +size+1
+        corner = (i * self.size + j).ravel()
+        table = self._flat if len(columns) == len(MARKETS) else self._flat[:, columns]
+        c00 = table.take(corner, axis=0)
+        c01 = table.take(corner + 1, axis=0)
+        c10 = table.take(corner + self.size, axis=0)
+        c11 = table.take(corner + self.size + 1, axis=0)
+        low = c00 + (c01 - c00) * ty
+        high = c10 + (c11 - c10) * ty
+        values = low + (high - low) * tx
+        result = {name: values[:, k].astype(np.float64).reshape(lambda_home.shape) for k, name in enumerate(names)}
+        if not inside.all():
+            exact = exact_markets(lambda_home[~inside], lambda_away[~inside])
+            for name in names:
+                result[name][~inside] = exact[name]
+        return result
+
+    def _interpolate(self, lambda_home: float, lambda_away: float, markets: int) -> List[float]:
+        """Scalar bilinear interpolation of the first ``markets`` columns (plain floats)."""
+        x = (lambda_home - LAMBDA_MIN) / self.step
+        y = (lambda_away - LAMBDA_MIN) / self.step
+        i = min(int(x), self.size - 2)
+        j = min(int(y), self.size - 2)
+        tx = x - i
+        ty = y - j
+        (c00, c01), (c10, c11) = self.table[i:i + 2, j:j + 2, :markets].tolist()
+        w00, w01, w10, w11 = (1 - tx) * (1 - ty), (1 - tx) * ty, tx * (1 - ty), tx * ty
+        return [w00 * c00[k] + w01 * c01[k] + w10 * c10[k] + w11 * c11[k] for k in range(markets)]
+
+    def probabilities(self, lambda_home: float, lambda_away: float) -> Dict[str, float]:
+        """All markets for one pair of expectations."""
+        if not self.contains(lambda_home, lambda_away):
+            return {name: float(value) for name, value in exact_markets(lambda_home, lambda_away).items()}
+        return dict(zip(MARKETS, self._interpolate(lambda_home, lambda_away, len(MARKETS))))
+
+    def poisson_probabilities(
+        self, lambda_home: float, lambda_away: float, max_goals: int = MAX_GOALS
+    ) -> Dict[str, float]:
+        """Drop-in for :func:`tipstars_prediction.poisson_probabilities`.
+
+        Uses the exact function outside the grid or for another ``max_goals``.
+        """
+        if max_goals != MAX_GOALS or not self.contains(lambda_home, lambda_away):
+            return poisson_probabilities(lambda_home, lambda_away, max_goals)
+        home, draw, away = self._interpolate(lambda_home, lambda_away, 3)
+        return {"home": home, "draw": draw, "away": away}
+
+
+def shared_grid(path: Optional[Path] = None) -> PoissonGrid:
+    """The process-wide grid, mapped (or built) on first use."""
+    global _shared
+    if _shared is None:
+        with _shared_lock:
+            if _shared is None:
+                _shared = PoissonGrid.load(path)
+    return _shared
+
+
+__all__ = [
+    "MARKETS",
+    "PoissonGrid",
+    "TOLERANCE",
+    "exact_markets",
+    "shared_grid",
+]
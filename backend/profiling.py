@@ -0,0 +1,334 @@
+"""
+profiling.py
+============
+
+Production profiling hooks for the API worker.
+
+* :class:`SamplingProfiler` – a background thread samples the Python stacks
+  of the event-loop thread (or of every thread) every few milliseconds via
+  ``sys._current_frames()`` and aggregates them as *folded stacks*
+  (``frame;frame;frame count`` per line), the input format of
+  ``flamegraph.pl``, speedscope and inferno.  Nothing is instrumented, so
+  the overhead is one stack walk per interval and zero when idle.
+* :class:`RequestProfilingMiddleware` – an ASGI middleware that profiles a
+  single request when an admin sends ``X-Profile: 1`` (``todos`` samples all
+  threads, e.g. work sent to ``asyncio.to_thread``).  The event loop runs
+  every request, so loop-thread samples are kept only while the profiled
+  request's own coroutine chain is on the stack; other threads sampled with
+  ``todos`` are not filtered and may include other requests' work.  The
+  folded output is kept in a :class:`ProfileStore` and its id returned in
+  ``X-Profile-Id``.
+* :class:`LoopLagMonitor` – measures how late the event loop wakes up from a
+  short sleep.  A watchdog thread notices when the loop stops answering for
+  longer than the threshold and logs the stack that is blocking it, i.e. the
+  coroutine doing blocking work.
+* :class:`SlowQueryListener` – a ``pymongo`` ``CommandListener`` logging every
+  command slower than a threshold together with its filter or pipeline; only
+  slow commands are summarized.
+
+Example usage::
+
+    profiler = SamplingProfiler(interval=0.005, thread_ids=[threading.get_ident()])
+    profiler.start()
+    await asyncio.sleep(10)
+    folded = folded_stacks(profiler.stop())
+
+    client = AsyncIOMotorClient(url, event_listeners=[SlowQueryListener(threshold_ms=100)])
+
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+import uuid
+from collections import Counter, OrderedDict, deque
+from datetime import datetime
+from typing import Any, Callable, Deque, Dict, List, Optional, Sequence
+
+from bson import json_util
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+# commands that are never worth reporting
+IGNORED_COMMANDS = {"hello", "ismaster", "isMaster", "ping", "endSessions", "saslStart", "saslContinue", "buildInfo"}
+
+# characters of a filter / pipeline kept in logs
+MAX_FILTER_CHARS = 500
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    path = code.co_filename.replace(os.sep, "/").rsplit("/", 2)
+    location = "/".join(path[-2:])
+    return f"{code.co_name} ({location}:{code.co_firstlineno})".replace(";", ":")
+
+
+def folded_stacks(samples: Counter) -> str:
+    """Folded-stack text (``root;...;leaf count``), heaviest stacks first."""
+    return "\n".join(f"{stack} {count}" for stack, count in samples.most_common())
+
+
+class SamplingProfiler:
+    """Samples thread stacks from a background thread until stopped."""
+
+    def __init__(
+        self,
+        interval: float = 0.005,
+        thread_ids: Optional[Sequence[int]] = None,
+        anchor=None,
+        anchor_thread: Optional[int] = None,
+    ) -> None:
+        self.interval = interval
+        self.thread_ids = set(thread_ids) if thread_ids is not None else None
+        # samples of ``anchor_thread`` only count while the frame ``anchor`` is on its stack
+        self.anchor = anchor
+        self.anchor_thread = anchor_thread
+        self.samples: Counter = Counter()
+        self.sample_count = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> Counter:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self.samples
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own or (self.thread_ids is not None and thread_id not in self.thread_ids):
+                    continue
+                stack = []
+                anchored = self.anchor is None or thread_id != self.anchor_thread
+                while frame is not None:
+                    anchored = anchored or frame is self.anchor
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                if not anchored:
+                    continue
+                if self.thread_ids is None or len(self.thread_ids) > 1:
+                    stack.append(f"thread {names.get(thread_id, thread_id)}")
+                self.samples[";".join(reversed(stack))] += 1
+            self.sample_count += 1
+
+
+class ProfileStore:
+    """The most recent per-request profiles, oldest evicted first."""
+
+    def __init__(self, max_entries: int = 50) -> None:
+        self.max_entries = max_entries
+        self._profiles: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+    def add(self, profile_id: str, path: str, elapsed_ms: float, samples: Counter) -> None:
+        self._profiles[profile_id] = {
+            "id": profile_id,
+            "path": path,
+            "ms": round(elapsed_ms, 2),
+            "muestras": sum(samples.values()),
+            "created_at": datetime.utcnow(),
+            "folded": folded_stacks(samples),
+        }
+        while len(self._profiles) > self.max_entries:
+            self._profiles.popitem(last=False)
+
+    def get(self, profile_id: str) -> Optional[Dict[str, Any]]:
+        return self._profiles.get(profile_id)
+
+    def summaries(self) -> List[Dict[str, Any]]:
+        return [
+            {key: value for key, value in profile.items() if key != "folded"}
+            for profile in reversed(self._profiles.values())
+        ]
+
+
+class RequestProfilingMiddleware:
+    """Profile single requests on demand (``X-Profile: 1`` or ``todos`` from an admin)."""
+
+    def __init__(
+        self,
+        app,
+        store: ProfileStore,
+        is_admin: Callable[[Optional[str]], bool],
+        interval: float = 0.001,
+        max_concurrent: int = 4,
+    ) -> None:
+        self.app = app
+        self.store = store
+        self.is_admin = is_admin
+        self.interval = interval
+        self.max_concurrent = max_concurrent
+        self._active = 0
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        mode = None
+        token = None
+        for name, value in scope["headers"]:
+            if name == b"x-profile":
+                mode = value.decode("latin-1")
+            elif name == b"x-admin-token":
+                token = value.decode("latin-1")
+        if mode not in ("1", "todos") or self._active >= self.max_concurrent or not self.is_admin(token):
+            return await self.app(scope, receive, send)
+
+        profile_id = uuid.uuid4().hex[:12]
+
+        async def send_with_id(message) -> None:
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", []), (b"x-profile-id", profile_id.encode())]
+            await send(message)
+
+        loop_thread = threading.get_ident()
+        thread_ids = None if mode == "todos" else [loop_thread]
+        # this coroutine's frame is on the loop thread's stack exactly while this request runs
+        # (inner middlewares must not move the request to another task, as BaseHTTPMiddleware does)
+        profiler = SamplingProfiler(self.interval, thread_ids, anchor=sys._getframe(), anchor_thread=loop_thread)
+        self._active += 1
+        started = time.perf_counter()
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            samples = profiler.stop()
+            self._active -= 1
+            self.store.add(profile_id, scope["path"], (time.perf_counter() - started) * 1000, samples)
+
+
+class LoopLagMonitor:
+    """Event-loop lag statistics plus a watchdog reporting the blocking stack."""
+
+    def __init__(self, interval: float = 0.1, threshold: float = 0.1, window: int = 600) -> None:
+        self.interval = interval
+        self.threshold = threshold
+        self._lags: Deque[float] = deque(maxlen=window)
+        self._heartbeat = time.monotonic()
+        self._loop_thread: Optional[int] = None
+        self._stop = threading.Event()
+        self._reported_for: Optional[float] = None
+        self.blocks = 0
+        self.last_block: Optional[Dict[str, Any]] = None
+
+    async def run(self) -> None:
+        """Measure lag forever; starts the watchdog thread on first use."""
+        self._loop_thread = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        watchdog.start()
+        try:
+            while True:
+                heartbeat = self._heartbeat
+                await asyncio.sleep(self.interval)
+                now = time.monotonic()
+                self._heartbeat = now
+                lag = now - heartbeat - self.interval
+                self._lags.append(lag)
+                # long stalls were already reported with their stack by the watchdog
+                if lag > self.threshold and self._reported_for != heartbeat:
+                    logger.warning(f"Retraso del bucle de eventos: {lag * 1000:.0f} ms")
+        finally:
+            self._stop.set()
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.threshold / 2):
+            heartbeat = self._heartbeat
+            stalled = time.monotonic() - heartbeat - self.interval
+            if stalled <= self.threshold or self._reported_for == heartbeat:
+                continue
+            # the loop has not woken up: whatever it is running right now is blocking it
+            frame = sys._current_frames().get(self._loop_thread)
+            stack = "".join(traceback.format_stack(frame, limit=15)) if frame is not None else ""
+            self._reported_for = heartbeat
+            self.blocks += 1
+            self.last_block = {"ms": round(stalled * 1000), "at": datetime.utcnow(), "stack": stack}
+            logger.warning(f"Bucle de eventos bloqueado más de {stalled * 1000:.0f} ms en:\n{stack}")
+
+    def stats(self) -> Dict[str, Any]:
+        lags = sorted(self._lags)
+        if not lags:
+            return {"muestras": 0, "bloqueos": self.blocks, "ultimo_bloqueo": self.last_block}
+        return {
+            "muestras": len(lags),
+            "lag_ms_p50": round(lags[len(lags) // 2] * 1000, 2),
+            "lag_ms_p99": round(lags[int(0.99 * (len(lags) - 1))] * 1000, 2),
+            "lag_ms_max": round(lags[-1] * 1000, 2),
+            "bloqueos": self.blocks,
+            "ultimo_bloqueo": self.last_block,
+        }
+
+
+def _command_summary(command_name: str, command: Dict[str, Any]) -> Dict[str, Any]:
+    target = command.get(command_name)
+    details = (
+        command.get("filter")
+        or command.get("pipeline")
+        or command.get("query")
+        or [op.get("q") for op in command.get("updates", command.get("deletes", []))]
+        or None
+    )
+    summary = {"command": command_name, "collection": target if isinstance(target, str) else None}
+    if details:
+        summary["filter"] = json_util.dumps(details)[:MAX_FILTER_CHARS]
+    if command.get("sort"):
+        summary["sort"] = json_util.dumps(command["sort"])[:MAX_FILTER_CHARS]
+    return summary
+
+
+class SlowQueryListener(monitoring.CommandListener):
+    """Log Mongo commands slower than ``threshold_ms`` with their filters."""
+
+    def __init__(self, threshold_ms: float = 100.0, keep: int = 100) -> None:
+        self.threshold_ms = threshold_ms
+        self.recent: Deque[Dict[str, Any]] = deque(maxlen=keep)
+        self._started: Dict[tuple, tuple] = {}
+
+    def started(self, event) -> None:
+        if event.command_name in IGNORED_COMMANDS:
+            return
+        # just a reference: the command is only serialized if it turns out to be slow
+        self._started[(event.connection_id, event.request_id)] = (event.command_name, event.command)
+
+    def succeeded(self, event) -> None:
+        self._finish(event, failed=False)
+
+    def failed(self, event) -> None:
+        self._finish(event, failed=True)
+
+    def _finish(self, event, failed: bool) -> None:
+        started = self._started.pop((event.connection_id, event.request_id), None)
+        if started is None:
+            return
+        duration_ms = event.duration_micros / 1000
+        if duration_ms < self.threshold_ms:
+            return
+        summary = _command_summary(*started)
+        entry = {**summary, "ms": round(duration_ms, 1), "failed": failed, "at": datetime.utcnow()}
+        self.recent.append(entry)
+        logger.warning(
+            f"Consulta Mongo lenta ({duration_ms:.0f} ms): {summary['command']} "
+            f"{summary.get('collection')} filtro={summary.get('filter')}"
+        )
+
+
+__all__ = [
+    "LoopLagMonitor",
+    "ProfileStore",
+    "RequestProfilingMiddleware",
+    "SamplingProfiler",
+    "SlowQueryListener",
+    "folded_stacks",
+]
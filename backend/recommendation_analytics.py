@@ -0,0 +1,391 @@
+"""
+recommendation_analytics.py
+===========================
+
+Incremental evaluation of stored recommendations.
+
+Every leg of every stored recommendation (``mock_parlay_recommendations``)
+and every favourite is exploded once into the ``recommendation_legs``
+collection and then moves through three states:
+
+``pending``
+    waiting for kick-off.
+``closed``
+    the closing price has been looked up in the odds time series and the
+    closing-line value (CLV) computed: ``odds_taken / closing_odds - 1``.
+``settled``
+    the final score is known and the leg has been graded as won or lost.
+``void``
+    no final score turned up while the scores feed still covered the event
+    (``SCORES_DAYS``); the leg is no longer looked up.
+
+Each state transition adds its contribution to the ``analytics_rollups``
+collection with ``$inc``, so rollups are never recomputed from the history
+collections.  A transition is a conditional update on the previous state, and
+only the run whose update moved the leg adds it, so overlapping runs (several
+workers, the manual endpoint) never count a leg twice.  Dashboards read the rollups and derive CLV, hit rate, ROI (flat
+one-unit stakes) and calibration per risk tier and per sport.
+
+Example usage::
+
+    analytics = RecommendationAnalytics(db, odds_timeseries, odds_api_key)
+    await analytics.ensure_indexes()
+    await analytics.run()
+    report = await analytics.report()
+
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import httpx
+from pymongo import ASCENDING, UpdateOne
+
+from odds_timeseries import OddsTimeSeriesStore, parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+STATE_ID = "recommendation_analytics"
+
+# Spanish selection labels used by the parlay generator mapped to time-series outcomes
+SELECTION_OUTCOMES = {"local": "h2h:home", "visitante": "h2h:away", "empate": "h2h:draw"}
+
+# confidence scores are grouped in bins of this width for calibration
+CALIBRATION_BIN = 10
+
+# how long after kick-off a leg is considered ready for settlement
+SETTLE_AFTER = timedelta(hours=3)
+
+# days of finished games returned by the scores endpoint; older legs without a
+# result can never be settled and are voided
+SCORES_DAYS = 3
+SETTLE_GIVE_UP = timedelta(days=SCORES_DAYS)
+
+# documents are only ingested once older than this: writes are buffered (write-behind)
+# and may land after newer ones, which would otherwise fall behind the watermark.
+# The server raises it to the write-behind retry window.
+INGEST_DELAY = timedelta(minutes=1)
+
+# (leg, update, rollup increments or None) for one conditional state transition
+Transition = Tuple[Dict[str, Any], Dict[str, Any], Optional[Dict[str, Any]]]
+
+
+def calibration_bin(confidence: Optional[float]) -> Optional[str]:
+    """Return the calibration bin label (e.g. ``"70"``) for a confidence score."""
+    if confidence is None:
+        return None
+    lower = int(min(max(confidence, 0), 99) // CALIBRATION_BIN * CALIBRATION_BIN)
+    return str(lower)
+
+
+def leg_won(selection: str, home_score: float, away_score: float) -> bool:
+    """Grade a 1X2 selection against a final score."""
+    if selection == "local":
+        return home_score > away_score
+    if selection == "visitante":
+        return away_score > home_score
+    if selection == "empate":
+        return home_score == away_score
+    raise ValueError(f"Selección desconocida '{selection}'")
+
+
+def rollup_keys(leg: Dict[str, Any]) -> List[str]:
+    """Rollup documents a leg contributes to."""
+    tier = leg.get("risk_tier") or "sin_nivel"
+    sport = leg.get("sport") or "desconocido"
+    return ["total", f"nivel:{tier}", f"deporte:{sport}", f"nivel_deporte:{tier}:{sport}"]
+
+
+def summarize_rollup(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """Derive dashboard metrics from a raw rollup document."""
+    clv_n = doc.get("clv_n", 0)
+    settled = doc.get("settled", 0)
+    staked = doc.get("staked", 0.0)
+    calibration = []
+    for label, stats in sorted(doc.get("calibration", {}).items(), key=lambda item: int(item[0])):
+        n = stats.get("n", 0)
+        calibration.append({
+            "confianza_desde": int(label),
+            "confianza_hasta": int(label) + CALIBRATION_BIN,
+            "apuestas": n,
+            "acierto_real": round(stats.get("hits", 0) / n, 4) if n else None,
+            "probabilidad_media": round(stats.get("confidence_sum", 0.0) / n / 100, 4) if n else None,
+        })
+    return {
+        "clave": doc["_id"],
+        "apuestas": doc.get("legs", 0),
+        "clv_medio": round(doc.get("clv_sum", 0.0) / clv_n, 4) if clv_n else None,
+        "clv_positivo": round(doc.get("clv_beat", 0) / clv_n, 4) if clv_n else None,
+        "con_cierre": clv_n,
+        "liquidadas": settled,
+        "anuladas": doc.get("void", 0),
+        "tasa_acierto": round(doc.get("hits", 0) / settled, 4) if settled else None,
+        "roi": round((doc.get("returned", 0.0) - staked) / staked, 4) if staked else None,
+        "calibracion": calibration,
+    }
+
+
+def explode_recommendation(rec: Dict[str, Any]) -> Iterable[Dict[str, Any]]:
+    """Yield one leg document per bet of a stored parlay recommendation."""
+    risk_levels = rec.get("risk_levels", [])
+    for i, parlay in enumerate(rec.get("parlays", [])):
+        tier = risk_levels[i] if i < len(risk_levels) else None
+        for j, bet in enumerate(parlay):
+            yield _leg_document(f"{rec['id']}:{i}:{j}", "recomendacion", tier, bet, rec.get("generated_at"))
+
+
+def explode_favorite(favorite: Dict[str, Any]) -> Iterable[Dict[str, Any]]:
+    """Yield the leg document for a stored favourite, if it describes a bet."""
+    bet = favorite.get("bet_data") or {}
+    if "odds" in bet and "selection" in bet:
+        yield _leg_document(f"fav:{favorite['id']}", "favorito", "favorito", bet, favorite.get("created_at"))
+
+
+def _leg_document(leg_id: str, source: str, tier: Optional[str], bet: Dict[str, Any], created_at) -> Dict[str, Any]:
+    commence_time = bet.get("commence_time")
+    if isinstance(commence_time, str):
+        commence_time = parse_timestamp(commence_time)
+    trackable = bool(bet.get("event_id")) and commence_time is not None and bet.get("selection") in SELECTION_OUTCOMES
+    return {
+        "_id": leg_id,
+        "source": source,
+        "risk_tier": tier,
+        "sport": bet.get("sport"),
+        "league": bet.get("league"),
+        "event_id": bet.get("event_id"),
+        "bookmaker": bet.get("bookmaker"),
+        "selection": bet.get("selection"),
+        "odds": float(bet.get("odds", 0) or 0),
+        "confidence": bet.get("confidence_score"),
+        "commence_time": commence_time,
+        "created_at": created_at,
+        "status": "pending" if trackable else "untracked",
+    }
+
+
+class RecommendationAnalytics:
+    """Incremental CLV / performance pipeline over stored recommendations."""
+
+    def __init__(
+        self,
+        db,
+        odds_timeseries: OddsTimeSeriesStore,
+        odds_api_key: Optional[str] = None,
+        batch_size: int = 1000,
+        ingest_delay: timedelta = INGEST_DELAY,
+    ) -> None:
+        self.db = db
+        self.odds_timeseries = odds_timeseries
+        self.odds_api_key = odds_api_key
+        self.batch_size = batch_size
+        self.ingest_delay = ingest_delay
+
+    async def ensure_indexes(self) -> None:
+        await self.db.recommendation_legs.create_index(
+            [("status", ASCENDING), ("commence_time", ASCENDING)], name="status_commence"
+        )
+        await self.db.event_results.create_index([("event_id", ASCENDING)], name="event_id", unique=True)
+
+    async def run(self, now: Optional[datetime] = None) -> Dict[str, int]:
+        """Process everything that became evaluable since the previous run."""
+        now = now or datetime.utcnow()
+        ingested = await self._ingest_new(now)
+        closed = await self._close_legs(now)
+        settled, voided = await self._settle_legs(now)
+        return {"nuevas": ingested, "cerradas": closed, "liquidadas": settled, "anuladas": voided}
+
+    async def report(self) -> Dict[str, List[Dict[str, Any]]]:
+        """Read the precomputed rollups grouped by dimension."""
+        docs = await self.db.analytics_rollups.find().to_list(None)
+        report: Dict[str, List[Dict[str, Any]]] = {"total": [], "nivel": [], "deporte": [], "nivel_deporte": []}
+        for doc in docs:
+            dimension = doc["_id"].split(":", 1)[0]
+            report.setdefault(dimension, []).append(summarize_rollup(doc))
+        return report
+
+    async def _ingest_new(self, now: datetime) -> int:
+        state = await self.db.analytics_state.find_one({"_id": STATE_ID}) or {}
+        ingested = 0
+        for collection, field, explode in (
+            ("mock_parlay_recommendations", "generated_at", explode_recommendation),
+            ("favorites", "created_at", explode_favorite),
+        ):
+            # the watermark is (field, _id): several documents may share a timestamp
+            watermark, watermark_id = state.get(collection), state.get(f"{collection}_id")
+            query: Dict[str, Any] = {field: {"$lte": now - self.ingest_delay}}
+            if watermark and watermark_id is not None:
+                query["$or"] = [{field: {"$gt": watermark}}, {field: watermark, "_id": {"$gt": watermark_id}}]
+            elif watermark:
+                query[field]["$gte"] = watermark
+            docs = await self.db[collection].find(query).sort([(field, ASCENDING), ("_id", ASCENDING)]).to_list(self.batch_size)
+            if not docs:
+                continue
+            legs = [leg for doc in docs for leg in explode(doc)]
+            if legs:
+                result = await self.db.recommendation_legs.bulk_write(
+                    [UpdateOne({"_id": leg["_id"]}, {"$setOnInsert": leg}, upsert=True) for leg in legs],
+                    ordered=False,
+                )
+                # only legs inserted now are counted, so a retried batch is not counted twice
+                inserted = [legs[index] for index in result.upserted_ids]
+                await self._apply_rollups([(leg, {"legs": 1}) for leg in inserted])
+                ingested += len(inserted)
+            await self.db.analytics_state.update_one(
+                {"_id": STATE_ID},
+                {"$set": {collection: docs[-1][field], f"{collection}_id": docs[-1]["_id"]}},
+                upsert=True,
+            )
+        return ingested
+
+    async def _close_legs(self, now: datetime) -> int:
+        legs = await self.db.recommendation_legs.find(
+            {"status": "pending", "commence_time": {"$lte": now}}
+        ).sort("commence_time", ASCENDING).to_list(self.batch_size)
+        changes: List[Transition] = []
+        for leg in legs:
+            outcome = SELECTION_OUTCOMES[leg["selection"]]
+            closing = await self.odds_timeseries.closing_price(
+                leg["event_id"], leg.get("bookmaker"), outcome, leg["commence_time"]
+            )
+            if closing is None and leg.get("bookmaker"):
+                closing = await self.odds_timeseries.closing_price(leg["event_id"], None, outcome, leg["commence_time"])
+            fields: Dict[str, Any] = {"status": "closed", "closing_odds": closing, "clv": None}
+            increments = None
+            if closing:
+                clv = leg["odds"] / closing - 1.0
+                fields["clv"] = clv
+                increments = {"clv_n": 1, "clv_sum": clv, "clv_beat": 1 if clv > 0 else 0}
+            changes.append((leg, {"$set": fields}, increments))
+        return len(await self._transition("pending", changes))
+
+    async def _settle_legs(self, now: datetime) -> Tuple[int, int]:
+        legs = await self.db.recommendation_legs.find(
+            {"status": "closed", "commence_time": {"$lte": now - SETTLE_AFTER}}
+        ).sort("commence_time", ASCENDING).to_list(self.batch_size)
+        if not legs:
+            return 0, 0
+
+        event_ids = list({leg["event_id"] for leg in legs})
+        results = {
+            doc["event_id"]: doc
+            for doc in await self.db.event_results.find({"event_id": {"$in": event_ids}, "completed": True}).to_list(None)
+        }
+        # the scores feed only covers recent games: don't spend quota on older ones
+        missing_leagues = {
+            leg["league"]
+            for leg in legs
+            if leg["event_id"] not in results and leg.get("league") and leg["commence_time"] > now - SETTLE_GIVE_UP
+        }
+        if missing_leagues and self.odds_api_key:
+            results.update(await self._sync_scores(missing_leagues))
+
+        changes: List[Transition] = []
+        for leg in legs:
+            result = results.get(leg["event_id"])
+            if not result and leg["commence_time"] <= now - SETTLE_GIVE_UP:
+                changes.append((leg, {"$set": {"status": "void"}}, {"void": 1}))
+                continue
+            if not result:
+                changes.append((leg, {"$inc": {"settle_attempts": 1}}, None))
+                continue
+            won = leg_won(leg["selection"], result["home_score"], result["away_score"])
+            increments: Dict[str, Any] = {
+                "settled": 1,
+                "hits": 1 if won else 0,
+                "staked": 1.0,
+                "returned": leg["odds"] if won else 0.0,
+            }
+            label = calibration_bin(leg.get("confidence"))
+            if label is not None:
+                increments[f"calibration.{label}.n"] = 1
+                increments[f"calibration.{label}.hits"] = 1 if won else 0
+                increments[f"calibration.{label}.confidence_sum"] = float(leg["confidence"])
+            changes.append((leg, {"$set": {"status": "settled", "won": won}}, increments))
+        claimed = [increments for _, increments in await self._transition("closed", changes) if increments]
+        voided = sum(1 for increments in claimed if "void" in increments)
+        return len(claimed) - voided, voided
+
+    async def _transition(self, status: str, changes: List[Transition]) -> List[Tuple[Dict[str, Any], Optional[Dict[str, Any]]]]:
+        """Update each leg only if it is still in ``status``; roll up the legs this run moved.
+
+        Runs may overlap (the manual endpoint, one loop per worker), so the
+        conditional update claims the leg and its contribution is added once.
+        """
+        if not changes:
+            return []
+        results = await asyncio.gather(*(
+            self.db.recommendation_legs.update_one({"_id": leg["_id"], "status": status}, update)
+            for leg, update, _ in changes
+        ))
+        claimed = [
+            (leg, increments)
+            for (leg, _, increments), result in zip(changes, results)
+            if result.modified_count == 1
+        ]
+        await self._apply_rollups([(leg, increments) for leg, increments in claimed if increments])
+        return claimed
+
+    async def _sync_scores(self, leagues: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """Fetch recent final scores from TheOddsAPI and store them in ``event_results``."""
+        results: Dict[str, Dict[str, Any]] = {}
+        async with httpx.AsyncClient() as client:
+            for league in leagues:
+                try:
+                    response = await client.get(
+                        f"https://api.the-odds-api.com/v4/sports/{league}/scores",
+                        params={"apiKey": self.odds_api_key, "daysFrom": SCORES_DAYS},
+                        timeout=10,
+                    )
+                    if response.status_code != 200:
+                        continue
+                    for game in response.json():
+                        result = self._parse_score(game)
+                        if result:
+                            results[result["event_id"]] = result
+                except Exception as e:
+                    logger.warning(f"Error obteniendo resultados de {league}: {str(e)}")
+        if results:
+            await self.db.event_results.bulk_write(
+                [UpdateOne({"event_id": event_id}, {"$set": doc}, upsert=True) for event_id, doc in results.items()],
+                ordered=False,
+            )
+        return results
+
+    @staticmethod
+    def _parse_score(game: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        if not game.get("completed") or not game.get("scores"):
+            return None
+        scores = {score["name"]: float(score["score"]) for score in game["scores"]}
+        if game["home_team"] not in scores or game["away_team"] not in scores:
+            return None
+        return {
+            "event_id": game["id"],
+            "completed": True,
+            "home_score": scores[game["home_team"]],
+            "away_score": scores[game["away_team"]],
+        }
+
+    async def _apply_rollups(self, contributions: List[Tuple[Dict[str, Any], Dict[str, Any]]]) -> None:
+        merged: Dict[str, Dict[str, Any]] = {}
+        for leg, increments in contributions:
+            for key in rollup_keys(leg):
+                acc = merged.setdefault(key, {})
+                for field, value in increments.items():
+                    acc[field] = acc.get(field, 0) + value
+        if merged:
+            await self.db.analytics_rollups.bulk_write(
+                [UpdateOne({"_id": key}, {"$inc": inc}, upsert=True) for key, inc in merged.items()],
+                ordered=False,
+            )
+
+
+__all__ = [
+    "RecommendationAnalytics",
+    "calibration_bin",
+    "leg_won",
+    "summarize_rollup",
+]
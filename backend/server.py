@@ -1,30 +1,42 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, HTTPException, Request, Depends, Header
+from fastapi.responses import JSONResponse, PlainTextResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from contextlib import asynccontextmanager
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
 import httpx
 import asyncio
-from emergentintegrations.llm.chat import LlmChat, UserMessage
 import json
-import random
+import time
+import hmac
+import threading
+
+from odds_timeseries import OddsTimeSeriesStore, parse_timestamp, steam_moves
+from recommendation_analytics import INGEST_DELAY, RecommendationAnalytics
+from domain import OddsRow, parse_games
+from sports_registry import SportsRegistry
+from odds_snapshot import OddsSnapshotStore
+from http_cache import ResponseCache, SnapshotVersions, cache_control
+from llm_analysis import AnalysisService, EmergentLlmClient, FakeLlmClient, MongoAnalysisCache
+from personalized_feeds import PersonalizedFeeds, build_recommendation
+from write_behind import WriteBehind
+from bson.errors import InvalidDocument
+from profiling import LoopLagMonitor, ProfileStore, RequestProfilingMiddleware, SamplingProfiler, SlowQueryListener, folded_stacks
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
+# MongoDB connection (the client and the services using it are created in the lifespan)
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
-
-# Create the main app without a prefix
-app = FastAPI(title="TipStars App API", description="API para análisis inteligente de apuestas deportivas")
+client: Optional[AsyncIOMotorClient] = None
+db = None
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -33,7 +45,32 @@ api_router = APIRouter(prefix="/api")
 ODDS_API_KEY = os.environ.get('ODDS_API_KEY')
 OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')
 
-# Supported sports configuration
+# Admin-only profiling endpoints are disabled unless a token is configured
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+MAX_PROFILE_SECONDS = 60
+
+ANALYTICS_INTERVAL_SECONDS = int(os.environ.get('ANALYTICS_INTERVAL_SECONDS', '600'))
+MAX_ANALYSIS_BETS = 100
+MAX_SIMULATION_LEGS = 20
+# Monte Carlo runs are CPU and memory heavy: few at a time, each with a time budget
+SIMULATION_CONCURRENCY = int(os.environ.get('SIMULATION_CONCURRENCY', '2'))
+SIMULATION_TIME_BUDGET = float(os.environ.get('SIMULATION_TIME_BUDGET', '2.0'))
+simulation_slots = asyncio.Semaphore(SIMULATION_CONCURRENCY)
+MAX_PORTFOLIO_BETS = 500
+MAX_GAMES_PER_PAGE = 100
+
+# Parlay history: client max-age and ETag time bucket; the newest stored recommendation is read in warm-up
+HISTORY_MAX_AGE = 15
+history_origin: Optional[tuple] = None
+
+# Price soccer with the precomputed, memory-mapped Poisson grid instead of the exact sums
+USE_POISSON_GRID = os.environ.get('USE_POISSON_GRID', '1') == '1'
+poisson_grid = None
+
+# Sports whose odds snapshot is loaded during warm-up (comma separated, costs API quota)
+WARM_SPORTS = [sport for sport in os.environ.get('WARM_SPORTS', '').split(',') if sport]
+
+# Supported sports configuration (seed for the league registry below)
 SPORTS_CONFIG = {
     "soccer": {
         "name": "Fútbol",
@@ -67,22 +104,102 @@ SPORTS_CONFIG = {
     }
 }
 
-class OddsData(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    sport: str
-    sport_name: str
-    home_team: str
-    away_team: str
-    commence_time: str
-    bookmaker: str
-    home_odds: float
-    away_odds: float
-    draw_odds: Optional[float] = None
-    spread_home: Optional[float] = None
-    spread_away: Optional[float] = None
-    total_over: Optional[float] = None
-    total_under: Optional[float] = None
-    fetched_at: datetime = Field(default_factory=datetime.utcnow)
+# Database-backed services, created by init_services() during startup
+odds_timeseries: Optional[OddsTimeSeriesStore] = None
+recommendation_analytics: Optional[RecommendationAnalytics] = None
+sports_registry: Optional[SportsRegistry] = None
+analysis_cache: Optional[MongoAnalysisCache] = None
+analysis_service: Optional[AnalysisService] = None
+personalized_feeds: Optional[PersonalizedFeeds] = None
+write_behind: Optional[WriteBehind] = None
+
+# Warm-up progress reported by /api/health/ready
+warmup_state = {"indices": False, "registro": False, "snapshots": False}
+
+def init_services(database):
+    """Create the services that depend on the database"""
+    global odds_timeseries, recommendation_analytics, sports_registry, analysis_cache, analysis_service
+    global personalized_feeds, write_behind
+    
+    # Bucketed price-movement history (one document per event per hour)
+    odds_timeseries = OddsTimeSeriesStore(database.odds_timeseries)
+    
+    # Leagues per sport, synced from TheOddsAPI /sports and cached in MongoDB
+    sports_registry = SportsRegistry(
+        database.sports_registry,
+        SPORTS_CONFIG,
+        ODDS_API_KEY,
+        ttl=timedelta(hours=float(os.environ.get('SPORTS_REGISTRY_TTL_HOURS', '12'))),
+        max_leagues_per_sport=int(os.environ.get('MAX_LEAGUES_PER_SPORT', '5')),
+        poll_unrequested=os.environ.get('POLL_UNREQUESTED_LEAGUES') == '1'
+    )
+    
+    # Batched, cached LLM analysis (LLM_FAKE=1 uses an offline fake model)
+    if os.environ.get('LLM_FAKE') == '1':
+        llm_client = FakeLlmClient(latency=float(os.environ.get('LLM_FAKE_LATENCY', '0.5')))
+    else:
+        llm_client = EmergentLlmClient(OPENAI_API_KEY, model=os.environ.get('LLM_MODEL', 'gpt-4o-mini'))
+    analysis_cache = MongoAnalysisCache(
+        database.llm_analysis_cache, ttl=timedelta(hours=float(os.environ.get('LLM_CACHE_TTL_HOURS', '6')))
+    )
+    analysis_service = AnalysisService(
+        llm_client,
+        analysis_cache,
+        batch_size=int(os.environ.get('LLM_BATCH_SIZE', '20')),
+        max_concurrency=int(os.environ.get('LLM_MAX_CONCURRENCY', '2')),
+        tokens_per_minute=int(os.environ.get('LLM_TOKENS_PER_MINUTE', '60000')),
+        timeout=float(os.environ.get('LLM_TIMEOUT_SECONDS', '20')),
+        pricer=price_legs
+    )
+    
+    # Stored preferences and per-user feeds precomputed on every odds ingest
+    personalized_feeds = PersonalizedFeeds(
+        database,
+        pool_for=get_candidate_pool,
+        version_of=lambda sport: snapshot_versions.get(f"odds:{sport}"),
+        active_window=timedelta(days=float(os.environ.get('ACTIVE_USER_DAYS', '14'))),
+        candidates_per_sport=int(os.environ.get('FEED_CANDIDATES_PER_SPORT', '20'))
+    )
+    
+    # Buffered inserts, flushed in unordered batches so requests don't wait for Mongo
+    flush_interval = float(os.environ.get('WRITE_FLUSH_INTERVAL_SECONDS', '0.5'))
+    max_pending = int(os.environ.get('WRITE_MAX_PENDING', '10000'))
+    write_behind = WriteBehind()
+    write_behind.register("recomendaciones", database.mock_parlay_recommendations, flush_interval=flush_interval, max_pending=max_pending)
+    write_behind.register("favoritos", database.favorites, flush_interval=flush_interval, max_pending=max_pending)
+    write_behind.register(
+        "odds", database.odds_data, max_batch=1000, flush_interval=flush_interval, max_pending=max(max_pending, 50000),
+        on_flush=odds_written
+    )
+    
+    # Closing-line value / performance analytics over stored recommendations; documents are
+    # ingested only once past the write-behind retry window, so late writes aren't skipped
+    retry_window = max(write_behind[name].retry_window for name in ("recomendaciones", "favoritos"))
+    recommendation_analytics = RecommendationAnalytics(
+        database, odds_timeseries, ODDS_API_KEY,
+        ingest_delay=max(INGEST_DELAY, timedelta(seconds=retry_window))
+    )
+
+def odds_written(docs: List[Dict[str, Any]]):
+    """A whole odds load reached MongoDB: candidate pools and personalized feeds of its sports are stale"""
+    for sport in {doc["sport"] for doc in docs}:
+        snapshot_versions.bump(f"odds:{sport}")
+        personalized_feeds.notify(sport)
+
+# Latest odds per sport kept in memory, plus serialized responses keyed by snapshot version
+odds_snapshots = OddsSnapshotStore(ttl=float(os.environ.get('ODDS_SNAPSHOT_TTL_SECONDS', '60')))
+snapshot_versions = SnapshotVersions()
+response_cache = ResponseCache(max_age=float(os.environ.get('RESPONSE_CACHE_MAX_AGE_SECONDS', '30')))
+
+# Profiling hooks: slow Mongo commands, event-loop lag and on-demand request profiles
+slow_queries = SlowQueryListener(threshold_ms=float(os.environ.get('SLOW_QUERY_MS', '100')))
+loop_monitor = LoopLagMonitor(threshold=float(os.environ.get('LOOP_LAG_THRESHOLD_MS', '100')) / 1000)
+request_profiles = ProfileStore()
+profiling_lock = asyncio.Lock()
+
+# Parlay candidate pools keyed by sorted sports: (snapshot versions, built at, pool)
+candidate_pools: Dict[tuple, tuple] = {}
+CANDIDATE_POOL_MAX_AGE = float(os.environ.get('CANDIDATE_POOL_MAX_AGE_SECONDS', '60'))
 
 class UserPreferences(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -92,6 +209,7 @@ class UserPreferences(BaseModel):
     risk_level: str = "medio"  # bajo, medio, alto
     preferred_sports: List[str] = ["soccer"]
     preferred_leagues: List[str] = []
+    min_ev: Optional[float] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 class MockBet(BaseModel):
@@ -104,6 +222,10 @@ class MockBet(BaseModel):
     reasoning: str
     sport: str
     sport_name: str
+    event_id: Optional[str] = None
+    league: Optional[str] = None
+    bookmaker: Optional[str] = None
+    commence_time: Optional[str] = None
 
 class MockParlayRecommendation(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -117,20 +239,55 @@ class MockParlayRecommendation(BaseModel):
 async def root():
     return {"message": "TipStars App API - Análisis inteligente de apuestas deportivas", "status": "activo", "version": "1.0"}
 
+@api_router.get("/health/live")
+async def liveness():
+    """Comprobar que el proceso responde (sin E/S)"""
+    return {"status": "vivo"}
+
+@api_router.get("/health/ready")
+async def readiness():
+    """Comprobar que la base de datos responde y que las cachés están calientes"""
+    mongo_ok = False
+    try:
+        await asyncio.wait_for(db.command("ping"), timeout=2)
+        mongo_ok = True
+    except Exception as e:
+        logger.warning(f"Ping a MongoDB fallido: {str(e)}")
+    
+    ready = mongo_ok and all(warmup_state.values())
+    body = {
+        "status": "listo" if ready else "calentando",
+        "mongo": mongo_ok,
+        "caches": {
+            **warmup_state,
+            "deportes_en_memoria": [sport for sport in SPORTS_CONFIG if odds_snapshots.peek(sport)]
+        }
+    }
+    return JSONResponse(body, status_code=200 if ready else 503)
+
 @api_router.get("/deportes")
-async def get_supported_sports():
+async def get_supported_sports(request: Request):
     """Obtener lista de deportes soportados"""
-    return {"deportes": SPORTS_CONFIG}
+    await sports_registry.ensure_fresh()
+    
+    async def build():
+        return {"deportes": sports_registry.public_config()}
+    
+    return await response_cache.respond(
+        request, "deportes", (), sports_registry.etag, build, cache_control(300, 3600)
+    )
 
 @api_router.get("/deportes/conteo")
 async def get_sports_count():
     """Obtener conteo de juegos disponibles por deporte"""
     sports_count = {}
+    await sports_registry.ensure_fresh()
     
     async with httpx.AsyncClient() as client:
         for sport_key, sport_config in SPORTS_CONFIG.items():
             total_games = 0
-            for api_key in sport_config["api_keys"]:
+            for league in sports_registry.leagues_for(sport_key):
+                api_key = league.key
                 try:
                     url = f"https://api.the-odds-api.com/v4/sports/{api_key}/odds"
                     params = {
@@ -144,6 +301,7 @@ async def get_sports_count():
                     if response.status_code == 200:
                         odds_data = response.json()
                         total_games += len(odds_data)
+                        await sports_registry.record_fetch(api_key, len(odds_data))
                     
                 except Exception as e:
                     logging.warning(f"Error contando {api_key}: {str(e)}")
@@ -157,262 +315,357 @@ async def get_sports_count():
     
     return {"sports_count": sports_count}
 
+async def load_sport_odds(sport: str) -> List[OddsRow]:
+    """Fetch, record and store the latest odds of every active league of a sport"""
+    sport_config = SPORTS_CONFIG[sport]
+    all_odds = []
+    fetched_at = datetime.utcnow()
+    await sports_registry.ensure_fresh()
+    
+    async with httpx.AsyncClient() as client:
+        # Fetch odds for each active league/tournament in this sport
+        for league in sports_registry.leagues_for(sport):
+            api_key = league.key
+            try:
+                url = f"https://api.the-odds-api.com/v4/sports/{api_key}/odds"
+                params = {
+                    "apiKey": ODDS_API_KEY,
+                    "regions": "uk,us,eu",
+                    "markets": ",".join(league.markets),
+                    "oddsFormat": "decimal"
+                }
+                
+                response = await client.get(url, params=params)
+                if response.status_code == 200:
+                    odds_data = response.json()
+                    await sports_registry.record_fetch(api_key, len(odds_data))
+                    
+                    all_odds.extend(parse_games(odds_data, sport, sport_config["name"], api_key, fetched_at))
+                    
+                    # Record price movements for line charts / steam detection
+                    try:
+                        await odds_timeseries.record_games(odds_data, sport=sport, league=api_key, fetched_at=fetched_at)
+                    except Exception as e:
+                        logging.warning(f"Error guardando movimientos de {api_key}: {str(e)}")
+            
+            except Exception as e:
+                logging.warning(f"Error fetching {api_key}: {str(e)}")
+                continue
+    
+    # Store in database (write-behind; one unit, so pools and feeds are refreshed once the whole load is written)
+    if all_odds:
+        try:
+            await write_behind["odds"].put_many(odds.to_document() for odds in all_odds)
+        except InvalidDocument as e:
+            logging.warning(f"Odds de {sport} no guardadas: {str(e)}")
+    
+    return all_odds
+
+def parse_query_timestamp(value: Optional[str], name: str) -> Optional[datetime]:
+    """Optional ISO-8601 query parameter; a value that doesn't parse is a 400, not a missing filter"""
+    parsed = parse_timestamp(value)
+    if value and parsed is None:
+        raise HTTPException(status_code=400, detail=f"Fecha inválida en '{name}': {value}")
+    return parsed
+
 @api_router.get("/odds/{sport}")
-async def get_odds_by_sport(sport: str):
-    """Obtener odds en vivo para un deporte específico"""
+async def get_odds_by_sport(
+    sport: str,
+    request: Request,
+    liga: Optional[str] = None,
+    desde: Optional[str] = None,
+    hasta: Optional[str] = None,
+    orden: str = "asc",
+    limite: int = 30,
+    offset: int = 0
+):
+    """Obtener odds en vivo para un deporte específico, agrupadas por partido"""
     if sport not in SPORTS_CONFIG:
         raise HTTPException(status_code=404, detail=f"Deporte '{sport}' no soportado")
+    if orden not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="El orden debe ser 'asc' o 'desc'")
+    limite = min(max(limite, 1), MAX_GAMES_PER_PAGE)
+    offset = max(offset, 0)
+    start, end = parse_query_timestamp(desde, "desde"), parse_query_timestamp(hasta, "hasta")
     
     try:
         sport_config = SPORTS_CONFIG[sport]
-        all_odds = []
+        if liga:
+            # only users asking for a league make it worth polling (in memory, once per client per interval)
+            sports_registry.record_request(liga, request.client.host if request.client else None)
+        snapshot = await odds_snapshots.get(sport, load_sport_odds)
         
-        async with httpx.AsyncClient() as client:
-            # Fetch odds for each league/tournament in this sport
-            for api_key in sport_config["api_keys"]:
-                try:
-                    url = f"https://api.the-odds-api.com/v4/sports/{api_key}/odds"
-                    params = {
-                        "apiKey": ODDS_API_KEY,
-                        "regions": "uk,us,eu",
-                        "markets": "h2h,spreads,totals",
-                        "oddsFormat": "decimal"
-                    }
-                    
-                    response = await client.get(url, params=params)
-                    if response.status_code == 200:
-                        odds_data = response.json()
-                        
-                        for game in odds_data:
-                            for bookmaker in game.get('bookmakers', []):
-                                for market in bookmaker.get('markets', []):
-                                    odds_entry = OddsData(
-                                        sport=sport,
-                                        sport_name=sport_config["name"],
-                                        home_team=game['home_team'],
-                                        away_team=game['away_team'],
-                                        commence_time=game['commence_time'],
-                                        bookmaker=bookmaker['title']
-                                    )
-                                    
-                                    if market['key'] == 'h2h':
-                                        outcomes = {outcome['name']: outcome['price'] for outcome in market['outcomes']}
-                                        odds_entry.home_odds = outcomes.get(game['home_team'], 0)
-                                        odds_entry.away_odds = outcomes.get(game['away_team'], 0)
-                                        odds_entry.draw_odds = outcomes.get('Draw', None)
-                                    
-                                    elif market['key'] == 'spreads':
-                                        for outcome in market['outcomes']:
-                                            if outcome['name'] == game['home_team']:
-                                                odds_entry.spread_home = outcome['point']
-                                            elif outcome['name'] == game['away_team']:
-                                                odds_entry.spread_away = outcome['point']
-                                    
-                                    elif market['key'] == 'totals':
-                                        for outcome in market['outcomes']:
-                                            if outcome['name'] == 'Over':
-                                                odds_entry.total_over = outcome['price']
-                                            elif outcome['name'] == 'Under':
-                                                odds_entry.total_under = outcome['price']
-                                    
-                                    if odds_entry.home_odds > 0 or odds_entry.away_odds > 0:
-                                        all_odds.append(odds_entry)
-                
-                except Exception as e:
-                    logging.warning(f"Error fetching {api_key}: {str(e)}")
-                    continue
-        
-        # Store in database
-        if all_odds:
-            odds_dicts = [odds.dict() for odds in all_odds]
-            await db.odds_data.insert_many(odds_dicts)
+        async def build():
+            # Games are grouped, sorted and indexed once per snapshot; a request only slices them
+            games, total = snapshot.query(
+                league=liga,
+                start=start,
+                end=end,
+                descending=orden == "desc",
+                offset=offset,
+                limit=limite
+            )
+            return {
+                "games": games,
+                "total_games": total,
+                "offset": offset,
+                "limite": limite,
+                "next_offset": offset + limite if offset + limite < total else None,
+                "sport": sport_config["name"],
+                "emoji": sport_config["emoji"]
+            }
         
-        return {
-            "odds": all_odds[:30], 
-            "total_games": len(all_odds),
-            "sport": sport_config["name"],
-            "emoji": sport_config["emoji"]
-        }
+        return await response_cache.respond(
+            request, "odds", (sport, liga, desde, hasta, orden, limite, offset), snapshot.version, build,
+            cache_control(30, 60)
+        )
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error obteniendo odds: {str(e)}")
 
-@api_router.post("/generar/parlay-mock")
+@api_router.get("/movimientos/{event_id}")
+async def get_odds_movements(
+    event_id: str,
+    desde: Optional[str] = None,
+    hasta: Optional[str] = None,
+    bookmaker: Optional[str] = None,
+    mercado: Optional[str] = None,
+    umbral_steam: float = 0.05
+):
+    """Obtener el movimiento de precios de un evento en un rango de tiempo"""
+    end = parse_query_timestamp(hasta, "hasta") or datetime.utcnow()
+    start = parse_query_timestamp(desde, "desde") or end - timedelta(days=7)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="El rango de fechas no es válido")
+    
+    try:
+        series = await odds_timeseries.query_range(event_id, start, end, bookmaker=bookmaker, outcome=mercado)
+        movimientos = []
+        for entry in series.values():
+            movimientos.append({
+                "bookmaker": entry["bookmaker"],
+                "mercado": entry["outcome"],
+                "puntos": [{"t": moment, "precio": price} for moment, price in entry["points"]],
+                "steam": steam_moves(entry["points"], min_change=umbral_steam)
+            })
+        
+        return {"event_id": event_id, "desde": start, "hasta": end, "movimientos": movimientos}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error obteniendo movimientos: {str(e)}")
+
+async def price_legs(legs: List[Dict[str, Any]]) -> List[Optional[float]]:
+    """Sport-model probability of each leg against the consensus of the candidate pool"""
+    sports = [sport for sport in {leg.get("sport") for leg in legs} if sport in SPORTS_CONFIG]
+    if not sports:
+        return [None] * len(legs)
+    pool = await get_candidate_pool(sports)
+    return pool.probabilities_for(legs)
+
+async def get_candidate_pool(sports: List[str]):
+    """Candidate pool for a set of sports, rebuilt when one of their odds snapshots changes"""
+    # NumPy is only imported on first use to keep cold starts fast
+    from candidate_pool import build_pool, latest_odds_documents
+    
+    key = tuple(sorted(set(sports)))
+    version = tuple(snapshot_versions.get(f"odds:{sport}") for sport in key)
+    cached = candidate_pools.get(key)
+    if cached and cached[0] == version and time.monotonic() - cached[1] < CANDIDATE_POOL_MAX_AGE:
+        return cached[2]
+    
+    pool = build_pool(await latest_odds_documents(db.odds_data, key))
+    candidate_pools[key] = (version, time.monotonic(), pool)
+    return pool
+
+@api_router.post("/generar/parlay-mock", response_model=MockParlayRecommendation)
 async def generate_mock_parlay(preferences: Dict[str, Any]):
     """Generar recomendaciones de parlay temporales (sin IA)"""
     try:
-        # Get latest odds from database for selected sports
-        selected_sports = preferences.get('preferred_sports', ['soccer'])
-        latest_odds = []
+        # Stored preferences of the user, when given, replace the request body
+        if preferences.get('user_id'):
+            preferences = await personalized_feeds.get_preferences(preferences['user_id']) or preferences
         
-        for sport in selected_sports:
-            sport_odds = await db.odds_data.find({"sport": sport}).sort("fetched_at", -1).limit(20).to_list(20)
-            latest_odds.extend(sport_odds)
+        selected_sports = preferences.get('preferred_sports') or ['soccer']
+        min_odds = preferences.get('min_odds') or 1.5
+        max_legs = preferences.get('max_legs') or 4
+        min_ev = preferences.get('min_ev')
         
-        if not latest_odds:
-            raise HTTPException(status_code=404, detail="No hay datos de odds disponibles")
+        # Latest odds of every upcoming event as sorted columns (one aggregation, cached per snapshot)
+        pool = await get_candidate_pool(selected_sports)
         
-        # Filter odds based on preferences
-        min_odds = preferences.get('min_odds', 1.5)
-        max_legs = preferences.get('max_legs', 4)
-        
-        filtered_bets = []
-        
-        for odds in latest_odds:
-            # Add home bet if odds meet criteria
-            if odds.get('home_odds', 0) >= min_odds:
-                filtered_bets.append({
-                    'home_team': odds['home_team'],
-                    'away_team': odds['away_team'],
-                    'selection': 'local',
-                    'odds': odds['home_odds'],
-                    'sport': odds['sport'],
-                    'sport_name': odds['sport_name']
-                })
-            
-            # Add away bet if odds meet criteria
-            if odds.get('away_odds', 0) >= min_odds:
-                filtered_bets.append({
-                    'home_team': odds['home_team'],
-                    'away_team': odds['away_team'],
-                    'selection': 'visitante',
-                    'odds': odds['away_odds'],
-                    'sport': odds['sport'],
-                    'sport_name': odds['sport_name']
-                })
-            
-            # Add draw bet if available and meets criteria
-            if odds.get('draw_odds') and odds['draw_odds'] >= min_odds:
-                filtered_bets.append({
-                    'home_team': odds['home_team'],
-                    'away_team': odds['away_team'],
-                    'selection': 'empate',
-                    'odds': odds['draw_odds'],
-                    'sport': odds['sport'],
-                    'sport_name': odds['sport_name']
-                })
+        if len(pool) == 0:
+            raise HTTPException(status_code=404, detail="No hay datos de odds disponibles")
         
-        if len(filtered_bets) < 6:
+        if len(pool.select(min_odds, min_ev=min_ev)) < 6:
             raise HTTPException(status_code=404, detail="No hay suficientes apuestas que cumplan los criterios")
         
-        # Generate mock parlays with realistic logic
-        mock_parlays = []
-        risk_levels = ['conservador', 'equilibrado', 'agresivo']
-        
-        for risk_level in risk_levels:
-            parlay_bets = []
-            
-            if risk_level == 'conservador':
-                # Conservative: 2-3 legs, lower odds, higher confidence
-                legs = random.randint(2, 3)
-                selected_bets = random.sample([b for b in filtered_bets if b['odds'] <= 2.5], min(legs, len(filtered_bets)))
-                confidence_range = (75, 90)
-            elif risk_level == 'equilibrado':
-                # Balanced: 3-4 legs, medium odds, medium confidence  
-                legs = random.randint(3, min(4, max_legs))
-                selected_bets = random.sample([b for b in filtered_bets if 1.8 <= b['odds'] <= 3.5], min(legs, len(filtered_bets)))
-                confidence_range = (60, 80)
-            else:  # agresivo
-                # Aggressive: 4+ legs, higher odds, lower confidence
-                legs = random.randint(4, max_legs)
-                selected_bets = random.sample([b for b in filtered_bets if b['odds'] >= 2.0], min(legs, len(filtered_bets)))
-                confidence_range = (45, 70)
-            
-            parlay_odds = 1.0
-            for bet in selected_bets:
-                confidence = random.randint(confidence_range[0], confidence_range[1])
-                
-                # Generate realistic reasoning based on bet
-                reasoning_options = [
-                    f"Buena forma reciente del equipo",
-                    f"Valor interesante con odds de {bet['odds']}",
-                    f"Estadísticas favorables en casa/visitante",
-                    f"Análisis técnico positivo",
-                    f"Tendencia histórica favorable"
-                ]
-                
-                mock_bet = MockBet(
-                    home_team=bet['home_team'],
-                    away_team=bet['away_team'], 
-                    selection=bet['selection'],
-                    odds=bet['odds'],
-                    confidence_score=confidence,
-                    reasoning=random.choice(reasoning_options),
-                    sport=bet['sport'],
-                    sport_name=bet['sport_name']
-                )
-                
-                parlay_bets.append(mock_bet)
-                parlay_odds *= bet['odds']
-            
-            if parlay_bets:
-                mock_parlays.append(parlay_bets)
-        
-        # Calculate total odds and payouts
-        total_odds = []
-        potential_payouts = []
-        
-        for parlay in mock_parlays:
-            parlay_total = 1.0
-            for bet in parlay:
-                parlay_total *= bet.odds
-            total_odds.append(round(parlay_total, 2))
-            potential_payouts.append(round(parlay_total * 10, 2))  # Assuming $10 bet
-        
-        recommendation = MockParlayRecommendation(
-            parlays=mock_parlays,
-            total_odds=total_odds,
-            risk_levels=risk_levels,
-            potential_payouts=potential_payouts
-        )
+        # One parlay per risk level; payouts assume a $10 bet and ids are assigned when the document is built
+        recommendation = build_recommendation(
+            pool, min_odds, max_legs, min_ev,
+            leagues=preferences.get('preferred_leagues') or None,
+            risk_level=preferences.get('risk_level')
+        ).to_document()
         
-        # Store in database
-        await db.mock_parlay_recommendations.insert_one(recommendation.dict())
+        # Store in database (write-behind; the history merges the documents not written yet)
+        await write_behind["recomendaciones"].put(recommendation)
+        snapshot_versions.bump("historial")
         
         return recommendation
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generando parlays: {str(e)}")
 
+@api_router.put("/preferencias/{user_id}")
+async def save_user_preferences(user_id: str, preferences: Dict[str, Any]):
+    """Guardar las preferencias de un usuario y regenerar su feed"""
+    try:
+        validated = UserPreferences(**{**preferences, "user_id": user_id})
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Preferencias inválidas: {str(e)}")
+    unknown = [sport for sport in validated.preferred_sports if sport not in SPORTS_CONFIG]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Deportes no soportados: {', '.join(unknown)}")
+    
+    try:
+        return {"preferencias": await personalized_feeds.save_preferences(validated.model_dump())}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error guardando preferencias: {str(e)}")
+
+@api_router.get("/preferencias/{user_id}")
+async def get_user_preferences(user_id: str):
+    """Obtener las preferencias guardadas de un usuario"""
+    preferences = await personalized_feeds.get_preferences(user_id)
+    if preferences is None:
+        raise HTTPException(status_code=404, detail="Usuario sin preferencias guardadas")
+    return {"preferencias": preferences}
+
+@api_router.get("/feed/{user_id}")
+async def get_user_feed(user_id: str):
+    """Obtener el feed personalizado precalculado de un usuario"""
+    try:
+        feed = await personalized_feeds.get_feed(user_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error obteniendo feed: {str(e)}")
+    if feed is None:
+        raise HTTPException(status_code=404, detail="Feed no disponible: guarda primero las preferencias")
+    return feed
+
+async def load_history_origin() -> tuple:
+    """Newest stored recommendation of both collections, read once at startup"""
+    latest = []
+    for collection in (db.parlay_recommendations, db.mock_parlay_recommendations):
+        newest = await collection.find_one({}, {"id": 1, "generated_at": 1}, sort=[("generated_at", -1), ("_id", -1)])
+        latest.append(None if newest is None else (str(newest.get("id", newest["_id"])), str(newest.get("generated_at"))))
+    return tuple(latest)
+
+def history_version() -> tuple:
+    """In-memory version of the history: polls never read MongoDB.
+
+    The counter is bumped on every recommendation queued by this worker; the
+    time bucket lets writes of other workers show up within one max-age.
+    """
+    return (history_origin, snapshot_versions.get("historial"), int(time.time() // HISTORY_MAX_AGE))
+
 @api_router.get("/historial/parlays")
-async def get_parlay_history():
+async def get_parlay_history(request: Request):
     """Obtener historial reciente de recomendaciones de parlay"""
     try:
-        # Get both real and mock recommendations
-        real_history = await db.parlay_recommendations.find().sort("generated_at", -1).limit(5).to_list(5)
-        mock_history = await db.mock_parlay_recommendations.find().sort("generated_at", -1).limit(10).to_list(10)
+        async def build():
+            # Get both real and mock recommendations
+            real_history = await db.parlay_recommendations.find({}, {"_id": 0}).sort("generated_at", -1).limit(5).to_list(5)
+            mock_history = await db.mock_parlay_recommendations.find({}, {"_id": 0}).sort("generated_at", -1).limit(10).to_list(10)
+            
+            # Read-your-writes: recommendations still waiting in the write-behind queue
+            stored_ids = {rec["id"] for rec in mock_history}
+            unwritten = [rec for rec in write_behind["recomendaciones"].pending() if rec["id"] not in stored_ids]
+            mock_history = sorted(unwritten + mock_history, key=lambda rec: rec["generated_at"], reverse=True)[:10]
+            
+            return {
+                "historial": mock_history + real_history,
+                "total": len(mock_history + real_history)
+            }
         
-        return {
-            "historial": mock_history + real_history,
-            "total": len(mock_history + real_history)
-        }
+        return await response_cache.respond(
+            request, "historial", (), history_version(), build, cache_control(HISTORY_MAX_AGE, 30)
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error obteniendo historial: {str(e)}")
 
+@api_router.post("/analizar/apuestas")
+async def analyze_bets(bets: List[Dict[str, Any]]):
+    """Analizar apuestas con IA (en lote, con caché y respaldo estadístico)"""
+    if not bets:
+        raise HTTPException(status_code=400, detail="No se proporcionaron apuestas")
+    if len(bets) > MAX_ANALYSIS_BETS:
+        raise HTTPException(status_code=400, detail=f"Máximo {MAX_ANALYSIS_BETS} apuestas por análisis")
+    if any(not bet.get('odds') or not bet.get('selection') for bet in bets):
+        raise HTTPException(status_code=400, detail="Cada apuesta necesita 'odds' y 'selection'")
+    
+    try:
+        analisis = await analysis_service.analyze(bets)
+        return {"analisis": analisis, "total": len(analisis)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error analizando apuestas: {str(e)}")
+
+@api_router.post("/analitica/procesar")
+async def run_recommendation_analytics():
+    """Procesar de forma incremental las recomendaciones pendientes de evaluar"""
+    try:
+        procesado = await recommendation_analytics.run()
+        return {"procesado": procesado}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error procesando analítica: {str(e)}")
+
+@api_router.get("/analitica/rendimiento")
+async def get_recommendation_performance():
+    """Obtener CLV, tasa de acierto, ROI y calibración por nivel de riesgo y deporte"""
+    try:
+        return {"rendimiento": await recommendation_analytics.report()}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error obteniendo rendimiento: {str(e)}")
+
 @api_router.post("/favoritos")
 async def add_to_favorites(bet_data: Dict[str, Any]):
     """Agregar apuesta a favoritos"""
     try:
         favorite = {
             "id": str(uuid.uuid4()),
+            "user_id": bet_data.get("user_id"),
             "bet_data": bet_data,
             "created_at": datetime.utcnow()
         }
         
-        await db.favorites.insert_one(favorite)
+        await write_behind["favoritos"].put(favorite, key=favorite["user_id"])
         return {"message": "Agregado a favoritos", "id": favorite["id"]}
+    except InvalidDocument as e:
+        raise HTTPException(status_code=400, detail=f"Apuesta inválida: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error agregando a favoritos: {str(e)}")
 
 @api_router.get("/favoritos")
-async def get_favorites():
+async def get_favorites(user_id: Optional[str] = None):
     """Obtener apuestas favoritas"""
     try:
-        favorites = await db.favorites.find().sort("created_at", -1).limit(20).to_list(20)
+        query = {"user_id": user_id} if user_id else {}
+        favorites = await db.favorites.find(query, {"_id": 0}).sort("created_at", -1).limit(20).to_list(20)
+        
+        # Read-your-writes: favorites still waiting in the write-behind queue
+        stored_ids = {favorite["id"] for favorite in favorites}
+        unwritten = [
+            favorite for favorite in write_behind["favoritos"].pending(user_id)
+            if favorite["id"] not in stored_ids
+        ]
+        favorites = sorted(unwritten + favorites, key=lambda favorite: favorite["created_at"], reverse=True)[:20]
         return {"favoritos": favorites}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error obteniendo favoritos: {str(e)}")
 
+@api_router.get("/metricas/escrituras")
+async def get_write_metrics():
+    """Obtener profundidad de cola y latencia de escritura de las colas write-behind"""
+    return {"colas": write_behind.metrics()}
+
 @api_router.post("/calcular/parlay")
 async def calculate_parlay_odds(bets: List[Dict[str, Any]]):
     """Calcular odds totales de un parlay manualmente"""
@@ -444,9 +697,218 @@ async def calculate_parlay_odds(bets: List[Dict[str, Any]]):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error calculando parlay: {str(e)}")
 
+@api_router.post("/simular/parlay")
+async def simulate_parlay_risk(request: Dict[str, Any]):
+    """Simular un parlay con Monte Carlo: probabilidad real, pagos, varianza y riesgo de ruina"""
+    bets = request.get("bets") or []
+    if not bets:
+        raise HTTPException(status_code=400, detail="No se proporcionaron apuestas")
+    if len(bets) > MAX_SIMULATION_LEGS:
+        raise HTTPException(status_code=400, detail=f"Máximo {MAX_SIMULATION_LEGS} apuestas por simulación")
+
+    if simulation_slots.locked():
+        raise HTTPException(status_code=429, detail="Demasiadas simulaciones en curso, inténtalo de nuevo")
+
+    from parlay_simulator import simulate_parlay
+
+    try:
+        async with simulation_slots:
+            # CPU-bound: keep the event loop free while the batches run
+            return await asyncio.to_thread(
+                simulate_parlay,
+                bets,
+                seed=request.get("seed"),
+                stake=float(request.get("stake", 10)),
+                bankroll=request.get("bankroll"),
+                repetitions=min(int(request.get("repeticiones", 100)), 1000),
+                tolerance=max(float(request.get("tolerancia", 0.001)), 0.0002),
+                time_budget=SIMULATION_TIME_BUDGET,
+                grid=poisson_grid,
+            )
+    except (KeyError, TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Apuestas inválidas: {str(e)}")
+
+@api_router.post("/optimizar/stakes")
+async def optimize_portfolio_stakes(request: Dict[str, Any]):
+    """Calcular stakes de Kelly fraccional para varias apuestas simultáneas"""
+    bets = request.get("bets") or []
+    if not bets:
+        raise HTTPException(status_code=400, detail="No se proporcionaron apuestas")
+    if len(bets) > MAX_PORTFOLIO_BETS:
+        raise HTTPException(status_code=400, detail=f"Máximo {MAX_PORTFOLIO_BETS} apuestas por cartera")
+
+    from kelly_portfolio import optimize_stakes
+
+    try:
+        return await asyncio.to_thread(
+            optimize_stakes,
+            bets,
+            bankroll=float(request.get("bankroll", 1000)),
+            fraction=float(request.get("fraccion_kelly", 0.25)),
+            max_bet_share=float(request.get("max_por_apuesta", 0.05)),
+            max_total_share=float(request.get("max_total", 0.25)),
+            scenarios=min(int(request.get("escenarios", 2000)), 10000),
+            seed=request.get("seed"),
+        )
+    except (KeyError, TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Apuestas inválidas: {str(e)}")
+
+def is_admin_token(token: Optional[str]) -> bool:
+    # headers arrive decoded as latin-1: compare the raw bytes (compare_digest rejects non-ASCII str)
+    return bool(ADMIN_TOKEN) and token is not None and hmac.compare_digest(token.encode("latin-1"), ADMIN_TOKEN.encode())
+
+async def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Only admins (X-Admin-Token) may use the profiling endpoints"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Perfilado no habilitado")
+    if not is_admin_token(x_admin_token):
+        raise HTTPException(status_code=403, detail="Acceso restringido a administradores")
+
+@api_router.post("/admin/perfil", dependencies=[Depends(require_admin)], response_class=PlainTextResponse)
+async def profile_worker(segundos: float = 10, intervalo_ms: float = 5, hilos: str = "bucle"):
+    """Perfilar el worker durante N segundos (salida en pilas plegadas para flamegraph)"""
+    if not 0 < segundos <= MAX_PROFILE_SECONDS:
+        raise HTTPException(status_code=400, detail=f"La duración debe estar entre 0 y {MAX_PROFILE_SECONDS} segundos")
+    if profiling_lock.locked():
+        raise HTTPException(status_code=409, detail="Ya hay un perfilado en curso")
+    
+    async with profiling_lock:
+        # This coroutine runs on the event-loop thread, which is what gets sampled by default
+        thread_ids = None if hilos == "todos" else [threading.get_ident()]
+        profiler = SamplingProfiler(interval=max(intervalo_ms, 1) / 1000, thread_ids=thread_ids)
+        profiler.start()
+        try:
+            await asyncio.sleep(segundos)
+        finally:
+            samples = profiler.stop()
+    return PlainTextResponse(folded_stacks(samples))
+
+@api_router.get("/admin/perfiles", dependencies=[Depends(require_admin)])
+async def list_request_profiles():
+    """Listar los perfiles de peticiones recientes (cabecera X-Profile)"""
+    return {"perfiles": request_profiles.summaries()}
+
+@api_router.get("/admin/perfiles/{profile_id}", dependencies=[Depends(require_admin)], response_class=PlainTextResponse)
+async def get_request_profile(profile_id: str):
+    """Obtener el perfil de una petición en pilas plegadas"""
+    profile = request_profiles.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Perfil no encontrado")
+    return PlainTextResponse(profile["folded"])
+
+@api_router.get("/admin/bucle", dependencies=[Depends(require_admin)])
+async def get_loop_lag():
+    """Obtener el retraso del bucle de eventos y el último bloqueo detectado"""
+    return loop_monitor.stats()
+
+@api_router.get("/admin/mongo-lentas", dependencies=[Depends(require_admin)])
+async def get_slow_queries():
+    """Obtener las consultas lentas recientes a MongoDB"""
+    return {"umbral_ms": slow_queries.threshold_ms, "consultas": list(reversed(slow_queries.recent))}
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+async def analytics_loop():
+    while True:
+        await asyncio.sleep(ANALYTICS_INTERVAL_SECONDS)
+        try:
+            await recommendation_analytics.run()
+        except Exception as e:
+            logger.warning(f"Error en la analítica de recomendaciones: {str(e)}")
+
+async def warm_up():
+    """Create indexes and warm caches without delaying the first response"""
+    global poisson_grid, history_origin
+    from candidate_pool import ensure_indexes as ensure_odds_indexes
+    
+    try:
+        await odds_timeseries.ensure_indexes()
+        await recommendation_analytics.ensure_indexes()
+        await analysis_cache.ensure_indexes()
+        await personalized_feeds.ensure_indexes()
+        await ensure_odds_indexes(db.odds_data)
+        for collection in (db.parlay_recommendations, db.mock_parlay_recommendations):
+            await collection.create_index([("generated_at", -1)], name="generated_at")
+        warmup_state["indices"] = True
+    except Exception as e:
+        logger.warning(f"Error creando índices: {str(e)}")
+    
+    try:
+        history_origin = await load_history_origin()
+    except Exception as e:
+        logger.warning(f"Error leyendo el historial: {str(e)}")
+    
+    try:
+        await sports_registry.load()
+        warmup_state["registro"] = True
+    except Exception as e:
+        logger.warning(f"Error cargando el registro de deportes: {str(e)}")
+    
+    for sport in WARM_SPORTS:
+        try:
+            await odds_snapshots.get(sport, load_sport_odds)
+        except Exception as e:
+            logger.warning(f"Error precargando odds de {sport}: {str(e)}")
+    warmup_state["snapshots"] = True
+    
+    if USE_POISSON_GRID:
+        try:
+            from poisson_grid import shared_grid
+            # mapped from disk; only the first worker on the host pays for building it
+            poisson_grid = await asyncio.to_thread(shared_grid)
+            from sport_models import MODELS, PoissonModel
+            MODELS.register("soccer", PoissonModel(grid=poisson_grid))
+        except Exception as e:
+            logger.warning(f"Error cargando la tabla de Poisson: {str(e)}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global client, db
+    client = AsyncIOMotorClient(mongo_url, event_listeners=[slow_queries])
+    db = client[os.environ['DB_NAME']]
+    init_services(db)
+    write_behind.start()
+    
+    background = [
+        asyncio.create_task(warm_up()),
+        asyncio.create_task(personalized_feeds.run()),
+        asyncio.create_task(sports_registry.run())
+    ]
+    if ANALYTICS_INTERVAL_SECONDS > 0:
+        background.append(asyncio.create_task(analytics_loop()))
+    if loop_monitor.threshold > 0:
+        background.append(asyncio.create_task(loop_monitor.run()))
+    
+    yield
+    
+    for task in background:
+        task.cancel()
+    # Durably write everything still buffered before the client goes away
+    await write_behind.close()
+    try:
+        await sports_registry.flush_requests()
+    except Exception as e:
+        logger.warning(f"Error guardando la demanda de ligas: {str(e)}")
+    client.close()
+
+# Create the main app without a prefix
+app = FastAPI(
+    title="TipStars App API",
+    description="API para análisis inteligente de apuestas deportivas",
+    lifespan=lifespan
+)
+
 # Include the router in the main app
 app.include_router(api_router)
 
+# Per-request profiling for admins (X-Profile: 1 | todos), results under /api/admin/perfiles
+app.add_middleware(RequestProfilingMiddleware, store=request_profiles, is_admin=is_admin_token)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -454,14 +916,3 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
-
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
\ No newline at end of file
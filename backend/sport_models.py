@@ -0,0 +1,679 @@
+"""
+sport_models.py
+===============
+
+Pluggable, vectorized pricing models per sport.
+
+Every engine implements the same two-step interface over a batch of events
+(:class:`EventMarkets`, one array entry per event):
+
+* ``fit(markets)`` – sport-specific parameters calibrated to the margin-free
+  market consensus (moneyline, spread line, total line and over price);
+* ``price(params, markets)`` – model probabilities, always including
+  ``home``/``draw``/``away`` (``draw`` is 0 where the sport has no draws)
+  plus the extra markets the model can price.
+
+The engines:
+
+* ``soccer`` – :class:`PoissonModel`: independent Poisson goals fitted to the
+  1X2 prices by Newton's method; prices 1X2, over/under the event's line and
+  both teams to score.
+* ``basketball`` – :class:`NormalMarginModel`: normal margin whose median sits
+  on the spread line and whose scale reproduces the moneyline, and a normal
+  total; prices the moneyline, spread cover and totals.
+* ``americanfootball`` – :class:`SkellamMarginModel`: the margin is a Skellam
+  difference of Poisson "scoring units" of ``unit`` points, which keeps the
+  lumpy, discrete NFL margins; ties go half to each side (overtime).  The
+  total and the mean margin are solved on the lattice for the over price and
+  the moneyline.
+* ``tennis`` – :class:`TennisMarkovModel`: point → game → set (tie-break at
+  6-6) → match Markov chain on the serve-point probabilities of both players,
+  fitted to the moneyline; prices straight sets and total sets, best of 5 for
+  men's Grand Slams.
+* ``esports`` – :class:`BradleyTerryModel`: Bradley–Terry ratings fitted
+  jointly over every match in the batch, so teams playing several matches
+  pool their prices; each match is priced from its own consensus shrunk
+  towards the joint ratings, within a tolerance; exposes Elo-scaled ratings
+  and best-of-3 map markets.
+
+:class:`ModelRegistry` maps sports to engines and prices a mixed batch in one
+pass, one vectorized call per sport.  Sports without an engine (or whose
+engine fails) are left as NaN, so callers can fall back to the consensus.
+
+Example usage::
+
+    markets = EventMarkets.from_consensus(home=h, draw=d, away=a, ...)
+    prices = MODELS.price(markets, sports=["soccer", "tennis", ...])
+    prices["home"], prices["over"], prices["cover_home"]
+
+"""
+
+from __future__ import annotations
+
+import logging
+import math
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+Prices = Dict[str, np.ndarray]
+
+# keeps logits and inverse CDFs finite
+EPSILON = 1e-6
+
+# men's Grand Slams are played best of five sets
+GRAND_SLAMS = ("aus_open", "french_open", "wimbledon", "us_open")
+
+
+# -- vectorized helpers ---------------------------------------------------------------
+
+
+def normal_cdf(x: np.ndarray) -> np.ndarray:
+    """Standard normal CDF (Abramowitz–Stegun 7.1.26, absolute error below 1.5e-7)."""
+    x = np.asarray(x, dtype=np.float64)
+    z = np.abs(x) / math.sqrt(2.0)
+    t = 1.0 / (1.0 + 0.3275911 * z)
+    poly = t * (0.254829592 + t * (-0.284496736 + t * (1.421413741 + t * (-1.453152027 + t * 1.061405429))))
+    tail = 0.5 * poly * np.exp(-z * z)
+    return np.where(x >= 0, 1.0 - tail, tail)
+
+
+def normal_ppf(p: np.ndarray) -> np.ndarray:
+    """Inverse standard normal CDF (Acklam's rational approximation, relative error 1.2e-9)."""
+    p = np.clip(np.asarray(p, dtype=np.float64), EPSILON, 1 - EPSILON)
+    a = (-3.969683028665376e01, 2.209460984245205e02, -2.759285104469687e02,
+         1.383577518672690e02, -3.066479806614716e01, 2.506628277459239e00)
+    b = (-5.447609879822406e01, 1.615858368580409e02, -1.556989798598866e02,
+         6.680131188771972e01, -1.328068155288572e01)
+    c = (-7.784894002430293e-03, -3.223964580411365e-01, -2.400758277161838e00,
+         -2.549732539343734e00, 4.374664141464968e00, 2.938163982698783e00)
+    d = (7.784695709041462e-03, 3.224671290700398e-01, 2.445134137142996e00, 3.754408661907416e00)
+    low = 0.02425
+    q = np.sqrt(-2 * np.log(np.where(p < 0.5, p, 1 - p)))
+    tail = (((((c[0] * q + c[1]) * q + c[2]) * q + c[3]) * q + c[4]) * q + c[5]) / (
+        (((d[0] * q + d[1]) * q + d[2]) * q + d[3]) * q + 1
+    )
+    r = (p - 0.5) ** 2
+    central = (p - 0.5) * (((((a[0] * r + a[1]) * r + a[2]) * r + a[3]) * r + a[4]) * r + a[5]) / (
+        ((((b[0] * r + b[1]) * r + b[2]) * r + b[3]) * r + b[4]) * r + 1
+    )
+    return np.where(p < low, tail, np.where(p > 1 - low, -tail, central))
+
+
+def poisson_pmf(mean: np.ndarray, max_count: int) -> np.ndarray:
+    """``P(k)`` for ``k = 0..max_count``, one row per mean."""
+    mean = np.maximum(np.asarray(mean, dtype=np.float64), EPSILON)
+    k = np.arange(max_count + 1)
+    log_factorial = np.array([math.lgamma(i + 1) for i in k])
+    return np.exp(k * np.log(mean)[..., None] - mean[..., None] - log_factorial)
+
+
+def lattice_tail(pmf: np.ndarray, offset: int, threshold: np.ndarray) -> np.ndarray:
+    """``P(X > threshold)`` for an integer variable, spreading each point over ``[k - ½, k + ½]``.
+
+    With the mass of ``k`` spread uniformly, a threshold on the lattice
+    (``k``) counts half of ``P(X = k)`` – a push or a tie split in two – and
+    non-integer lines interpolate linearly, so integer-valued models can
+    price any half or whole line.
+
+    Args:
+        pmf: ``(events, values)`` probabilities of ``offset, offset + 1, ...``.
+        offset: value of the first column.
+        threshold: one threshold per event, in lattice units.
+    """
+    values = offset + np.arange(pmf.shape[-1])
+    weight = np.clip(values + 0.5 - np.asarray(threshold, dtype=np.float64)[..., None], 0.0, 1.0)
+    return (pmf * weight).sum(axis=-1)
+
+
+def bisect(function: Callable[[np.ndarray], np.ndarray], target: np.ndarray, low: float, high: float,
+           iterations: int = 40) -> np.ndarray:
+    """Solve ``function(x) = target`` per event for an increasing ``function``."""
+    target = np.asarray(target, dtype=np.float64)
+    lower = np.full(target.shape, low)
+    upper = np.full(target.shape, high)
+    for _ in range(iterations):
+        middle = (lower + upper) / 2
+        below = function(middle) < target
+        lower = np.where(below, middle, lower)
+        upper = np.where(below, upper, middle)
+    return (lower + upper) / 2
+
+
+def _no_draw(home: np.ndarray, away: np.ndarray) -> np.ndarray:
+    """Two-way home probability from consensus prices that may include a draw."""
+    return home / (home + away)
+
+
+def _two_way(home: np.ndarray) -> Prices:
+    return {"home": home, "draw": np.zeros_like(home), "away": 1.0 - home}
+
+
+# -- batch of events ------------------------------------------------------------------
+
+
+@dataclass(slots=True)
+class EventMarkets:
+    """Margin-free market consensus of a batch of events (NaN where not quoted)."""
+
+    home: np.ndarray
+    draw: np.ndarray
+    away: np.ndarray
+    spread: np.ndarray  # home handicap in points, negative when the home side is favoured
+    total: np.ndarray  # total points / goals line
+    over: np.ndarray  # probability of the over at ``total``
+    home_team: List[str]
+    away_team: List[str]
+    league: List[Optional[str]]
+
+    def __len__(self) -> int:
+        return len(self.home)
+
+    @classmethod
+    def from_consensus(
+        cls,
+        home: Sequence[float],
+        away: Sequence[float],
+        home_team: Sequence[str],
+        away_team: Sequence[str],
+        draw: Optional[Sequence[float]] = None,
+        spread: Optional[Sequence[float]] = None,
+        total: Optional[Sequence[float]] = None,
+        over: Optional[Sequence[float]] = None,
+        league: Optional[Sequence[Optional[str]]] = None,
+    ) -> "EventMarkets":
+        home = np.asarray(home, dtype=np.float64)
+        missing = np.full(len(home), np.nan)
+
+        def column(values) -> np.ndarray:
+            return missing.copy() if values is None else np.asarray(values, dtype=np.float64)
+
+        return cls(
+            home=home,
+            draw=column(draw),
+            away=np.asarray(away, dtype=np.float64),
+            spread=column(spread),
+            total=column(total),
+            over=column(over),
+            home_team=list(home_team),
+            away_team=list(away_team),
+            league=list(league) if league is not None else [None] * len(home),
+        )
+
+    def take(self, index: np.ndarray) -> "EventMarkets":
+        return EventMarkets(
+            home=self.home[index],
+            draw=self.draw[index],
+            away=self.away[index],
+            spread=self.spread[index],
+            total=self.total[index],
+            over=self.over[index],
+            home_team=[self.home_team[i] for i in index],
+            away_team=[self.away_team[i] for i in index],
+            league=[self.league[i] for i in index],
+        )
+
+
+class SportModel(ABC):
+    """Interface of a pricing engine: calibrate to the market, then price."""
+
+    @abstractmethod
+    def fit(self, markets: EventMarkets) -> Dict[str, np.ndarray]:
+        """Parameters of every event, calibrated to its consensus."""
+
+    @abstractmethod
+    def price(self, params: Dict[str, np.ndarray], markets: EventMarkets) -> Prices:
+        """Model probabilities of every event from fitted parameters."""
+
+    def evaluate(self, markets: EventMarkets) -> Prices:
+        return self.price(self.fit(markets), markets)
+
+
+# -- soccer ---------------------------------------------------------------------------
+
+
+class PoissonModel(SportModel):
+    """Independent Poisson goals, fitted to 1X2 with Newton's method."""
+
+    def __init__(self, default_line: float = 2.5, iterations: int = 8, grid=None) -> None:
+        self.default_line = default_line
+        self.iterations = iterations
+        # optional poisson_grid.PoissonGrid: interpolated instead of exact 1X2 sums
+        self.grid = grid
+
+    def _one_x_two(self, lambda_home: np.ndarray, lambda_away: np.ndarray) -> Prices:
+        if self.grid is not None:
+            return self.grid.lookup(lambda_home, lambda_away, ("home", "draw", "away"))
+        from poisson_grid import exact_markets
+
+        return exact_markets(lambda_home, lambda_away)
+
+    def fit(self, markets: EventMarkets) -> Dict[str, np.ndarray]:
+        total = markets.home + np.nan_to_num(markets.draw) + markets.away
+        target_home = markets.home / total
+        target_away = markets.away / total
+        lambda_home = np.full(len(markets), 1.4)
+        lambda_away = np.full(len(markets), 1.1)
+        step = 1e-4
+        for _ in range(self.iterations):
+            base = self._one_x_two(lambda_home, lambda_away)
+            shifted_home = self._one_x_two(lambda_home + step, lambda_away)
+            shifted_away = self._one_x_two(lambda_home, lambda_away + step)
+            f_home = base["home"] - target_home
+            f_away = base["away"] - target_away
+            # 2x2 Jacobian of (P(home), P(away)) with respect to (lambda_home, lambda_away)
+            a = (shifted_home["home"] - base["home"]) / step
+            b = (shifted_away["home"] - base["home"]) / step
+            c = (shifted_home["away"] - base["away"]) / step
+            d = (shifted_away["away"] - base["away"]) / step
+            det = a * d - b * c
+            det = np.where(np.abs(det) < EPSILON, EPSILON, det)
+            lambda_home = np.clip(lambda_home - (d * f_home - b * f_away) / det, 0.05, 6.0)
+            lambda_away = np.clip(lambda_away - (a * f_away - c * f_home) / det, 0.05, 6.0)
+        valid = np.isfinite(target_home) & np.isfinite(target_away)
+        return {
+            "lambda_home": np.where(valid, lambda_home, np.nan),
+            "lambda_away": np.where(valid, lambda_away, np.nan),
+        }
+
+    def price(self, params: Dict[str, np.ndarray], markets: EventMarkets) -> Prices:
+        lambda_home = params["lambda_home"]
+        lambda_away = params["lambda_away"]
+        valid = np.isfinite(lambda_home)
+        safe_home = np.where(valid, lambda_home, 1.0)
+        safe_away = np.where(valid, lambda_away, 1.0)
+        prices = dict(self._one_x_two(safe_home, safe_away))
+        prices = {name: prices[name] for name in ("home", "draw", "away")}
+        line = np.where(np.isfinite(markets.total), markets.total, self.default_line)
+        goals = poisson_pmf(safe_home + safe_away, int(np.ceil(line.max(initial=self.default_line))) + 15)
+        prices["over"] = lattice_tail(goals, 0, line)
+        prices["under"] = 1.0 - prices["over"]
+        prices["btts"] = -np.expm1(-safe_home) * -np.expm1(-safe_away)
+        return {name: np.where(valid, values, np.nan) for name, values in prices.items()}
+
+
+# -- basketball / american football ---------------------------------------------------
+
+
+class NormalMarginModel(SportModel):
+    """Normal home margin and total points."""
+
+    def __init__(self, sigma_margin: float, sigma_total: float, default_total: float) -> None:
+        self.sigma_margin = sigma_margin
+        self.sigma_total = sigma_total
+        self.default_total = default_total
+
+    def _fit_margin(self, moneyline: np.ndarray, spread_margin: np.ndarray, total: np.ndarray):
+        """Mean margin and its scale per event, reproducing the moneyline wherever it is quoted.
+
+        The spread line is where the market puts the median margin; the scale
+        that also gives the quoted moneyline is ``margin / ppf(moneyline)``,
+        kept between half and twice the sport's default.  Where it had to be
+        clamped the margin gives way, so the moneyline is always matched.
+        """
+        z = normal_ppf(moneyline)
+        sigma = np.full(len(moneyline), self.sigma_margin)
+        usable = np.isfinite(spread_margin) & np.isfinite(z) & (spread_margin * z > 0) & (np.abs(z) > 0.05)
+        sigma[usable] = np.clip(spread_margin[usable] / z[usable], 0.5 * self.sigma_margin, 2 * self.sigma_margin)
+        margin = np.where(np.isfinite(z), sigma * z, spread_margin)
+        return margin, sigma
+
+    def _fit_total(self, line: np.ndarray, over: np.ndarray) -> np.ndarray:
+        return line + self.sigma_total * normal_ppf(over)
+
+    def fit(self, markets: EventMarkets) -> Dict[str, np.ndarray]:
+        moneyline = _no_draw(markets.home, markets.away)
+        over = np.where(np.isfinite(markets.over), markets.over, 0.5)
+        quoted = np.isfinite(markets.total)
+        total = np.full(len(markets), float(self.default_total))
+        if quoted.any():
+            total[quoted] = self._fit_total(markets.total[quoted], over[quoted])
+        margin, sigma = self._fit_margin(moneyline, -markets.spread, total)
+        return {"margin": margin, "sigma": sigma, "total": total}
+
+    def _margin_above(self, params: Dict[str, np.ndarray], threshold: np.ndarray) -> np.ndarray:
+        return 1.0 - normal_cdf((threshold - params["margin"]) / params["sigma"])
+
+    def _total_above(self, params: Dict[str, np.ndarray], line: np.ndarray) -> np.ndarray:
+        return 1.0 - normal_cdf((line - params["total"]) / self.sigma_total)
+
+    def price(self, params: Dict[str, np.ndarray], markets: EventMarkets) -> Prices:
+        margin = params["margin"]
+        prices = _two_way(self._margin_above(params, np.zeros_like(margin)))
+        spread = np.where(np.isfinite(markets.spread), markets.spread, -np.round(margin * 2) / 2)
+        line = np.where(np.isfinite(markets.total), markets.total, np.round(params["total"] * 2) / 2)
+        # home covers when margin + spread > 0
+        prices["cover_home"] = self._margin_above(params, -spread)
+        prices["cover_away"] = 1.0 - prices["cover_home"]
+        prices["over"] = self._total_above(params, line)
+        prices["under"] = 1.0 - prices["over"]
+        valid = np.isfinite(margin)
+        return {name: np.where(valid, values, np.nan) for name, values in prices.items()}
+
+
+class SkellamMarginModel(NormalMarginModel):
+    """Margin as a Skellam difference of Poisson scoring units of ``unit`` points.
+
+    With ``unit`` points per score the margin has standard deviation
+    ``sqrt(unit * total)`` (about 13.3 points for 4-point units and a
+    44-point total, close to the NFL's), and its mass sits on multiples of
+    ``unit`` instead of being smooth.
+    """
+
+    def __init__(self, unit: float, sigma_total: float, default_total: float, max_units: int = 40) -> None:
+        super().__init__(math.sqrt(unit * default_total), sigma_total, default_total)
+        self.unit = unit
+        self.max_units = max_units
+
+    def _rates(self, params: Dict[str, np.ndarray]):
+        total = np.maximum(params["total"], np.abs(params["margin"]) + self.unit)
+        rate_home = np.maximum((total + params["margin"]) / (2 * self.unit), 0.05)
+        rate_away = np.maximum((total - params["margin"]) / (2 * self.unit), 0.05)
+        return rate_home, rate_away
+
+    def _difference_pmf(self, rate_home: np.ndarray, rate_away: np.ndarray) -> np.ndarray:
+        """``P(X - Y = d)`` for ``d = -max_units..max_units``."""
+        home = poisson_pmf(rate_home, self.max_units)
+        # reversed away pmf: column k holds P(Y = max_units - k), so the convolution is indexed by d + max_units
+        away = poisson_pmf(rate_away, self.max_units)[:, ::-1]
+        size = 2 * self.max_units + 1
+        length = 1 << (size - 1).bit_length()
+        difference = np.fft.irfft(np.fft.rfft(home, length) * np.fft.rfft(away, length), length)[:, :size]
+        return np.maximum(difference, 0.0)
+
+    def _margin_above(self, params: Dict[str, np.ndarray], threshold: np.ndarray) -> np.ndarray:
+        rate_home, rate_away = self._rates(params)
+        pmf = self._difference_pmf(rate_home, rate_away)
+        return lattice_tail(pmf, -self.max_units, np.asarray(threshold) / self.unit)
+
+    def _total_above(self, params: Dict[str, np.ndarray], line: np.ndarray) -> np.ndarray:
+        rate_home, rate_away = self._rates(params)
+        pmf = poisson_pmf(rate_home + rate_away, 2 * self.max_units)
+        return lattice_tail(pmf, 0, line / self.unit)
+
+    def _fit_margin(self, moneyline: np.ndarray, spread_margin: np.ndarray, total: np.ndarray):
+        # the lattice's scale is fixed by the unit and the total: the mean margin alone
+        # is solved for the moneyline; the spread only places events without one
+        valid = np.isfinite(moneyline)
+        target = np.where(valid, moneyline, 0.5)
+        margin = bisect(
+            lambda m: self._margin_above({"margin": m, "total": total}, np.zeros_like(m)),
+            target,
+            low=-3 * self.sigma_margin,
+            high=3 * self.sigma_margin,
+            iterations=30,
+        )
+        return np.where(valid, margin, spread_margin), np.full(len(moneyline), self.sigma_margin)
+
+    def _fit_total(self, line: np.ndarray, over: np.ndarray) -> np.ndarray:
+        # priced on the Poisson lattice, so fitted on it too (a normal fit leaves the over near 0.48)
+        return bisect(
+            lambda t: self._total_above({"margin": np.zeros_like(t), "total": t}, line),
+            over,
+            low=self.unit,
+            high=2 * self.max_units * self.unit,
+            iterations=30,
+        )
+
+
+# -- tennis ---------------------------------------------------------------------------
+
+
+def _hold(p: np.ndarray) -> np.ndarray:
+    """Probability that the server holds, given the point-on-serve probability."""
+    q = 1.0 - p
+    return p ** 4 * (1 + 4 * q + 10 * q ** 2) + 20 * (p * q) ** 3 * p ** 2 / (1 - 2 * p * q)
+
+
+def _tiebreak(serve_a: np.ndarray, serve_b: np.ndarray) -> np.ndarray:
+    """Probability that A wins a tie-break in which A serves first (ABBAAB... order)."""
+    states = {(0, 0): np.ones_like(serve_a)}
+    won = np.zeros_like(serve_a)
+    for played in range(12):
+        a_serves = ((played + 1) // 2) % 2 == 0
+        point = serve_a if a_serves else 1.0 - serve_b
+        for a in range(max(0, played - 6), min(played, 6) + 1):
+            mass = states.pop((a, played - a), None)
+            if mass is None:
+                continue
+            for next_state, probability in (((a + 1, played - a), point), ((a, played - a + 1), 1.0 - point)):
+                if next_state[0] == 7:
+                    won = won + mass * probability
+                elif next_state[1] < 7:
+                    states[next_state] = states.get(next_state, 0.0) + mass * probability
+    # from 6-6 every pair of points has one serve each: first to lead by two
+    a_pair = serve_a * (1.0 - serve_b)
+    b_pair = (1.0 - serve_a) * serve_b
+    return won + states[(6, 6)] * a_pair / (a_pair + b_pair)
+
+
+def _set(serve_a: np.ndarray, serve_b: np.ndarray, a_serves_first: bool) -> np.ndarray:
+    """Probability that A wins a set (tie-break at 6-6)."""
+    hold_a = _hold(serve_a)
+    hold_b = _hold(serve_b)
+    states = {(0, 0): np.ones_like(serve_a)}
+    won = np.zeros_like(serve_a)
+    for played in range(12):
+        a_serves = (played % 2 == 0) == a_serves_first
+        game = hold_a if a_serves else 1.0 - hold_b
+        for a in range(max(0, played - 6), min(played, 6) + 1):
+            mass = states.pop((a, played - a), None)
+            if mass is None:
+                continue
+            for (games_a, games_b), probability in (((a + 1, played - a), game), ((a, played - a + 1), 1.0 - game)):
+                if games_a >= 6 and games_a - games_b >= 2:
+                    won = won + mass * probability
+                elif not (games_b >= 6 and games_b - games_a >= 2):
+                    states[(games_a, games_b)] = states.get((games_a, games_b), 0.0) + mass * probability
+    # game 13 is served by whoever served the first game
+    tiebreak = _tiebreak(serve_a, serve_b) if a_serves_first else 1.0 - _tiebreak(serve_b, serve_a)
+    return won + states[(6, 6)] * tiebreak
+
+
+def _sets_to_win(set_a: np.ndarray, needed: int) -> Dict[int, np.ndarray]:
+    """``P(A wins needed-l)`` for every number ``l`` of sets lost."""
+    return {
+        lost: math.comb(needed - 1 + lost, lost) * set_a ** needed * (1.0 - set_a) ** lost
+        for lost in range(needed)
+    }
+
+
+class TennisMarkovModel(SportModel):
+    """Point/game/set/match Markov chain on both players' serve-point probabilities."""
+
+    def __init__(self, serve_atp: float = 0.64, serve_wta: float = 0.56) -> None:
+        self.serve_atp = serve_atp
+        self.serve_wta = serve_wta
+
+    def _best_of(self, markets: EventMarkets) -> np.ndarray:
+        return np.array([
+            5 if league and "atp" in league and any(slam in league for slam in GRAND_SLAMS) else 3
+            for league in markets.league
+        ])
+
+    @staticmethod
+    def _set_probability(serve_home: np.ndarray, serve_away: np.ndarray) -> np.ndarray:
+        # who serves first in each set alternates in practice: average both orders
+        return 0.5 * (_set(serve_home, serve_away, True) + _set(serve_home, serve_away, False))
+
+    def _match(self, set_home: np.ndarray, best_of: np.ndarray) -> np.ndarray:
+        three = sum(_sets_to_win(set_home, 2).values())
+        five = sum(_sets_to_win(set_home, 3).values())
+        return np.where(best_of == 5, five, three)
+
+    def fit(self, markets: EventMarkets) -> Dict[str, np.ndarray]:
+        base = np.array([self.serve_wta if league and "wta" in league else self.serve_atp for league in markets.league])
+        best_of = self._best_of(markets)
+        moneyline = _no_draw(markets.home, markets.away)
+        valid = np.isfinite(moneyline)
+
+        def match_probability(edge: np.ndarray) -> np.ndarray:
+            serve_home = np.clip(base + edge / 2, 0.3, 0.95)
+            serve_away = np.clip(base - edge / 2, 0.3, 0.95)
+            return self._match(self._set_probability(serve_home, serve_away), best_of)
+
+        edge = bisect(match_probability, np.where(valid, moneyline, 0.5), -0.5, 0.5, iterations=30)
+        return {
+            "serve_home": np.where(valid, np.clip(base + edge / 2, 0.3, 0.95), np.nan),
+            "serve_away": np.where(valid, np.clip(base - edge / 2, 0.3, 0.95), np.nan),
+            "best_of": best_of,
+        }
+
+    def price(self, params: Dict[str, np.ndarray], markets: EventMarkets) -> Prices:
+        valid = np.isfinite(params["serve_home"])
+        serve_home = np.where(valid, params["serve_home"], 0.6)
+        serve_away = np.where(valid, params["serve_away"], 0.6)
+        best_of = params["best_of"]
+        set_home = self._set_probability(serve_home, serve_away)
+        needed = np.where(best_of == 5, 3, 2)
+        prices = _two_way(self._match(set_home, best_of))
+        prices["set_home"] = set_home
+        prices["home_straight_sets"] = set_home ** needed
+        prices["away_straight_sets"] = (1.0 - set_home) ** needed
+        # more sets than the minimum, e.g. over 2.5 sets in a best of three
+        prices["over_sets"] = 1.0 - prices["home_straight_sets"] - prices["away_straight_sets"]
+        return {name: np.where(valid, values, np.nan) for name, values in prices.items()}
+
+
+# -- esports --------------------------------------------------------------------------
+
+
+class BradleyTerryModel(SportModel):
+    """Bradley–Terry series ratings fitted jointly over the batch (Elo scale exposed).
+
+    The joint fit pools the prices of teams playing several matches but can
+    contradict a match's own price (thin esports markets, stale lines), so a
+    match's log-odds are its de-margined consensus moved ``pooling`` of the way
+    towards the joint ratings, and never more than ``tolerance`` away from it.
+    """
+
+    ELO_SCALE = 400 / math.log(10)
+
+    def __init__(self, ridge: float = 1e-3, pooling: float = 0.3, tolerance: float = 0.2) -> None:
+        # keeps each connected group of teams identifiable without shrinking the prices noticeably
+        self.ridge = ridge
+        self.pooling = pooling
+        self.tolerance = tolerance  # in log-odds: 0.2 moves an even match to at most 55%
+
+    def fit(self, markets: EventMarkets) -> Dict[str, np.ndarray]:
+        moneyline = np.clip(_no_draw(markets.home, markets.away), EPSILON, 1 - EPSILON)
+        valid = np.isfinite(moneyline)
+        teams: Dict[str, int] = {}
+        home = np.array([teams.setdefault(name, len(teams)) for name in markets.home_team], dtype=np.intp)
+        away = np.array([teams.setdefault(name, len(teams)) for name in markets.away_team], dtype=np.intp)
+        logit = np.log(moneyline / (1 - moneyline))
+
+        # least squares on logit(p) = r_home - r_away: normal equations of the signed incidence matrix
+        normal = self.ridge * np.eye(len(teams))
+        rhs = np.zeros(len(teams))
+        h, a, y = home[valid], away[valid], logit[valid]
+        np.add.at(normal, (h, h), 1.0)
+        np.add.at(normal, (a, a), 1.0)
+        np.add.at(normal, (h, a), -1.0)
+        np.add.at(normal, (a, h), -1.0)
+        np.add.at(rhs, h, y)
+        np.add.at(rhs, a, -y)
+        ratings = np.linalg.solve(normal, rhs) if len(teams) else np.zeros(0)
+
+        rating_home = np.where(valid, ratings[home], np.nan) if len(teams) else np.zeros(0)
+        rating_away = np.where(valid, ratings[away], np.nan) if len(teams) else np.zeros(0)
+        pooled = np.clip(self.pooling * (rating_home - rating_away - logit), -self.tolerance, self.tolerance)
+        return {
+            "difference": logit + pooled,
+            "rating_home": rating_home,
+            "rating_away": rating_away,
+            "elo_home": 1500 + self.ELO_SCALE * rating_home,
+            "elo_away": 1500 + self.ELO_SCALE * rating_away,
+        }
+
+    def price(self, params: Dict[str, np.ndarray], markets: EventMarkets) -> Prices:
+        valid = np.isfinite(params["difference"])
+        difference = np.where(valid, params["difference"], 0.0)
+        series = 1.0 / (1.0 + np.exp(-difference))
+        prices = _two_way(series)
+        # best-of-three series: P(series) = m²(3 - 2m) for a per-map probability m
+        per_map = bisect(lambda m: m * m * (3 - 2 * m), series, 0.0, 1.0, iterations=40)
+        prices["map_home"] = per_map
+        prices["home_2_0"] = per_map ** 2
+        prices["away_2_0"] = (1.0 - per_map) ** 2
+        prices["over_maps"] = 1.0 - prices["home_2_0"] - prices["away_2_0"]
+        return {name: np.where(valid, values, np.nan) for name, values in prices.items()}
+
+
+# -- registry -------------------------------------------------------------------------
+
+
+class ModelRegistry:
+    """Pricing engine per sport; prices mixed batches one sport at a time."""
+
+    def __init__(self) -> None:
+        self.models: Dict[str, SportModel] = {}
+
+    def register(self, sport: str, model: SportModel) -> SportModel:
+        self.models[sport] = model
+        return model
+
+    def get(self, sport: str) -> Optional[SportModel]:
+        return self.models.get(sport)
+
+    def __contains__(self, sport: str) -> bool:
+        return sport in self.models
+
+    def price(self, markets: EventMarkets, sports: Sequence[str]) -> Prices:
+        """Model probabilities for every event; NaN for sports without an engine.
+
+        Args:
+            markets: consensus of all events, any mix of sports.
+            sports: the sport of each event.
+
+        Returns:
+            A dict mapping each market priced by at least one engine to an
+            array with one entry per event.
+        """
+        sports = np.asarray(sports, dtype=object)
+        prices: Prices = {}
+        for sport in dict.fromkeys(sports.tolist()):
+            model = self.models.get(sport)
+            if model is None:
+                continue
+            index = np.flatnonzero(sports == sport)
+            try:
+                sport_prices = model.evaluate(markets.take(index))
+            except Exception as e:
+                logger.warning(f"Error en el modelo de {sport}: {str(e)}")
+                continue
+            for name, values in sport_prices.items():
+                prices.setdefault(name, np.full(len(markets), np.nan))[index] = values
+        return prices
+
+
+def default_registry(grid=None) -> ModelRegistry:
+    """The engines for the sports of ``SPORTS_CONFIG``."""
+    registry = ModelRegistry()
+    registry.register("soccer", PoissonModel(grid=grid))
+    registry.register("basketball", NormalMarginModel(sigma_margin=12.0, sigma_total=18.0, default_total=225.0))
+    registry.register("americanfootball", SkellamMarginModel(unit=4.0, sigma_total=13.0, default_total=44.0))
+    registry.register("tennis", TennisMarkovModel())
+    registry.register("esports", BradleyTerryModel())
+    return registry
+
+
+MODELS = default_registry()
+
+
+__all__ = [
+    "BradleyTerryModel",
+    "EventMarkets",
+    "MODELS",
+    "ModelRegistry",
+    "NormalMarginModel",
+    "PoissonModel",
+    "SkellamMarginModel",
+    "SportModel",
+    "TennisMarkovModel",
+    "default_registry",
+]
@@ -0,0 +1,352 @@
+"""
+sports_registry.py
+==================
+
+Registry of the leagues polled for each sport.
+
+The hard-coded ``SPORTS_CONFIG`` in ``server.py`` is only used as a seed.  The
+registry syncs the league list from TheOddsAPI ``/v4/sports`` endpoint (which
+does not count against the request quota) at most once per TTL and persists
+one document per league in the ``sports_registry`` collection, so restarts
+reuse the cached list.
+
+For every league it records:
+
+* ``active`` – whether TheOddsAPI currently lists the league as active;
+* ``in_season`` – cleared when a fetch returns no events and restored on the
+  next sync, so empty leagues stop consuming quota between syncs;
+* demand statistics – how often users asked for the league, when, and how
+  many events the last fetch returned.  Only user requests
+  (:meth:`SportsRegistry.record_request`) count as demand; our own polling
+  (:meth:`SportsRegistry.record_fetch`) does not, or every polled league
+  would keep itself polled.  A client counts once per league per
+  ``demand_interval`` (auto-polling frontends are not extra demand) and the
+  counts are kept in memory and written by :meth:`SportsRegistry.run` in one
+  ``bulk_write`` per interval.
+
+:meth:`SportsRegistry.leagues_for` returns the leagues worth polling for a
+sport: active, in season and not outright-only, seeded leagues first, then
+leagues users asked for by demand, capped at ``max_leagues_per_sport``.  Other
+leagues the API lists are only polled with ``poll_unrequested=True``.  Each league carries its own
+market list, which drives the ``markets`` parameter of odds requests.
+
+Example usage::
+
+    registry = SportsRegistry(db.sports_registry, SPORTS_CONFIG, ODDS_API_KEY)
+    await registry.load()
+    for league in registry.leagues_for("soccer"):
+        params["markets"] = ",".join(league.markets)
+
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+SPORTS_URL = "https://api.the-odds-api.com/v4/sports"
+
+# markets with a parser in the odds pipeline
+SUPPORTED_MARKETS = ("h2h", "spreads", "totals")
+
+
+@dataclass(slots=True)
+class League:
+    """One TheOddsAPI league ("sport key" in their terminology)."""
+
+    key: str
+    sport: str
+    title: str
+    active: bool = True
+    in_season: bool = True
+    has_outrights: bool = False
+    seeded: bool = False
+    markets: List[str] = field(default_factory=lambda: ["h2h"])
+    requests: int = 0
+    last_requested_at: Optional[datetime] = None
+    last_event_count: Optional[int] = None
+
+    @property
+    def pollable(self) -> bool:
+        return self.active and self.in_season and not self.has_outrights
+
+    def to_public(self) -> Dict[str, Any]:
+        return {
+            "key": self.key,
+            "title": self.title,
+            "active": self.active,
+            "in_season": self.in_season,
+            "markets": self.markets,
+        }
+
+
+def sport_for_league(league_key: str, sports: Dict[str, Any]) -> Optional[str]:
+    """Map a league key such as ``soccer_epl`` to one of our sports by prefix."""
+    prefix = league_key.split("_", 1)[0]
+    return prefix if prefix in sports else None
+
+
+class SportsRegistry:
+    """Lazily synced, persisted league registry."""
+
+    def __init__(
+        self,
+        collection,
+        seed_config: Dict[str, Dict[str, Any]],
+        api_key: Optional[str],
+        ttl: timedelta = timedelta(hours=12),
+        max_leagues_per_sport: int = 5,
+        poll_unrequested: bool = False,
+        demand_interval: float = 300.0,
+    ) -> None:
+        self.collection = collection
+        self.seed_config = seed_config
+        self.api_key = api_key
+        self.ttl = ttl
+        self.max_leagues_per_sport = max_leagues_per_sport
+        self.poll_unrequested = poll_unrequested
+        self.demand_interval = demand_interval
+        self._seen: Dict[Tuple[Optional[str], str], datetime] = {}
+        self._unsaved: Dict[str, int] = {}
+        self.leagues: Dict[str, League] = {}
+        self.synced_at: Optional[datetime] = None
+        self.etag = ""
+        self._loaded = False
+        self._lock = asyncio.Lock()
+        self._seed()
+
+    def _seed(self) -> None:
+        for sport, config in self.seed_config.items():
+            for key in config["api_keys"]:
+                self.leagues[key] = League(
+                    key=key, sport=sport, title=key, seeded=True, markets=list(config["markets"])
+                )
+        self._refresh_etag()
+
+    def _refresh_etag(self) -> None:
+        payload = json.dumps(self.public_config(), sort_keys=True, default=str).encode()
+        self.etag = '"' + hashlib.sha1(payload).hexdigest()[:16] + '"'
+
+    @property
+    def sports(self) -> Dict[str, Dict[str, Any]]:
+        return self.seed_config
+
+    def is_stale(self, now: Optional[datetime] = None) -> bool:
+        now = now or datetime.utcnow()
+        return self.synced_at is None or now - self.synced_at > self.ttl
+
+    async def load(self) -> None:
+        """Restore persisted leagues and sync with TheOddsAPI if the cache is stale."""
+        async with self._lock:
+            if not self._loaded:
+                docs = await self.collection.find().to_list(None)
+                for doc in docs:
+                    self._apply_document(doc)
+                synced = [doc["synced_at"] for doc in docs if doc.get("synced_at")]
+                self.synced_at = max(synced) if synced else None
+                self._loaded = True
+                self._refresh_etag()
+        await self.ensure_fresh()
+
+    async def ensure_fresh(self) -> None:
+        """Sync the league list when the TTL has expired.
+
+        Failures are logged and the previous (or seeded) list keeps being used
+        until the next attempt.
+        """
+        if not self.is_stale() or not self.api_key:
+            return
+        async with self._lock:
+            if not self.is_stale():
+                return
+            try:
+                await self.sync()
+            except Exception as e:
+                # retry after a shorter delay instead of on every request
+                self.synced_at = datetime.utcnow() - self.ttl + timedelta(minutes=5)
+                logger.warning(f"Error sincronizando deportes: {str(e)}")
+
+    async def sync(self) -> None:
+        async with httpx.AsyncClient() as client:
+            response = await client.get(SPORTS_URL, params={"apiKey": self.api_key, "all": "true"}, timeout=10)
+            response.raise_for_status()
+            remote = response.json()
+
+        now = datetime.utcnow()
+        listed = set()
+        updates = []
+        for item in remote:
+            sport = sport_for_league(item["key"], self.seed_config)
+            if sport is None:
+                continue
+            listed.add(item["key"])
+            league = self.leagues.get(item["key"])
+            if league is None:
+                league = self.leagues[item["key"]] = League(
+                    key=item["key"], sport=sport, title=item.get("title", item["key"]),
+                    markets=list(self.seed_config[sport]["markets"]),
+                )
+            league.title = item.get("title", league.title)
+            league.active = bool(item.get("active"))
+            league.has_outrights = bool(item.get("has_outrights"))
+            league.in_season = league.active
+            updates.append(self._meta_update(league, now))
+
+        # seeded leagues no longer listed by the API are kept but never polled
+        for league in self.leagues.values():
+            if league.key not in listed and league.seeded:
+                league.active = False
+                updates.append(self._meta_update(league, now))
+
+        if updates:
+            await self.collection.bulk_write(updates, ordered=False)
+        self.synced_at = now
+        self._refresh_etag()
+
+    @staticmethod
+    def _meta_update(league: League, now: datetime) -> UpdateOne:
+        return UpdateOne(
+            {"_id": league.key},
+            {
+                "$set": {
+                    "sport": league.sport,
+                    "title": league.title,
+                    "active": league.active,
+                    "in_season": league.in_season,
+                    "has_outrights": league.has_outrights,
+                    "seeded": league.seeded,
+                    "synced_at": now,
+                },
+                "$setOnInsert": {"markets": league.markets, "user_requests": 0},
+            },
+            upsert=True,
+        )
+
+    def _apply_document(self, doc: Dict[str, Any]) -> None:
+        league = self.leagues.get(doc["_id"])
+        if league is None:
+            if doc.get("sport") not in self.seed_config:
+                return
+            league = self.leagues[doc["_id"]] = League(key=doc["_id"], sport=doc["sport"], title=doc.get("title", doc["_id"]))
+        league.title = doc.get("title", league.title)
+        league.active = doc.get("active", league.active)
+        league.in_season = doc.get("in_season", league.in_season)
+        league.has_outrights = doc.get("has_outrights", league.has_outrights)
+        league.markets = [m for m in doc.get("markets", league.markets) if m in SUPPORTED_MARKETS] or ["h2h"]
+        # "requests" used to count our own polling too and is ignored
+        league.requests = doc.get("user_requests", 0)
+        league.last_requested_at = doc.get("last_user_request_at")
+        league.last_event_count = doc.get("last_event_count")
+
+    def leagues_for(self, sport: str) -> List[League]:
+        """Leagues worth polling for ``sport``, most relevant first."""
+        candidates = [
+            league
+            for league in self.leagues.values()
+            if league.sport == sport and league.pollable
+            and (league.seeded or league.requests > 0 or self.poll_unrequested)
+        ]
+        candidates.sort(key=lambda league: (not league.seeded, -league.requests, league.key))
+        return candidates[: self.max_leagues_per_sport]
+
+    def record_request(self, league_key: str, client: Optional[str] = None) -> bool:
+        """Count a user request for a league, once per client per ``demand_interval``.
+
+        Requested leagues become pollable.  Nothing is written here: the counts
+        are saved by :meth:`flush_requests`.  Returns whether the request counted.
+        """
+        league = self.leagues.get(league_key)
+        if league is None:
+            return False
+        now = datetime.utcnow()
+        seen = self._seen.get((client, league_key))
+        if seen is not None and (now - seen).total_seconds() < self.demand_interval:
+            return False
+        self._seen[(client, league_key)] = now
+        league.requests += 1
+        league.last_requested_at = now
+        self._unsaved[league_key] = self._unsaved.get(league_key, 0) + 1
+        if league.requests == 1 and not league.seeded:
+            self._refresh_etag()
+        return True
+
+    async def flush_requests(self) -> int:
+        """Write the demand counted since the previous flush in one ``bulk_write``."""
+        now = datetime.utcnow()
+        self._seen = {
+            key: seen for key, seen in self._seen.items() if (now - seen).total_seconds() < self.demand_interval
+        }
+        unsaved, self._unsaved = self._unsaved, {}
+        if not unsaved:
+            return 0
+        try:
+            await self.collection.bulk_write(
+                [
+                    UpdateOne(
+                        {"_id": key},
+                        {"$inc": {"user_requests": count}, "$set": {"last_user_request_at": self.leagues[key].last_requested_at}},
+                        upsert=True,
+                    )
+                    for key, count in unsaved.items()
+                ],
+                ordered=False,
+            )
+        except Exception:
+            # keep the counts for the next flush
+            for key, count in unsaved.items():
+                self._unsaved[key] = self._unsaved.get(key, 0) + count
+            raise
+        return len(unsaved)
+
+    async def run(self) -> None:
+        """Save the counted demand once per ``demand_interval``."""
+        while True:
+            await asyncio.sleep(self.demand_interval)
+            try:
+                await self.flush_requests()
+            except Exception as e:
+                logger.warning(f"Error guardando la demanda de ligas: {str(e)}")
+
+    async def record_fetch(self, league_key: str, event_count: int) -> None:
+        """Record how many events a fetch of a league's odds returned.
+
+        A fetch that returns no events marks the league out of season until
+        the next registry sync.  Fetches are not demand: see :meth:`record_request`.
+        """
+        league = self.leagues.get(league_key)
+        if league is None:
+            return
+        league.last_event_count = event_count
+        update: Dict[str, Any] = {"$set": {"last_event_count": event_count}}
+        if event_count == 0 and league.in_season:
+            league.in_season = False
+            update["$set"]["in_season"] = False
+            self._refresh_etag()
+        await self.collection.update_one({"_id": league_key}, update, upsert=True)
+
+    def public_config(self) -> Dict[str, Dict[str, Any]]:
+        """Supported sports in the ``SPORTS_CONFIG`` shape, with live league lists."""
+        config = {}
+        for sport, seed in self.seed_config.items():
+            leagues = self.leagues_for(sport)
+            config[sport] = {
+                "name": seed["name"],
+                "emoji": seed["emoji"],
+                "api_keys": [league.key for league in leagues],
+                "markets": sorted({market for league in leagues for market in league.markets}) or seed["markets"],
+                "ligas": [league.to_public() for league in leagues],
+            }
+        return config
+
+
+__all__ = ["League", "SportsRegistry", "sport_for_league"]
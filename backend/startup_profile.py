@@ -0,0 +1,124 @@
+"""
+startup_profile.py
+==================
+
+Cold-start profile of the FastAPI app.
+
+Runs two measurements, each in a fresh interpreter so nothing is cached:
+
+1. ``python -X importtime -c "import server"`` – import time per module,
+   aggregated by top-level package and sorted by self time.
+2. Time to first response – interpreter start → ``import server`` → lifespan
+   startup → first request answered (in process, through httpx's ASGI
+   transport, so no network or uvicorn overhead is included).
+
+Run from the ``backend`` directory::
+
+    python startup_profile.py --top 20 --path /api/health/live
+
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import subprocess
+import sys
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+ROOT_DIR = Path(__file__).parent
+
+FIRST_RESPONSE_SCRIPT = """
+import time
+started = time.perf_counter()
+import asyncio
+import httpx
+import server
+imported = time.perf_counter()
+
+async def main():
+    async with server.app.router.lifespan_context(server.app):
+        ready = time.perf_counter()
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://profile") as client:
+            response = await client.get({path!r})
+        done = time.perf_counter()
+    print(f"{{(imported - started) * 1000:.1f}} {{(ready - imported) * 1000:.1f}} {{(done - ready) * 1000:.1f}} {{response.status_code}}")
+
+asyncio.run(main())
+"""
+
+
+def import_times(module: str = "server") -> List[Tuple[str, float, float]]:
+    """Return ``(package, self_ms, cumulative_ms)`` per top-level package."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT_DIR, capture_output=True, text=True, env=os.environ.copy(),
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+
+    self_us: Dict[str, int] = defaultdict(int)
+    cumulative_us: Dict[str, int] = defaultdict(int)
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_part, cumulative_part, name = line[len("import time:"):].split("|")
+        name = name[1:]  # the indentation encodes the nesting depth
+        depth = (len(name) - len(name.lstrip())) // 2
+        entries.append((depth, name.strip().split(".")[0], int(self_part), int(cumulative_part)))
+
+    # importtime prints children before their parent; walk backwards to see parents first
+    parents: List[str] = []
+    for depth, package, self_time, cumulative in reversed(entries):
+        del parents[depth:]
+        self_us[package] += self_time
+        # count a package's cumulative time only where another package imported it
+        if not parents or parents[-1] != package:
+            cumulative_us[package] += cumulative
+        parents.append(package)
+    rows = [(package, self_us[package] / 1000, cumulative_us[package] / 1000) for package in self_us]
+    return sorted(rows, key=lambda row: row[1], reverse=True)
+
+
+def time_to_first_response(path: str = "/api/health/live") -> Dict[str, float]:
+    """Measure import, startup and first-request time in a fresh interpreter."""
+    result = subprocess.run(
+        [sys.executable, "-c", FIRST_RESPONSE_SCRIPT.format(path=path)],
+        cwd=ROOT_DIR, capture_output=True, text=True, env=os.environ.copy(),
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    import_ms, startup_ms, request_ms, status = result.stdout.split()[-4:]
+    return {
+        "import_ms": float(import_ms),
+        "startup_ms": float(startup_ms),
+        "first_request_ms": float(request_ms),
+        "total_ms": float(import_ms) + float(startup_ms) + float(request_ms),
+        "status": int(status),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Perfil de arranque de la API de TipStars")
+    parser.add_argument("--top", type=int, default=20, help="número de paquetes a mostrar")
+    parser.add_argument("--path", default="/api/health/live", help="ruta de la primera petición")
+    args = parser.parse_args()
+
+    print(f"{'paquete':<28}{'propio ms':>12}{'acumulado ms':>15}")
+    for package, self_ms, cumulative_ms in import_times()[: args.top]:
+        print(f"{package:<28}{self_ms:>12.1f}{cumulative_ms:>15.1f}")
+
+    timings = time_to_first_response(args.path)
+    print()
+    print(f"importación:      {timings['import_ms']:8.1f} ms")
+    print(f"arranque:         {timings['startup_ms']:8.1f} ms")
+    print(f"primera petición: {timings['first_request_ms']:8.1f} ms (HTTP {timings['status']})")
+    print(f"total:            {timings['total_ms']:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -77,6 +77,62 @@ def poisson_probabilities(lambda_home: float, lambda_away: float, max_goals: int
     return {"home": p_home / total, "draw": p_draw / total, "away": p_away / total}
 
 
+def implied_lambdas(
+    probabilities: Dict[str, float],
+    total_goals: float | None = None,
+    max_goals: int = 10,
+    iterations: int = 30,
+    grid=None,
+) -> Tuple[float, float]:
+    """Find Poisson goal expectations that reproduce given 1X2 probabilities.
+
+    The split between home and away goals is found by bisection so that
+    ``P(home) - P(away)`` matches.  When no ``total_goals`` is given the total
+    is also fitted, by bisection on the draw probability (more expected goals
+    means fewer draws).
+
+    Args:
+        probabilities: margin‑free probabilities with keys ``"home"``,
+            ``"draw"`` and ``"away"`` (see :func:`implied_probabilities`).
+        total_goals: expected total goals, if known (e.g. from a totals market).
+        max_goals: passed through to :func:`poisson_probabilities`.
+        iterations: bisection steps per search.
+        grid: optional :class:`poisson_grid.PoissonGrid`; its interpolated
+            ``poisson_probabilities`` replaces the exact sums (about 15x
+            faster, within ``poisson_grid.TOLERANCE``).
+
+    Returns:
+        A tuple ``(lambda_home, lambda_away)``.
+    """
+    target_diff = probabilities["home"] - probabilities["away"]
+    model = grid.poisson_probabilities if grid is not None else poisson_probabilities
+
+    def split(total: float) -> Tuple[float, float]:
+        low, high = 0.0, 1.0
+        for _ in range(iterations):
+            share = (low + high) / 2
+            probs = model(total * share, total * (1 - share), max_goals)
+            if probs["home"] - probs["away"] < target_diff:
+                low = share
+            else:
+                high = share
+        share = (low + high) / 2
+        return total * share, total * (1 - share)
+
+    if total_goals is not None:
+        return split(total_goals)
+
+    low, high = 0.2, 8.0
+    for _ in range(iterations):
+        total = (low + high) / 2
+        lambda_home, lambda_away = split(total)
+        if model(lambda_home, lambda_away, max_goals)["draw"] > probabilities["draw"]:
+            low = total
+        else:
+            high = total
+    return split((low + high) / 2)
+
+
 def fair_odds(probabilities: Dict[str, float]) -> Dict[str, float]:
     """Convert probabilities into fair decimal odds (without bookmaker margin).
 
@@ -89,6 +145,26 @@ def fair_odds(probabilities: Dict[str, float]) -> Dict[str, float]:
     return {outcome: (1.0 / prob if prob > 0 else float("inf")) for outcome, prob in probabilities.items()}
 
 
+def implied_probabilities(bookmaker_odds: Dict[str, float]) -> Dict[str, float]:
+    """Convert a complete set of bookmaker odds into margin‑free probabilities.
+
+    The raw implied probabilities ``1 / odds`` of a bookmaker sum to more than
+    1 (the overround).  They are normalised proportionally so they sum to 1.
+
+    Args:
+        bookmaker_odds: decimal odds for every mutually exclusive outcome of a
+            market, e.g. ``{"home": 2.1, "draw": 3.4, "away": 3.6}``.
+
+    Returns:
+        A dict mapping outcomes to probabilities.
+    """
+    raw = {outcome: 1.0 / odds for outcome, odds in bookmaker_odds.items() if odds and odds > 1.0}
+    total = sum(raw.values())
+    if total <= 0:
+        raise ValueError("No valid odds provided")
+    return {outcome: prob / total for outcome, prob in raw.items()}
+
+
 def expected_value(probabilities: Dict[str, float], bookmaker_odds: Dict[str, float]) -> Dict[str, float]:
     """Calculate expected value of a $1 stake on each outcome.
 
@@ -142,7 +218,9 @@ def select_value_bets(
 
 __all__ = [
     "poisson_probabilities",
+    "implied_lambdas",
     "fair_odds",
+    "implied_probabilities",
     "expected_value",
     "select_value_bets",
 ]
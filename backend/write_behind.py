@@ -0,0 +1,339 @@
+"""
+write_behind.py
+===============
+
+Write-behind buffering of MongoDB inserts.
+
+Endpoints that only need to *record* something (a generated recommendation,
+a favourite, a batch of odds rows) should not make the user wait for the
+insert.  :class:`WriteBehindQueue` buffers documents per collection and a
+background task writes them with unordered ``bulk_write`` calls:
+
+* a flush starts when ``max_batch`` documents are waiting or every
+  ``flush_interval`` seconds, whichever comes first;
+* when more than ``max_pending`` documents are waiting, producers wait for
+  the queue to drain (backpressure) instead of growing memory without bound;
+* each document is encoded to BSON (with its ``_id``) when queued: documents
+  that cannot be stored (unencodable values, over 16 MB) are rejected to the
+  caller with ``InvalidDocument`` instead of poisoning the queue, and a batch
+  retried after a network error cannot insert duplicates (duplicate-key
+  errors count as written); other per-document errors are logged and dropped;
+* a batch that keeps failing is retried at most ``max_attempts`` times, then
+  logged and dropped;
+* ``on_flush`` receives the documents of a ``put``/``put_many`` call once all
+  of them have been written, so a load split over several flushes is
+  reported once, complete;
+* :meth:`WriteBehind.close` drains everything with a journaled write
+  concern before the Mongo client is closed;
+* :meth:`WriteBehindQueue.pending` exposes the documents not written yet, so a
+  user reading right after a write still sees it (read-your-writes overlay).
+
+Example usage::
+
+    writes = WriteBehind()
+    favorites = writes.register("favoritos", db.favorites, flush_interval=0.5)
+    writes.start()
+    await favorites.put(favorite, key=user_id)
+    unflushed = favorites.pending(user_id)
+    await writes.close()
+
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional
+
+import bson
+from bson import ObjectId
+from bson.errors import InvalidDocument
+from bson.raw_bson import RawBSONDocument
+from pymongo import InsertOne
+from pymongo.errors import BulkWriteError, DocumentTooLarge
+from pymongo.write_concern import WriteConcern
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY = 11000
+
+# MongoDB's maximum BSON document size
+MAX_DOCUMENT_BYTES = 16 * 1024 * 1024
+
+# client-side errors: retrying the same document can never succeed
+UNWRITABLE = (InvalidDocument, OverflowError, DocumentTooLarge)
+
+# number of recent flushes kept for latency percentiles
+LATENCY_WINDOW = 256
+
+# longest pause of the flush loop while MongoDB keeps failing (seconds)
+MAX_BACKOFF = 30.0
+
+
+@dataclass(slots=True)
+class _Group:
+    """The documents of one ``put_many`` call, reported together once all are done."""
+
+    documents: List[Dict[str, Any]]
+    remaining: int
+
+
+@dataclass(slots=True)
+class _Pending:
+    document: Dict[str, Any]
+    key: Optional[str]
+    encoded: RawBSONDocument
+    group: _Group
+    attempts: int = 0
+
+
+def encode(document: Dict[str, Any], object_id: ObjectId) -> RawBSONDocument:
+    """BSON of ``document`` with ``_id``; raises ``InvalidDocument`` if MongoDB could not store it."""
+    try:
+        data = bson.encode({**document, "_id": object_id})
+    except (InvalidDocument, OverflowError) as e:
+        raise InvalidDocument(f"Documento no serializable: {str(e)}") from e
+    if len(data) > MAX_DOCUMENT_BYTES:
+        raise InvalidDocument(f"Documento demasiado grande ({len(data)} bytes)")
+    return RawBSONDocument(data)
+
+
+class WriteBehindQueue:
+    """Buffered inserts into one collection, flushed in unordered batches."""
+
+    def __init__(
+        self,
+        collection,
+        name: str,
+        max_batch: int = 500,
+        flush_interval: float = 0.5,
+        max_pending: int = 10_000,
+        max_attempts: int = 20,
+        on_flush: Optional[Callable[[List[Dict[str, Any]]], None]] = None,
+    ) -> None:
+        self.collection = collection
+        self.name = name
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self.on_flush = on_flush
+        self._queue: Deque[_Pending] = deque()
+        self._in_flight: List[_Pending] = []
+        self._flush_lock = asyncio.Lock()
+        self._batch_ready = asyncio.Event()
+        self._has_space = asyncio.Event()
+        self._has_space.set()
+        self._latencies: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self._stats = {
+            "enqueued": 0,
+            "written": 0,
+            "dropped": 0,
+            "flushes": 0,
+            "failed_flushes": 0,
+            "backpressure_waits": 0,
+        }
+
+    @property
+    def depth(self) -> int:
+        return len(self._queue) + len(self._in_flight)
+
+    @property
+    def retry_window(self) -> float:
+        """Longest time (seconds) a failing document is retried before being written or dropped."""
+        backoff = sum(min(self.flush_interval * 2 ** failures, MAX_BACKOFF) for failures in range(1, self.max_attempts + 1))
+        return self.flush_interval * self.max_attempts + backoff
+
+    async def put(self, document: Dict[str, Any], key: Optional[str] = None) -> None:
+        """Queue one document; waits only when the queue is over ``max_pending``."""
+        await self.put_many([document], key)
+
+    async def put_many(self, documents: Iterable[Dict[str, Any]], key: Optional[str] = None) -> None:
+        """Queue documents as one unit; raises ``InvalidDocument`` (queueing nothing) if one cannot be stored."""
+        documents = list(documents)
+        # encode before waiting: a rejected call never holds a place in the queue
+        encoded = [encode(document, ObjectId()) for document in documents]
+        if not documents:
+            return
+        if self.depth >= self.max_pending:
+            self._stats["backpressure_waits"] += 1
+        # re-checked after every wake-up: producers woken together may have refilled the queue
+        while self.depth >= self.max_pending:
+            self._has_space.clear()
+            self._batch_ready.set()
+            await self._has_space.wait()
+        group = _Group(documents, len(documents))
+        self._queue.extend(_Pending(document, key, raw, group) for document, raw in zip(documents, encoded))
+        self._stats["enqueued"] += len(documents)
+        if self.depth >= self.max_pending:
+            self._has_space.clear()
+        if len(self._queue) >= self.max_batch:
+            self._batch_ready.set()
+
+    def pending(self, key: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Documents queued but not yet written, oldest first (all keys when ``key`` is None)."""
+        return [
+            item.document
+            for item in (*self._in_flight, *self._queue)
+            if key is None or item.key == key
+        ]
+
+    async def flush(self, write_concern: Optional[WriteConcern] = None) -> int:
+        """Write up to ``max_batch`` queued documents; returns how many were written."""
+        async with self._flush_lock:
+            if not self._queue:
+                return 0
+            batch = [self._queue.popleft() for _ in range(min(self.max_batch, len(self._queue)))]
+            self._in_flight = batch
+            collection = self.collection
+            if write_concern is not None:
+                collection = collection.with_options(write_concern=write_concern)
+            started = time.perf_counter()
+            dropped = 0
+            try:
+                dropped = await self._write(collection, batch)
+            except BaseException:
+                # nothing is known to be written (this includes cancellation mid-write):
+                # put the batch back in front, keeping order; the fixed _ids make the retry safe
+                self._stats["failed_flushes"] += 1
+                retry = []
+                for item in batch:
+                    item.attempts += 1
+                    if item.attempts < self.max_attempts:
+                        retry.append(item)
+                if len(retry) < len(batch):
+                    given_up = [item for item in batch if item.attempts >= self.max_attempts]
+                    logger.error(f"{len(given_up)} documentos de {self.name} descartados tras {self.max_attempts} intentos")
+                    self._stats["dropped"] += len(given_up)
+                    self._complete(given_up)
+                self._queue.extendleft(reversed(retry))
+                if self.depth < self.max_pending:
+                    self._has_space.set()
+                raise
+            finally:
+                self._in_flight = []
+            self._latencies.append((time.perf_counter() - started) * 1000)
+            self._stats["flushes"] += 1
+            self._stats["written"] += len(batch) - dropped
+            self._stats["dropped"] += dropped
+            if self.depth < self.max_pending:
+                self._has_space.set()
+            self._complete(batch)
+        return len(batch) - dropped
+
+    async def _write(self, collection, batch: List[_Pending]) -> int:
+        """Insert ``batch`` unordered; returns the number of documents dropped."""
+        try:
+            await collection.bulk_write([InsertOne(item.encoded) for item in batch], ordered=False)
+        except BulkWriteError as e:
+            # unordered: everything but the reported documents was written
+            dropped = 0
+            for error in e.details.get("writeErrors", []):
+                if error.get("code") != DUPLICATE_KEY:
+                    dropped += 1
+                    logger.warning(f"Documento descartado en {self.name}: {error.get('errmsg')}")
+            return dropped
+        except UNWRITABLE as e:
+            if len(batch) == 1:
+                logger.warning(f"Documento descartado en {self.name}: {str(e)}")
+                return 1
+            # documents are validated when queued, so this is rare: isolate the culprit one by one
+            dropped = 0
+            for item in batch:
+                dropped += await self._write(collection, [item])
+            return dropped
+        return 0
+
+    def _complete(self, items: List[_Pending]) -> None:
+        """Report the ``put_many`` groups whose last document is now done (written or dropped)."""
+        if self.on_flush is None:
+            return
+        finished = []
+        for item in items:
+            item.group.remaining -= 1
+            if item.group.remaining == 0:
+                finished.extend(item.group.documents)
+        if finished:
+            try:
+                self.on_flush(finished)
+            except Exception as e:
+                logger.warning(f"Error tras escribir {self.name}: {str(e)}")
+
+    async def run(self) -> None:
+        """Flush loop: by size or by interval, backing off while Mongo is failing."""
+        failures = 0
+        while True:
+            try:
+                await asyncio.wait_for(self._batch_ready.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._batch_ready.clear()
+            try:
+                while await self.flush() and len(self._queue) >= self.max_batch:
+                    pass
+                failures = 0
+            except Exception as e:
+                failures += 1
+                logger.warning(f"Error escribiendo {self.name} ({self.depth} pendientes): {str(e)}")
+                await asyncio.sleep(min(self.flush_interval * 2 ** failures, MAX_BACKOFF))
+
+    async def drain(self, attempts: int = 3) -> None:
+        """Write everything still queued with a journaled write concern."""
+        durable = WriteConcern(j=True)
+        for attempt in range(attempts):
+            try:
+                while self._queue:
+                    await self.flush(durable)
+                return
+            except Exception as e:
+                logger.warning(f"Error vaciando {self.name} (intento {attempt + 1}): {str(e)}")
+                await asyncio.sleep(0.5 * 2 ** attempt)
+        if self._queue:
+            logger.error(f"{len(self._queue)} documentos de {self.name} no se pudieron escribir")
+
+    def metrics(self) -> Dict[str, Any]:
+        latencies = sorted(self._latencies)
+        return {
+            "cola": self.depth,
+            **self._stats,
+            "flush_ms_ultimo": round(self._latencies[-1], 2) if latencies else None,
+            "flush_ms_medio": round(sum(latencies) / len(latencies), 2) if latencies else None,
+            "flush_ms_p95": round(latencies[int(0.95 * (len(latencies) - 1))], 2) if latencies else None,
+            "flush_ms_max": round(latencies[-1], 2) if latencies else None,
+        }
+
+
+class WriteBehind:
+    """The write-behind queues of the app, started and drained together."""
+
+    def __init__(self) -> None:
+        self.queues: Dict[str, WriteBehindQueue] = {}
+        self._tasks: List[asyncio.Task] = []
+
+    def register(self, name: str, collection, **options: Any) -> WriteBehindQueue:
+        queue = WriteBehindQueue(collection, name, **options)
+        self.queues[name] = queue
+        return queue
+
+    def __getitem__(self, name: str) -> WriteBehindQueue:
+        return self.queues[name]
+
+    def start(self) -> None:
+        self._tasks = [asyncio.create_task(queue.run()) for queue in self.queues.values()]
+
+    async def close(self) -> None:
+        """Stop the flush loops and durably write whatever is still queued."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await asyncio.gather(*(queue.drain() for queue in self.queues.values()))
+
+    def metrics(self) -> Dict[str, Dict[str, Any]]:
+        return {name: queue.metrics() for name, queue in self.queues.items()}
+
+
+__all__ = ["WriteBehind", "WriteBehindQueue"]
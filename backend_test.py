@@ -54,23 +54,23 @@ class BackendTester:
                 data = response.json()
                 
                 # Verify response structure
-                if "odds" in data and "total_games" in data:
-                    odds_count = len(data["odds"])
+                if "games" in data and "total_games" in data:
+                    odds_count = len(data["games"])
                     total_games = data["total_games"]
                     
-                    self.log(f"✅ Odds API successful: {odds_count} odds entries, {total_games} total games")
+                    self.log(f"✅ Odds API successful: {odds_count} games on this page, {total_games} total games")
                     
                     # Verify odds data structure
                     if odds_count > 0:
-                        sample_odds = data["odds"][0]
-                        required_fields = ["home_team", "away_team", "home_odds", "away_odds", "bookmaker"]
+                        sample_odds = data["games"][0]
+                        required_fields = ["home_team", "away_team", "commence_time", "bookmakers", "prices", "best"]
                         
                         missing_fields = [field for field in required_fields if field not in sample_odds]
                         if not missing_fields:
                             self.log("✅ Odds data structure is valid")
                             self.test_results["odds_api"] = {
                                 "status": "success", 
-                                "details": f"Successfully fetched {odds_count} odds entries from {total_games} games"
+                                "details": f"Successfully fetched {odds_count} of {total_games} games"
                             }
                             return True
                         else:
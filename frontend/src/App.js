@@ -778,7 +778,10 @@ const EmptyState = ({ title, description, action, onAction }) => (
 function App() {
   const [selectedSport, setSelectedSport] = useState('soccer');
   const [odds, setOdds] = useState([]);
+  const [totalGames, setTotalGames] = useState(0);
+  const [nextOffset, setNextOffset] = useState(null);
   const [loading, setLoading] = useState(false);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [selectedBets, setSelectedBets] = useState([]);
   const [showApiModal, setShowApiModal] = useState(false);
   const [userApiKey, setUserApiKey] = useState(localStorage.getItem('openai_api_key') || '');
@@ -809,19 +812,43 @@ function App() {
   const fetchOdds = async (sport = selectedSport) => {
     setLoading(true);
     try {
-      const response = await axios.get(`${API}/odds/${sport}`, { timeout: 15000 });
-      setOdds(response.data.odds || []);
+      // One entry per game, sorted by kick-off, with the best price per outcome
+      const response = await axios.get(`${API}/odds/${sport}`, { params: { limite: 30 }, timeout: 15000 });
+      setOdds(response.data.games || []);
+      setTotalGames(response.data.total_games || 0);
+      setNextOffset(response.data.next_offset ?? null);
     } catch (error) {
       console.error('Error obteniendo odds:', error);
       setOdds([]);
+      setTotalGames(0);
+      setNextOffset(null);
     } finally {
       setLoading(false);
     }
   };
 
+  const fetchMoreOdds = async () => {
+    if (nextOffset === null) return;
+    setLoadingMore(true);
+    try {
+      const response = await axios.get(`${API}/odds/${selectedSport}`, {
+        params: { limite: 30, offset: nextOffset },
+        timeout: 15000
+      });
+      setOdds(prev => [...prev, ...(response.data.games || [])]);
+      setNextOffset(response.data.next_offset ?? null);
+    } catch (error) {
+      console.error('Error obteniendo más odds:', error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const handleSportChange = (sport) => {
     setSelectedSport(sport);
     setOdds([]);
+    setTotalGames(0);
+    setNextOffset(null);
     setSelectedBets([]);
     fetchOdds(sport);
   };
@@ -1029,7 +1056,7 @@ function App() {
                 gap: '8px'
               }}>
                 <span>📊</span>
-                {odds.length} Juegos Disponibles
+                {totalGames} Juegos Disponibles
               </span>
             </div>
           </div>
@@ -1068,23 +1095,44 @@ function App() {
                 `}</style>
               </div>
             ) : odds.length > 0 ? (
+              <>
                         <div style={{ display: 'grid', gridTemplateColumns: 'repeat(auto-fit, minmax(250px, 1fr))', gap: '16px' }}>
-            {odds.map((odd, index) => (
-              <div key={index} style={{ border: '1px solid #e5e7eb', borderRadius: '12px', padding: '16px', backgroundColor: 'white', boxShadow: '0 4px 6px rgba(0, 0, 0, 0.05)' }}>
+            {odds.map((game, index) => (
+              <div key={game.event_id || index} style={{ border: '1px solid #e5e7eb', borderRadius: '12px', padding: '16px', backgroundColor: 'white', boxShadow: '0 4px 6px rgba(0, 0, 0, 0.05)' }}>
                 <div style={{ fontWeight: 'bold', fontSize: '16px', marginBottom: '8px' }}>
-                  {odd.home_team} vs {odd.away_team}
+                  {game.home_team} vs {game.away_team}
                 </div>
                 <div style={{ fontSize: '12px', color: '#6b7280', marginBottom: '8px' }}>
-                  Inicio: {new Date(odd.commence_time).toLocaleString()}
+                  Inicio: {new Date(game.commence_time).toLocaleString()} · {game.bookmakers.length} casas
                 </div>
                 <div style={{ display: 'flex', gap: '8px', fontSize: '14px', color: '#374151' }}>
-                  <span>Local: {odd.home_odds}</span>
-                  <span>Visitante: {odd.away_odds}</span>
-                  {odd.draw_odds ? <span>Empate: {odd.draw_odds}</span> : null}
+                  {game.best.home ? <span title={game.best.home.bookmaker}>Local: {game.best.home.odds}</span> : null}
+                  {game.best.away ? <span title={game.best.away.bookmaker}>Visitante: {game.best.away.odds}</span> : null}
+                  {game.best.draw ? <span title={game.best.draw.bookmaker}>Empate: {game.best.draw.odds}</span> : null}
                 </div>
               </div>
             ))}
           </div>
+              {nextOffset !== null ? (
+                <div style={{ display: 'flex', justifyContent: 'center', marginTop: '16px' }}>
+                  <button
+                    onClick={fetchMoreOdds}
+                    disabled={loadingMore}
+                    style={{
+                      background: 'linear-gradient(135deg, #facc15, #eab308)',
+                      color: '#1f2937',
+                      padding: '10px 20px',
+                      borderRadius: '50px',
+                      border: 'none',
+                      fontWeight: 'bold',
+                      cursor: loadingMore ? 'wait' : 'pointer'
+                    }}
+                  >
+                    {loadingMore ? 'Cargando...' : `Ver más juegos (${odds.length} de ${totalGames})`}
+                  </button>
+                </div>
+              ) : null}
+              </>
             ) : (
               <EmptyState
                 title="No hay odds disponibles"